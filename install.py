@@ -1904,7 +1904,8 @@ def install_required_distro_packages(distro: Distro,
                    'python3-dev intltool g++ exiv2 build-essential ' \
                    'python3-wheel python3-setuptools gir1.2-gexiv2-0.10 libxkbcommon-x11-0 ' \
                    'python3-gi gir1.2-gudev-1.0 gir1.2-udisks-2.0 gir1.2-notify-0.7 '\
-                   'gir1.2-glib-2.0 gir1.2-gstreamer-1.0 gir1.2-gdkpixbuf-2.0 zenity ' \
+                   'gir1.2-glib-2.0 gir1.2-gstreamer-1.0 gir1.2-gst-plugins-base-1.0 ' \
+                   'gir1.2-gdkpixbuf-2.0 zenity ' \
                    'libqt5x11extras5 libxcb-xinerama0 '
 
         if install_pyqt5:
@@ -2157,7 +2158,8 @@ def install_required_distro_packages(distro: Distro,
                                    'python3-psutil python3-tornado python3-Babel ' \
                                    'typelib-1_0-GExiv2-0_10 typelib-1_0-UDisks-2_0 ' \
                                    'typelib-1_0-Notify-0_7 ' \
-                                   'typelib-1_0-Gst-1_0 typelib-1_0-GUdev-1_0 ' \
+                                   'typelib-1_0-Gst-1_0 typelib-1_0-GstVideo-1_0 ' \
+                                   'typelib-1_0-GUdev-1_0 ' \
                                    'python3-gphoto2 python3-arrow'
 
             packages = '{} {}'.format(packages, base_python_packages)
@@ -23,11 +23,14 @@ __copyright__ = "Copyright 2011-2017, Damon Lynch"
 
 import pickle
 import os
+import io
 import errno
-import hashlib
 from datetime import datetime
 import shutil
 import logging
+import queue
+import threading
+from contextlib import contextmanager
 import locale
 try:
     # Use the default locale as defined by the LANG variable
@@ -35,11 +38,12 @@ try:
 except locale.Error:
     pass
 
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List, Dict, Iterator, Union
 
 
 from raphodo.interprocess import (BackupFileData, BackupResults, BackupArguments,
-                          WorkerInPublishPullPipeline)
+                          WorkerInPublishPullPipeline, BackupDestination)
+from raphodo.serialization import encode_message
 from raphodo.copyfiles import FileCopy
 from raphodo.constants import (FileType, DownloadStatus, BackupStatus)
 from raphodo.rpdfile import RPDFile
@@ -48,14 +52,108 @@ from raphodo.cache import FdoCacheNormal, FdoCacheLarge
 from raphodo.copyfiles import copy_file_metadata
 from raphodo.problemnotification import (
     BackingUpProblems, BackupSubfolderCreationProblem, make_href, BackupOverwrittenProblem,
-    BackupAlreadyExistsProblem, FileWriteProblem
+    BackupAlreadyExistsProblem, FileWriteProblem, FileVerificationProblem, FileCopyProblem
 )
 from raphodo.storage import get_uri
+from raphodo.utilities import new_checksum, file_checksum
+
+
+class BackupDestinationState:
+    """
+    State of a backup device, when one worker backs up to several devices
+    """
+
+    def __init__(self, path: str, device_name: str) -> None:
+        self.path = path
+        self.device_name = device_name
+        self.uri = get_uri(path=path)
+        self.problems = BackingUpProblems(name=device_name, uri=self.uri)
+        self.total_downloaded = 0
+        self.bytes_downloaded = 0
+        self.amount_downloaded = 0
+
+
+class BackupWriter(threading.Thread):
+    """
+    Write a file to a backup device, chunk by chunk, in a thread of its own so
+    that each backup device is written to at its own pace.
+
+    An empty chunk indicates the end of the file. An exception indicates the
+    source file could not be read, and is reported as the writer's error.
+
+    Only the writer's thread sets its error, so read it only once the thread
+    has finished.
+    """
+
+    def __init__(self, device_id: int, destination: str, max_chunks: int) -> None:
+        super().__init__(daemon=True)
+        self.device_id = device_id
+        self.destination = destination
+        self.chunks = queue.Queue(maxsize=max_chunks)  # type: queue.Queue
+        self.amount_written = 0
+        self.error = None  # type: Optional[Exception]
+
+    def put(self, chunk: Union[bytes, Exception], timeout: float=0.1) -> bool:
+        """
+        Queue a chunk to be written, waiting for room in the queue
+
+        :param chunk: the chunk, or the error reading the source file
+        :param timeout: maximum time in seconds to wait for room in the queue
+        :return: False if the queue was full for the duration of the timeout,
+         else True
+        """
+
+        try:
+            self.chunks.put(chunk, timeout=timeout)
+        except queue.Full:
+            return False
+        return True
+
+    def run(self) -> None:
+        try:
+            dest = io.open(self.destination, 'wb')
+        except (OSError, FileNotFoundError, PermissionError) as e:
+            self.error = e
+            dest = None
+
+        while True:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                if self.error is None:
+                    self.error = chunk
+                break
+            if not chunk:
+                break
+            # Once an error has occurred, keep taking chunks from the queue, so
+            # the reader is never blocked
+            if self.error is None:
+                try:
+                    dest.write(chunk)
+                except (OSError, PermissionError) as e:
+                    self.error = e
+                else:
+                    self.amount_written += len(chunk)
+
+        if dest is not None:
+            try:
+                dest.close()
+            except (OSError, PermissionError) as e:
+                if self.error is None:
+                    self.error = e
+        if self.error is not None:
+            logging.error(
+                "%s. Failed to write backup file %s", self.error, self.destination
+            )
 
 
 class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
     def __init__(self):
         self.problems = BackingUpProblems()
+        # Used only when backing up to several devices at once (fan out)
+        self.fan_out = False
+        # Number of chunks that can be queued for a device before reading waits for it
+        self.fan_out_max_chunks = 16
+        self.destinations = {}  # type: Dict[int, BackupDestinationState]
         super().__init__('BackupFiles')
 
     def update_progress(self, amount_downloaded, total):
@@ -63,12 +161,11 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         chunk_downloaded = amount_downloaded - self.bytes_downloaded
         if (chunk_downloaded > self.batch_size_bytes) or (amount_downloaded == total):
             self.bytes_downloaded = amount_downloaded
-            self.content= pickle.dumps(BackupResults(
+            self.content = encode_message(BackupResults(
                 scan_id=self.scan_id,
                 device_id=self.device_id,
                 total_downloaded=self.total_downloaded + amount_downloaded,
-                chunk_downloaded=chunk_downloaded),
-               pickle.HIGHEST_PROTOCOL)
+                chunk_downloaded=chunk_downloaded))
             self.send_message_to_sink()
 
             # if amount_downloaded == total:
@@ -95,106 +192,204 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             # ignore any metadata copying errors
             copy_file_metadata(full_file_name, full_dest_name)
 
-    def do_backup(self, data: BackupFileData) -> None:
+    def prepare_backup(self, data: BackupFileData) -> Tuple[str, str, bool]:
+        """
+        Create the subfolder on the backup device, if necessary, and check whether
+        the backup file already exists.
+
+        :return: the backup folder, the backup file name including its path, and
+         whether the file should be copied
+        """
+
+        rpd_file = data.rpd_file
+        self.total_reached = False
+
+        if data.path_suffix is None:
+            dest_base_dir = self.path
+        else:
+            dest_base_dir = os.path.join(self.path, data.path_suffix)
+
+        dest_dir = os.path.join(dest_base_dir, rpd_file.download_subfolder)
+        backup_full_file_name = os.path.join(dest_dir, rpd_file.download_name)
+
+        if not os.path.isdir(dest_dir):
+            # create the subfolders on the backup path
+            try:
+                logging.debug("Creating subfolder %s on backup device %s...",
+                              dest_dir, self.device_name)
+                os.makedirs(dest_dir)
+                logging.debug("...backup subfolder created")
+            except (OSError, PermissionError, FileNotFoundError) as inst:
+                # There is a minuscule chance directory may have been
+                # created by another process between the time it
+                # takes to query and the time it takes to create a
+                # new directory. Ignore that error.
+                if inst.errno != errno.EEXIST:
+                    logging.error("Failed to create backup subfolder: %s",
+                                  rpd_file.download_path)
+                    logging.error(inst)
+
+                    self.problems.append(
+                        BackupSubfolderCreationProblem(
+                            folder=make_href(
+                                name=rpd_file.download_subfolder, uri=get_uri(path=dest_dir)
+                            ),
+                            exception=inst
+                        )
+                    )
+
+        backup_already_exists = os.path.exists(backup_full_file_name)
+
+        if backup_already_exists:
+            try:
+                modification_time = os.path.getmtime(backup_full_file_name)
+                dt = datetime.fromtimestamp(modification_time)
+                date = dt.strftime("%x")
+                time = dt.strftime("%X")
+            except Exception:
+                logging.error("Could not determine the file modification time of %s",
+                              backup_full_file_name)
+                date = time = ''
+
+            source = rpd_file.get_souce_href()
+            device = make_href(name=rpd_file.device_display_name, uri=rpd_file.device_uri)
+
+            if data.backup_duplicate_overwrite:
+                self.problems.append(BackupOverwrittenProblem(
+                    file_type_capitalized=rpd_file.title_capitalized,
+                    file_type=rpd_file.title,
+                    name=rpd_file.download_name,
+                    uri=get_uri(full_file_name=backup_full_file_name),
+                    source=source,
+                    device=device,
+                    date=date,
+                    time=time
+                ))
+                msg = "Overwriting backup file %s" % backup_full_file_name
+            else:
+                self.problems.append(BackupAlreadyExistsProblem(
+                    file_type_capitalized=rpd_file.title_capitalized,
+                    file_type=rpd_file.title,
+                    name=rpd_file.download_name,
+                    uri=get_uri(full_file_name=backup_full_file_name),
+                    source=source,
+                    device=device,
+                    date=date,
+                    time=time
+                ))
+                msg = "Skipping backup of file %s because it already exists" % \
+                      backup_full_file_name
+            logging.warning(msg)
+
+        copy_file = not backup_already_exists or data.backup_duplicate_overwrite
+        return dest_dir, backup_full_file_name, copy_file
+
+    def verify_backup(self, rpd_file: RPDFile, backup_full_file_name: str,
+                      checksum: Optional[str]) -> bool:
+        """
+        Read the backup file back, and compare its checksum to the checksum
+        calculated while the file was being copied from the device, so the
+        downloaded file need not be read again. If the file has no checksum,
+        use the checksum calculated while it was being read to back it up.
+
+        :param checksum: checksum calculated while reading the downloaded file
+         to back it up, if any
+        :return: True if the backup was verified or could not be verified
+         because no checksum was calculated, else False
+        """
+
+        expected = rpd_file.checksum if rpd_file.checksum is not None else checksum
+        if expected is None:
+            logging.warning(
+                "Could not verify backup file %s because it has no checksum",
+                backup_full_file_name
+            )
+            return True
+
+        try:
+            if file_checksum(backup_full_file_name, self.checksum_algorithm) == expected:
+                return True
+        except OSError as e:
+            logging.error("Could not read backup file %s: %s", backup_full_file_name, e)
+
+        logging.error("Verification of backup file %s failed", backup_full_file_name)
+        self.problems.append(
+            FileVerificationProblem(
+                name=rpd_file.download_name, uri=get_uri(full_file_name=backup_full_file_name)
+            )
+        )
+        return False
+
+    def complete_backup(self, rpd_file: RPDFile, dest_dir: str, backup_succeeded: bool) -> None:
+        if not backup_succeeded:
+            if rpd_file.status == DownloadStatus.download_failed:
+                rpd_file.status = DownloadStatus.download_and_backup_failed
+            else:
+                rpd_file.status = DownloadStatus.backup_problem
+        else:
+            # backup any THM, audio or XMP files
+            if rpd_file.download_thm_full_name:
+                self.backup_associate_file(dest_dir, rpd_file.download_thm_full_name)
+            if rpd_file.download_audio_full_name:
+                self.backup_associate_file(dest_dir, rpd_file.download_audio_full_name)
+            if rpd_file.download_xmp_full_name:
+                self.backup_associate_file(dest_dir, rpd_file.download_xmp_full_name)
+            if rpd_file.download_log_full_name:
+                self.backup_associate_file(dest_dir, rpd_file.download_log_full_name)
+
+    def send_backup_results(self, data: BackupFileData, do_backup: bool, backup_succeeded: bool,
+                            backup_full_file_name: str,
+                            mdata_exceptions: Optional[Tuple]) -> None:
+        rpd_file = data.rpd_file
+        self.total_downloaded += rpd_file.size
+        bytes_not_downloaded = rpd_file.size - self.amount_downloaded
+        if bytes_not_downloaded and do_backup:
+            self.content = encode_message(
+                BackupResults(
+                    scan_id=self.scan_id, device_id=self.device_id,
+                    total_downloaded=self.total_downloaded, chunk_downloaded=bytes_not_downloaded
+                )
+            )
+            self.send_message_to_sink()
+
+        self.content = encode_message(
+            BackupResults(
+                scan_id=self.scan_id, device_id=self.device_id, backup_succeeded=backup_succeeded,
+                do_backup=do_backup, rpd_file=rpd_file,
+                backup_full_file_name=backup_full_file_name, mdata_exceptions=mdata_exceptions
+            )
+        )
+        self.send_message_to_sink()
+
+    def init_file_backup(self, data: BackupFileData) -> None:
         rpd_file = data.rpd_file
-        backup_succeeded = False
         self.scan_id = rpd_file.scan_id
         self.verify_file = data.verify_file
+        if rpd_file.checksum_algorithm is not None:
+            self.checksum_algorithm = rpd_file.checksum_algorithm
+
+    def do_backup(self, data: BackupFileData) -> None:
+        rpd_file = data.rpd_file
+        backup_succeeded = False
+        self.init_file_backup(data)
 
         mdata_exceptions = None
 
         if not (data.move_succeeded and data.do_backup):
             backup_full_file_name = ''
         else:
-            self.total_reached = False
+            dest_dir, backup_full_file_name, copy_file = self.prepare_backup(data)
 
-            if data.path_suffix is None:
-                dest_base_dir = self.path
-            else:
-                dest_base_dir = os.path.join(self.path, data.path_suffix)
-
-            dest_dir = os.path.join(dest_base_dir, rpd_file.download_subfolder)
-            backup_full_file_name = os.path.join(dest_dir, rpd_file.download_name)
-
-            if not os.path.isdir(dest_dir):
-                # create the subfolders on the backup path
-                try:
-                    logging.debug("Creating subfolder %s on backup device %s...",
-                                  dest_dir, self.device_name)
-                    os.makedirs(dest_dir)
-                    logging.debug("...backup subfolder created")
-                except (OSError, PermissionError, FileNotFoundError) as inst:
-                    # There is a minuscule chance directory may have been
-                    # created by another process between the time it
-                    # takes to query and the time it takes to create a
-                    # new directory. Ignore that error.
-                    if inst.errno != errno.EEXIST:
-                        logging.error("Failed to create backup subfolder: %s",
-                                      rpd_file.download_path)
-                        logging.error(inst)
-
-                        self.problems.append(
-                            BackupSubfolderCreationProblem(
-                                folder=make_href(
-                                    name=rpd_file.download_subfolder, uri=get_uri(path=dest_dir)
-                                ),
-                                exception=inst
-                            )
-                        )
-
-            backup_already_exists = os.path.exists(backup_full_file_name)
-
-            if backup_already_exists:
-                try:
-                    modification_time = os.path.getmtime(backup_full_file_name)
-                    dt = datetime.fromtimestamp(modification_time)
-                    date = dt.strftime("%x")
-                    time = dt.strftime("%X")
-                except Exception:
-                    logging.error("Could not determine the file modification time of %s",
-                                  backup_full_file_name)
-                    date = time = ''
-
-                source = rpd_file.get_souce_href()
-                device = make_href(name=rpd_file.device_display_name, uri=rpd_file.device_uri)
-
-                if data.backup_duplicate_overwrite:
-                    self.problems.append(BackupOverwrittenProblem(
-                        file_type_capitalized=rpd_file.title_capitalized,
-                        file_type=rpd_file.title,
-                        name=rpd_file.download_name,
-                        uri=get_uri(full_file_name=backup_full_file_name),
-                        source=source,
-                        device=device,
-                        date=date,
-                        time=time
-                    ))
-                    msg = "Overwriting backup file %s" % backup_full_file_name
-                else:
-                    self.problems.append(BackupAlreadyExistsProblem(
-                        file_type_capitalized=rpd_file.title_capitalized,
-                        file_type=rpd_file.title,
-                        name=rpd_file.download_name,
-                        uri=get_uri(full_file_name=backup_full_file_name),
-                        source=source,
-                        device=device,
-                        date=date,
-                        time=time
-                    ))
-                    msg = "Skipping backup of file %s because it already exists" % \
-                          backup_full_file_name
-                logging.warning(msg)
-
-            if not backup_already_exists or data.backup_duplicate_overwrite:
+            if copy_file:
                 logging.debug("Backing up file %s on device %s...",
                               data.download_count, self.device_name)
                 source = rpd_file.download_full_file_name
                 destination = backup_full_file_name
                 backup_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
                 if backup_succeeded and self.verify_file:
-                    md5 = hashlib.md5(open(backup_full_file_name).read()).hexdigest()
-                    if md5 != rpd_file.md5:
-                        pass
+                    backup_succeeded = self.verify_backup(
+                        rpd_file, backup_full_file_name, self.checksum
+                    )
                 if backup_succeeded:
                     logging.debug("...backing up file %s on device %s succeeded",
                                   data.download_count, self.device_name)
@@ -203,43 +398,176 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                     mdata_exceptions = copy_file_metadata(
                         rpd_file.download_full_file_name, backup_full_file_name
                     )
-            if not backup_succeeded:
-                if rpd_file.status == DownloadStatus.download_failed:
-                    rpd_file.status = DownloadStatus.download_and_backup_failed
-                else:
-                    rpd_file.status = DownloadStatus.backup_problem
-            else:
-                # backup any THM, audio or XMP files
-                if rpd_file.download_thm_full_name:
-                    self.backup_associate_file(dest_dir, rpd_file.download_thm_full_name)
-                if rpd_file.download_audio_full_name:
-                    self.backup_associate_file(dest_dir, rpd_file.download_audio_full_name)
-                if rpd_file.download_xmp_full_name:
-                    self.backup_associate_file(dest_dir, rpd_file.download_xmp_full_name)
-                if rpd_file.download_log_full_name:
-                    self.backup_associate_file(dest_dir, rpd_file.download_log_full_name)
+            self.complete_backup(rpd_file, dest_dir, backup_succeeded)
 
-        self.total_downloaded += rpd_file.size
-        bytes_not_downloaded = rpd_file.size - self.amount_downloaded
-        if bytes_not_downloaded and data.do_backup:
-            self.content = pickle.dumps(
-                BackupResults(
-                    scan_id=self.scan_id, device_id=self.device_id,
-                    total_downloaded=self.total_downloaded, chunk_downloaded=bytes_not_downloaded
-                ),
-                pickle.HIGHEST_PROTOCOL
+        self.send_backup_results(
+            data, data.do_backup, backup_succeeded, backup_full_file_name, mdata_exceptions
+        )
+
+    @contextmanager
+    def use_destination(self, device_id: int) -> Iterator[BackupDestinationState]:
+        """
+        When backing up to more than one device, make the device the one this
+        worker is currently backing up to
+        """
+
+        state = self.destinations[device_id]
+        self.device_id = device_id
+        self.path = state.path
+        self.device_name = state.device_name
+        self.uri = state.uri
+        self.problems = state.problems
+        self.total_downloaded = state.total_downloaded
+        self.bytes_downloaded = state.bytes_downloaded
+        self.amount_downloaded = state.amount_downloaded
+        try:
+            yield state
+        finally:
+            state.problems = self.problems
+            state.total_downloaded = self.total_downloaded
+            state.bytes_downloaded = self.bytes_downloaded
+            state.amount_downloaded = self.amount_downloaded
+
+    def add_destinations(self, destinations: List[BackupDestination]) -> None:
+        for destination in destinations:
+            if destination.device_id not in self.destinations:
+                self.destinations[destination.device_id] = BackupDestinationState(
+                    path=destination.path, device_name=destination.device_name
+                )
+
+    def report_fan_out_progress(self, writers: List[BackupWriter], total: int) -> None:
+        for writer in writers:
+            with self.use_destination(writer.device_id):
+                self.update_progress(writer.amount_written, total)
+
+    def fan_out_copy(self, source: str, writers: List[BackupWriter], total: int) -> Optional[str]:
+        """
+        Read the source file once, and give each chunk to every writer.
+
+        A writer that falls behind the others does not hold them up until its
+        queue of chunks is full.
+
+        :return: the checksum of the source if files are being verified, else None
+        """
+
+        if self.verify_file:
+            checksum = new_checksum(self.checksum_algorithm)
+        else:
+            checksum = None
+
+        for writer in writers:
+            writer.start()
+
+        try:
+            with io.open(source, 'rb', self.io_buffer) as self.src:
+                while True:
+                    # first check if process is being stopped or paused
+                    self.check_for_controller_directive()
+
+                    chunk = self.src.read(self.io_buffer)
+                    for writer in writers:
+                        while writer.is_alive() and not writer.put(chunk):
+                            self.check_for_controller_directive()
+                            self.report_fan_out_progress(writers, total)
+                    self.report_fan_out_progress(writers, total)
+                    if not chunk:
+                        break
+                    if checksum is not None:
+                        checksum.update(chunk)
+        except (OSError, FileNotFoundError, PermissionError) as e:
+            logging.error(
+                "%s: %s. Failed to read %s while backing it up", e.errno, e.strerror, source
             )
-            self.send_message_to_sink()
+            for writer in writers:
+                # The writer reports the error itself once it has finished
+                while writer.is_alive() and not writer.put(e, timeout=1.0):
+                    pass
+        finally:
+            self.src = None
+
+        for writer in writers:
+            while writer.is_alive():
+                writer.join(0.1)
+                self.report_fan_out_progress([writer], total)
+
+        if checksum is not None:
+            return checksum.hexdigest()
+        return None
+
+    def do_fan_out_backup(self, data: BackupFileData) -> None:
+        """
+        Back up the file to every backup device, reading it only once
+        """
 
-        self.content = pickle.dumps(
-            BackupResults(
-                scan_id=self.scan_id, device_id=self.device_id, backup_succeeded=backup_succeeded,
-                do_backup=data.do_backup, rpd_file=rpd_file,
-                backup_full_file_name=backup_full_file_name, mdata_exceptions=mdata_exceptions
-            ),
-            pickle.HIGHEST_PROTOCOL
-        )
-        self.send_message_to_sink()
+        rpd_file = data.rpd_file
+        self.init_file_backup(data)
+        self.add_destinations(data.destinations)
+
+        # Backup files, by device id
+        backups = {}  # type: Dict[int, Tuple[str, str]]
+        writers = []  # type: List[BackupWriter]
+
+        for destination in data.destinations:
+            with self.use_destination(destination.device_id):
+                self.amount_downloaded = 0
+                self.init_copy_progress()
+                if data.move_succeeded and destination.do_backup:
+                    dest_dir, backup_full_file_name, copy_file = self.prepare_backup(data)
+                    backups[destination.device_id] = dest_dir, backup_full_file_name
+                    if copy_file:
+                        logging.debug("Backing up file %s on device %s...",
+                                      data.download_count, self.device_name)
+                        writers.append(
+                            BackupWriter(
+                                device_id=destination.device_id,
+                                destination=backup_full_file_name,
+                                max_chunks=self.fan_out_max_chunks
+                            )
+                        )
+
+        if writers:
+            checksum = self.fan_out_copy(rpd_file.download_full_file_name, writers, rpd_file.size)
+        else:
+            checksum = None
+        writers = {writer.device_id: writer for writer in writers}
+
+        for destination in data.destinations:
+            device_id = destination.device_id
+            with self.use_destination(device_id):
+                backup_succeeded = False
+                mdata_exceptions = None
+                if device_id not in backups:
+                    backup_full_file_name = ''
+                else:
+                    dest_dir, backup_full_file_name = backups[device_id]
+                    writer = writers.get(device_id)
+                    if writer is not None:
+                        if writer.error is not None:
+                            self.problems.append(
+                                FileCopyProblem(
+                                    name=os.path.basename(backup_full_file_name),
+                                    uri=get_uri(full_file_name=backup_full_file_name),
+                                    exception=writer.error
+                                )
+                            )
+                        else:
+                            backup_succeeded = True
+                            if self.verify_file:
+                                backup_succeeded = self.verify_backup(
+                                    rpd_file, backup_full_file_name, checksum
+                                )
+                        if backup_succeeded:
+                            logging.debug("...backing up file %s on device %s succeeded",
+                                          data.download_count, self.device_name)
+                            mdata_exceptions = copy_file_metadata(
+                                rpd_file.download_full_file_name, backup_full_file_name
+                            )
+                    self.complete_backup(rpd_file, dest_dir, backup_succeeded)
+
+                self.send_backup_results(
+                    data, destination.do_backup, backup_succeeded, backup_full_file_name,
+                    mdata_exceptions
+                )
 
     def reset_problems(self) -> None:
         self.problems = BackingUpProblems(
@@ -248,21 +576,26 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
     def send_problems(self) -> None:
         if self.problems:
-            self.content = pickle.dumps(
+            self.content = encode_message(
                 BackupResults(
                     scan_id=self.scan_id, device_id=self.device_id, problems=self.problems
-                ),
-                pickle.HIGHEST_PROTOCOL
+                )
             )
             self.send_message_to_sink()
             self.reset_problems()
 
     def cleanup_pre_stop(self):
-        self.send_problems()
+        if self.fan_out:
+            for device_id in self.destinations:
+                with self.use_destination(device_id):
+                    self.send_problems()
+        else:
+            self.send_problems()
 
     def do_work(self):
 
-        backup_arguments = pickle.loads(self.content)
+        backup_arguments = pickle.loads(self.content)  # type: BackupArguments
+        self.fan_out = backup_arguments.fan_out
         self.path = backup_arguments.path
         self.device_name = backup_arguments.device_name
         self.uri = get_uri(path=self.path)
@@ -271,12 +604,25 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
         while True:
             worker_id, directive, content = self.receiver.recv_multipart()
-            self.device_id = int(worker_id)
+            if not self.fan_out:
+                self.device_id = int(worker_id)
 
             self.check_for_command(directive, content)
 
             data = pickle.loads(content) # type: BackupFileData
-            if data.message == BackupStatus.backup_started:
+            if self.fan_out:
+                self.add_destinations(data.destinations)
+                if data.message == BackupStatus.backup_started:
+                    for destination in data.destinations:
+                        with self.use_destination(destination.device_id):
+                            self.reset_problems()
+                elif data.message == BackupStatus.backup_completed:
+                    for destination in data.destinations:
+                        with self.use_destination(destination.device_id):
+                            self.send_problems()
+                else:
+                    self.do_fan_out_backup(data=data)
+            elif data.message == BackupStatus.backup_started:
                 self.reset_problems()
             elif data.message == BackupStatus.backup_completed:
                 self.send_problems()
@@ -288,4 +634,4 @@ class BackupFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
 
 if __name__ == "__main__":
-    backup = BackupFilesWorker()
\ No newline at end of file
+    backup = BackupFilesWorker()
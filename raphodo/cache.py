@@ -19,7 +19,7 @@
 # see <http://www.gnu.org/licenses/>.
 
 """
-Rapid Photo Downloader deals with three types of cache:
+Rapid Photo Downloader deals with four types of cache:
 
 1. An image cache whose sole purpose is to store thumbnails of scanned files
    that have not necessarily been downloaded, but may have. This is only used
@@ -42,6 +42,15 @@ Rapid Photo Downloader deals with three types of cache:
    (Actual location may vary depending on value of environment variable
    XDG_CACHE_HOME)
 
+4. A cache of metadata values read from scanned files, like their date time,
+   orientation and camera model, keyed on the file's uri, size and
+   modification time. It's used to generate thumbnails and file and subfolder
+   names without reading the file's metadata again.
+   Name: Metadata Cache
+   Location: /home/USER/.cache/rapid-photo-downloader/metadata_cache.sqlite
+   (Actual location may vary depending on value of environment variable
+   XDG_CACHE_HOME)
+
 For the fdo cache specs, see:
 http://specifications.freedesktop.org/thumbnail-spec/thumbnail-spec-latest.html
 """
@@ -56,21 +65,34 @@ import hashlib
 from urllib.request import pathname2url
 import time
 import shutil
+import fcntl
+import mmap
+import threading
 from collections import namedtuple
-from typing import Optional, Tuple, Union
+from datetime import datetime
+from typing import Optional, Tuple, Union, Dict, List, Any, Callable
 import sqlite3
+import pickle
 
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, QBuffer, QIODevice
 from PyQt5.QtGui import QImage
+from tenacity import RetryError
 
 from raphodo.storage import get_program_cache_directory, get_fdo_cache_thumb_base_directory
 from raphodo.utilities import GenerateRandomFileName, format_size_for_user
-from raphodo.constants import ThumbnailCacheDiskStatus
-from raphodo.rpdsql import CacheSQL
+from raphodo.constants import ThumbnailCacheDiskStatus, FileType
+from raphodo.rpdsql import CacheSQL, InCache, CachedThumbnail, MetadataCacheSQL
+import raphodo.fileformats as fileformats
 
 
 GetThumbnail = namedtuple('GetThumbnail', 'disk_status, thumbnail, path')
 GetThumbnailPath = namedtuple('GetThumbnailPath', 'disk_status, path, mdatatime, orientation_unknown')
+ThumbnailCacheStatistics = namedtuple('ThumbnailCacheStatistics', 'hits, misses, evictions')
+MetadataCacheStatistics = namedtuple('MetadataCacheStatistics', 'hits, misses')
+GetThumbnailBytes = namedtuple(
+    'GetThumbnailBytes', 'disk_status, thumbnail_bytes, mdatatime, orientation_unknown'
+)
+
 
 class MD5Name:
     """Generate MD5 hashes for file names."""
@@ -366,9 +388,215 @@ class FdoCacheLarge(Cache):
         super().__init__(cache_dir, failure_dir)
 
 
+class PackedThumbnailStore:
+    """
+    Thumbnails stored one after another in append-only segment files, avoiding
+    the cost of one file per thumbnail. The location of each thumbnail is
+    recorded in the thumbnail cache database.
+
+    Several processes can append to a segment at the same time, because each
+    append is made while holding an exclusive lock on the segment file.
+    Thumbnails are read using a memory map of the segment file.
+
+    Thumbnails deleted from the database leave unused space in their segment.
+    Compaction copies the thumbnails remaining in a mostly unused segment to
+    the end of the newest segment, and deletes the old segment. A process
+    appending to a segment that compaction deleted appends to the newest
+    segment instead.
+    """
+
+    segment_prefix = 'thumbnails-'
+    segment_suffix = '.pack'
+    max_segment_size = 64 * 1024 * 1024
+
+    def __init__(self, cache_dir: str) -> None:
+        """
+        :param cache_dir: the directory in which the segment files are stored
+        """
+
+        self.cache_dir = cache_dir
+        self.current_segment = None  # type: Optional[int]
+        self.maps = {}  # type: Dict[int, mmap.mmap]
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(
+            self.cache_dir, '{}{:06d}{}'.format(self.segment_prefix, segment, self.segment_suffix)
+        )
+
+    @classmethod
+    def is_segment(cls, name: str) -> bool:
+        return name.startswith(cls.segment_prefix) and name.endswith(cls.segment_suffix)
+
+    def segments(self) -> List[int]:
+        """
+        :return: the numbers of the segment files, in ascending order
+        """
+
+        return sorted(
+            int(name[len(self.segment_prefix):-len(self.segment_suffix)])
+            for name in os.listdir(self.cache_dir) if self.is_segment(name)
+        )
+
+    def append(self, data: bytes) -> Tuple[int, int]:
+        """
+        Append a thumbnail to the newest segment file, starting a new segment
+        if the newest is full
+
+        :param data: the thumbnail
+        :return: the segment the thumbnail was written to, and its offset
+         in the segment
+        """
+
+        if self.current_segment is None:
+            segments = self.segments()
+            self.current_segment = segments[-1] if segments else 1
+
+        while True:
+            fd = os.open(
+                self.segment_path(self.current_segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                0o600
+            )
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                segment_stat = os.fstat(fd)
+                if not segment_stat.st_nlink:
+                    # The segment was compacted while waiting for the lock
+                    segments = self.segments()
+                    self.current_segment = segments[-1] if segments else 1
+                    continue
+                offset = segment_stat.st_size
+                if offset and offset + len(data) > self.max_segment_size:
+                    self.current_segment += 1
+                    continue
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                return self.current_segment, offset
+            finally:
+                # Closing the file releases the lock
+                os.close(fd)
+
+    def read(self, segment: int, offset: int, length: int) -> Optional[bytes]:
+        """
+        Read a thumbnail from a segment file
+
+        :param segment: the segment the thumbnail is in
+        :param offset: the offset of the thumbnail in the segment
+        :param length: the length of the thumbnail in bytes
+        :return: the thumbnail, or None if it could not be read
+        """
+
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < offset + length:
+            # The segment has not been mapped yet, or has grown since it was mapped
+            self.close_segment(segment)
+            try:
+                with open(self.segment_path(segment), 'rb') as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                logging.warning("Could not read thumbnail cache segment %s: %s", segment, e)
+                return None
+            self.maps[segment] = segment_map
+            if len(segment_map) < offset + length:
+                logging.warning("Thumbnail cache segment %s is truncated", segment)
+                return None
+        return segment_map[offset:offset + length]
+
+    def close_segment(self, segment: int) -> None:
+        segment_map = self.maps.pop(segment, None)
+        if segment_map is not None:
+            segment_map.close()
+
+    def remove_segment(self, segment: int) -> None:
+        self.close_segment(segment)
+        try:
+            os.remove(self.segment_path(segment))
+        except FileNotFoundError:
+            pass
+
+    def compact(self, thumb_db: CacheSQL, threshold: float=0.5) -> Tuple[int, int]:
+        """
+        Remove segments in which less than the threshold of space is used by
+        thumbnails, copying the remaining thumbnails to the newest segment.
+
+        Each segment is locked while it is compacted, so other processes can
+        append thumbnails while the cache is compacted. A process that looked up
+        a thumbnail's location before it was copied will not find it, and
+        generate it again.
+
+        :param thumb_db: the thumbnail cache database
+        :param threshold: proportion of a segment that must be used by
+         thumbnails for the segment to be kept
+        :return: number of segments removed, and bytes reclaimed
+        """
+
+        usage = thumb_db.segment_usage()
+        segments = self.segments()
+        if not segments:
+            return 0, 0
+
+        # Thumbnails are copied to the end of the newest segment, so it cannot
+        # be compacted
+        newest = segments[-1]
+        self.current_segment = newest
+
+        removed = reclaimed = 0
+        for segment in segments[:-1]:
+            segment_size = os.path.getsize(self.segment_path(segment))
+            used = usage.get(segment, 0)
+            if used >= segment_size * threshold:
+                continue
+
+            try:
+                fd = os.open(self.segment_path(segment), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                # Stop other processes appending to the segment while it is compacted
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                moved = []
+                for thumbnail in thumb_db.packed_thumbnails(segment):
+                    data = self.read(segment, thumbnail.offset, thumbnail.length)
+                    if data is not None:
+                        new_segment, new_offset = self.append(data)
+                        moved.append(
+                            (new_segment, new_offset, thumbnail.offset, thumbnail.length)
+                        )
+                if moved:
+                    thumb_db.move_packed_thumbnails(segment, moved)
+                # Remove any thumbnails that could not be read
+                thumb_db.delete_segments([segment])
+                self.remove_segment(segment)
+            finally:
+                os.close(fd)
+            removed += 1
+            reclaimed += segment_size - used
+
+        if removed:
+            logging.debug(
+                "Compacted %s thumbnail cache segments, reclaiming %s", removed,
+                format_size_for_user(reclaimed)
+            )
+        return removed, reclaimed
+
+    def close(self) -> None:
+        for segment in list(self.maps.keys()):
+            self.close_segment(segment)
+
+
 class ThumbnailCacheSql:
 
     not_found = GetThumbnailPath(ThumbnailCacheDiskStatus.not_found, None, None, None)
+    not_found_bytes = GetThumbnailBytes(ThumbnailCacheDiskStatus.not_found, None, None, None)
+
+    # Whether to save new thumbnails in packed segment files, rather than
+    # one file per thumbnail. Thumbnails are read from either.
+    use_packed_store = True
+
+    # When thumbnails were last used is recorded in the database in batches,
+    # rather than writing to the database each time a thumbnail is used
+    access_batch_size = 100
+    access_batch_time = 10.0  # seconds
 
     def __init__(self, create_table_if_not_exists: bool) -> None:
         self.cache_dir = get_program_cache_directory(create_if_not_exist=True)
@@ -399,6 +627,16 @@ class ThumbnailCacheSql:
             self.random_filename = GenerateRandomFileName()
             self.md5 = MD5Name()
             self.thumb_db = CacheSQL(self.cache_dir, create_table_if_not_exists)
+            # Thumbnails used but not yet recorded in the database: time used,
+            # uri, size, mtime
+            self.accessed = []  # type: List[Tuple[float, str, int, float]]
+            self.accessed_since = 0.0
+            # Cache statistics not yet added to those in the database
+            self.hits = self.misses = self.evictions = 0
+            self.packed = PackedThumbnailStore(self.cache_dir)
+            # Where thumbnails in segment files are extracted to when their path
+            # is requested
+            self.extract_dir = os.path.join(self.cache_dir, 'extracted')
 
     def save_thumbnail(self, full_file_name: str, size: int,
                        mtime: float,
@@ -424,8 +662,9 @@ class ThumbnailCacheSql:
          resized. Will be ignored if generation_failed is True.
         :param camera_model: optional camera model. If the thumbnail is
          not from a camera, then should be None.
-        :return the path of the saved file, else None if operation
-        failed
+        :return the path of the saved file, or if the thumbnail was saved
+        in a packed segment, the path of the segment file, else None if
+        operation failed
         """
 
         if not self.valid:
@@ -439,11 +678,26 @@ class ThumbnailCacheSql:
         else:
             logging.debug("Saving thumbnail for %s in RPD thumbnail cache", uri)
 
+        segment = offset = length = None
+        if self.use_packed_store and not generation_failed:
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            if not thumbnail.save(buffer, 'jpg', quality=75):
+                return None
+            data = buffer.data().data()
+            try:
+                segment, offset = self.packed.append(data)
+            except OSError as e:
+                logging.error("Could not save thumbnail for %s: %s", uri, e)
+                return None
+            length = len(data)
+
         try:
             self.thumb_db.add_thumbnail(uri=uri, size=size, mtime=mtime,
                                     mdatatime=mdatatime,
                                     md5_name=md5_name, orientation_unknown=orientation_unknown,
-                                    failure=generation_failed)
+                                    failure=generation_failed, segment=segment, offset=offset,
+                                    length=length)
         except sqlite3.OperationalError as e:
             logging.error("Database error adding thumbnail for %s: %s. Will not retry.", uri, e)
             return None
@@ -451,6 +705,9 @@ class ThumbnailCacheSql:
         if generation_failed:
             return None
 
+        if segment is not None:
+            return self.packed.segment_path(segment)
+
         md5_full_name = os.path.join(self.cache_dir, md5_name)
 
         temp_path = os.path.join(self.cache_dir, self.random_filename.name(extension='jpg'))
@@ -466,7 +723,8 @@ class ThumbnailCacheSql:
         return None
 
     def get_thumbnail_path(self, full_file_name: str, mtime, size: int,
-                           camera_model: str=None) -> GetThumbnailPath:
+                           camera_model: str=None,
+                           extract_packed: bool=True) -> GetThumbnailPath:
         """
         Attempt to get a thumbnail's path from the thumbnail cache.
 
@@ -478,6 +736,9 @@ class ThumbnailCacheSql:
          into a float if it's not already
         :param camera_model: optional camera model. If the thumbnail is
          not from a camera, then should be None.
+        :param extract_packed: if the thumbnail is in a packed segment
+         file, whether to extract it to its own file so it has a path.
+         If False, the path returned for such thumbnails is None.
         :return a GetThumbnailPath tuple of (1) ThumbnailCacheDiskStatus,
          to indicate whether the thumbnail was found, a failure, or
          missing, (2) the path (including the md5 name), else None,
@@ -488,8 +749,7 @@ class ThumbnailCacheSql:
         if not self.valid:
             return self.not_found
 
-        uri = self.md5.get_uri(full_file_name, camera_model)
-        in_cache = self.thumb_db.have_thumbnail(uri, size, mtime)
+        in_cache = self._have_thumbnail(full_file_name, mtime, size, camera_model)
 
         if in_cache is None:
             return self.not_found
@@ -498,14 +758,242 @@ class ThumbnailCacheSql:
             return GetThumbnailPath(ThumbnailCacheDiskStatus.failure, None,
                                     in_cache.mdatatime, None)
 
-        path = os.path.join(self.cache_dir, in_cache.md5_name)
-        if not os.path.exists(path):
-            self.thumb_db.delete_thumbnails([in_cache.md5_name])
-            return self.not_found
+        if in_cache.segment is not None:
+            if extract_packed:
+                path = self._extract_packed(in_cache)
+                if path is None:
+                    return self.not_found
+            else:
+                if not os.path.exists(self.packed.segment_path(in_cache.segment)):
+                    self.thumb_db.delete_segments([in_cache.segment])
+                    return self.not_found
+                path = None
+        else:
+            path = os.path.join(self.cache_dir, in_cache.md5_name)
+            if not os.path.exists(path):
+                self.thumb_db.delete_thumbnails([in_cache.md5_name])
+                return self.not_found
 
         return GetThumbnailPath(ThumbnailCacheDiskStatus.found, path,
                                 in_cache.mdatatime, in_cache.orientation_unknown)
 
+    def get_thumbnail_bytes(self, full_file_name: str, mtime, size: int,
+                            camera_model: str=None) -> GetThumbnailBytes:
+        """
+        Attempt to get a thumbnail from the thumbnail cache. Unlike
+        get_thumbnail_path(), thumbnails in packed segment files are
+        read directly, without being extracted.
+
+        :param full_file_name: full path of the file (including file
+        name). Will be turned into an absolute path if it is a file
+        system path
+        :param size: size of the file in bytes
+        :param mtime: file modification time, to be turned
+         into a float if it's not already
+        :param camera_model: optional camera model. If the thumbnail is
+         not from a camera, then should be None.
+        :return a GetThumbnailBytes tuple of (1) ThumbnailCacheDiskStatus,
+         to indicate whether the thumbnail was found, a failure, or
+         missing, (2) the thumbnail in jpeg format, else None,
+         (3) the file's metadata time, and (4) a bool indicating whether
+         the orientation of the thumbnail is unknown
+        """
+
+        if not self.valid:
+            return self.not_found_bytes
+
+        in_cache = self._have_thumbnail(full_file_name, mtime, size, camera_model)
+
+        if in_cache is None:
+            return self.not_found_bytes
+
+        if in_cache.failure:
+            return GetThumbnailBytes(ThumbnailCacheDiskStatus.failure, None,
+                                     in_cache.mdatatime, None)
+
+        if in_cache.segment is not None:
+            thumbnail_bytes = self.packed.read(
+                in_cache.segment, in_cache.offset, in_cache.length
+            )
+        else:
+            try:
+                with open(os.path.join(self.cache_dir, in_cache.md5_name), 'rb') as thumbnail:
+                    thumbnail_bytes = thumbnail.read()
+            except OSError:
+                thumbnail_bytes = None
+                self.thumb_db.delete_thumbnails([in_cache.md5_name])
+
+        if thumbnail_bytes is None:
+            return self.not_found_bytes
+
+        return GetThumbnailBytes(ThumbnailCacheDiskStatus.found, thumbnail_bytes,
+                                 in_cache.mdatatime, in_cache.orientation_unknown)
+
+    def _have_thumbnail(self, full_file_name: str, mtime, size: int,
+                        camera_model: Optional[str]) -> Optional[InCache]:
+        uri = self.md5.get_uri(full_file_name, camera_model)
+        in_cache = self.thumb_db.have_thumbnail(uri, size, mtime)
+        if in_cache is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            now = time.time()
+            if not self.accessed:
+                self.accessed_since = now
+            self.accessed.append((now, uri, size, mtime))
+            if (len(self.accessed) >= self.access_batch_size or
+                    now - self.accessed_since >= self.access_batch_time):
+                self.flush_access_times()
+        return in_cache
+
+    def flush_access_times(self) -> None:
+        """
+        Record in the database when thumbnails were last used, along with
+        the cache statistics gathered since the last flush
+        """
+
+        if not self.valid or not (self.accessed or self.hits or self.misses or self.evictions):
+            return
+        statistics = dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+        try:
+            self.thumb_db.record_access(self.accessed, statistics)
+        except (sqlite3.OperationalError, RetryError) as e:
+            logging.warning("Could not record thumbnail cache access: %s", e)
+        self.accessed = []
+        self.hits = self.misses = self.evictions = 0
+
+    def statistics(self) -> ThumbnailCacheStatistics:
+        """
+        :return: the number of cache hits, misses and evictions, in all
+         processes using the cache
+        """
+
+        if not self.valid:
+            return ThumbnailCacheStatistics(0, 0, 0)
+        self.flush_access_times()
+        statistics = self.thumb_db.statistics()
+        return ThumbnailCacheStatistics(
+            statistics.get('hits', 0), statistics.get('misses', 0),
+            statistics.get('evictions', 0)
+        )
+
+    def thumbnails_size(self) -> int:
+        """
+        :return: bytes used by thumbnails on disk, whether in packed segment
+         files or their own files. Space in segment files left unused by
+         deleted thumbnails is included, except in the newest segment, which
+         is never compacted.
+        """
+
+        if not self.valid:
+            return 0
+        size = 0
+        segments = self.packed.segments()
+        if segments:
+            size += self.thumb_db.segment_usage().get(segments[-1], 0)
+            for segment in segments[:-1]:
+                try:
+                    size += os.path.getsize(self.packed.segment_path(segment))
+                except FileNotFoundError:
+                    pass
+        db_name = self.thumb_db.db_fs_name()
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if (entry.is_file() and not self.packed.is_segment(entry.name) and
+                        not entry.name.startswith(db_name)):
+                    size += entry.stat().st_size
+        return size
+
+    def evict_lru(self, max_size: int,
+                  batch_size: int=500,
+                  stop_event: Optional[threading.Event]=None,
+                  pause: float=0.05) -> int:
+        """
+        Remove the least recently used thumbnails until the thumbnails use no
+        more than the maximum size.
+
+        Thumbnails are removed in batches, pausing between batches so as not
+        to compete with the rest of the program for the database.
+
+        Space in packed segment files used by the removed thumbnails is
+        reclaimed by compacting the segments, after which thumbnails continue
+        to be removed should the cache still be too big.
+
+        :param max_size: maximum bytes thumbnails may use
+        :param batch_size: how many thumbnails to remove in one batch
+        :param stop_event: if set, stop removing thumbnails
+        :param pause: time in seconds to wait between batches
+        :return: number of thumbnails removed
+        """
+
+        if not self.valid:
+            return 0
+
+        excess = self.thumbnails_size() - max_size
+        evicted = 0
+        packed_evicted = False
+        while excess > 0 and not (stop_event is not None and stop_event.is_set()):
+            thumbnails = self.thumb_db.least_recently_used(batch_size)
+            if not thumbnails:
+                break
+            batch = []  # type: List[CachedThumbnail]
+            for thumbnail in thumbnails:
+                if thumbnail.segment is not None:
+                    length = thumbnail.length
+                    packed_evicted = True
+                else:
+                    path = os.path.join(self.cache_dir, thumbnail.md5_name)
+                    try:
+                        length = os.path.getsize(path)
+                        os.remove(path)
+                    except OSError:
+                        length = 0
+                batch.append(thumbnail)
+                excess -= length
+                if excess <= 0:
+                    break
+            self.thumb_db.delete_cached_thumbnails(batch)
+            evicted += len(batch)
+            if excess <= 0 and packed_evicted:
+                self.packed.compact(self.thumb_db)
+                packed_evicted = False
+                excess = self.thumbnails_size() - max_size
+            if excess > 0 and pause:
+                time.sleep(pause)
+
+        if evicted:
+            self.evictions += evicted
+            self.flush_access_times()
+            logging.debug(
+                "Evicted %s least recently used thumbnails from the thumbnail cache", evicted
+            )
+        return evicted
+
+    def _extract_packed(self, in_cache: InCache) -> Optional[str]:
+        """
+        Extract a thumbnail in a packed segment file to its own file
+
+        :param in_cache: the thumbnail's details in the database
+        :return: the path of the extracted thumbnail, or None if it could not
+         be extracted
+        """
+
+        path = os.path.join(self.extract_dir, in_cache.md5_name)
+        data = self.packed.read(in_cache.segment, in_cache.offset, in_cache.length)
+        if data is None:
+            return None
+        try:
+            os.makedirs(self.extract_dir, 0o700, exist_ok=True)
+            temp_path = os.path.join(
+                self.extract_dir, self.random_filename.name(extension='jpg')
+            )
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, path)
+        except OSError as e:
+            logging.error("Could not extract thumbnail %s: %s", in_cache.md5_name, e)
+            return None
+        return path
 
     def cleanup_cache(self, days: int=30) -> None:
         """
@@ -518,9 +1006,19 @@ class ThumbnailCacheSql:
             i = 0
             now = time.time()
             deleted_thumbnails = []
+            deleted_segments = []
             for name in os.listdir(self.cache_dir):
                 thumbnail = os.path.join(self.cache_dir, name)
-                if (os.path.isfile(thumbnail) and
+                if self.packed.is_segment(name):
+                    # Thumbnails in a segment are deleted together, once none of
+                    # them has been read or written for the time period
+                    stat = os.stat(thumbnail)
+                    if max(stat.st_atime, stat.st_mtime) < now - time_period:
+                        deleted_segments.append(
+                            int(name[len(self.packed.segment_prefix):
+                                     -len(self.packed.segment_suffix)])
+                        )
+                elif (os.path.isfile(thumbnail) and
                         os.path.getatime(thumbnail) < now - time_period):
                     os.remove(thumbnail)
                     deleted_thumbnails.append(name)
@@ -532,6 +1030,18 @@ class ThumbnailCacheSql:
                         len(deleted_thumbnails), days
                     )
                 )
+            if self.thumb_db.cache_exists():
+                if deleted_segments:
+                    count = self.thumb_db.delete_segments(deleted_segments)
+                    for segment in deleted_segments:
+                        self.packed.remove_segment(segment)
+                    logging.debug(
+                        'Deleted %s thumbnails in %s segment files that had not been accessed '
+                        'for %s or more days', count, len(deleted_segments), days
+                    )
+                self.packed.compact(self.thumb_db)
+            # Extracted thumbnails are needed only while the program is running
+            shutil.rmtree(self.extract_dir, ignore_errors=True)
 
     def purge_cache(self) -> None:
         """
@@ -578,6 +1088,7 @@ class ThumbnailCacheSql:
         """
         Check for any thumbnails in the db that are not in the file system
         Check for any thumbnails exist on the file system that are not in the db
+        Compact the packed segment files
         Vacuum the db
 
         :return db rows removed, file system photos removed, db size reduction in bytes
@@ -592,7 +1103,14 @@ class ThumbnailCacheSql:
         if len(to_delete_from_db):
             self.thumb_db.delete_thumbnails(list(to_delete_from_db))
 
-        md5s = {md5 for md5 in os.listdir('.')} - {self.thumb_db.db_fs_name()}
+        segments = set(self.packed.segments())
+        missing_segments = set(self.thumb_db.segment_usage()) - segments
+        segment_rows_deleted = self.thumb_db.delete_segments(list(missing_segments))
+
+        md5s = {
+            md5 for md5 in os.listdir('.') if os.path.isfile(md5) and
+            not self.packed.is_segment(md5)
+        } - {self.thumb_db.db_fs_name()}
         to_delete_from_fs = md5s - rows
         if len(to_delete_from_fs):
             for md5 in to_delete_from_fs:
@@ -600,10 +1118,369 @@ class ThumbnailCacheSql:
 
         os.chdir(cwd)
 
+        self.packed.compact(self.thumb_db)
+
         size = self.db_size()
         self.thumb_db.vacuum()
 
-        return len(to_delete_from_db), len(to_delete_from_fs), size - self.db_size()
+        return (
+            len(to_delete_from_db) + segment_rows_deleted, len(to_delete_from_fs),
+            size - self.db_size()
+        )
+
+
+class CachedMetadata:
+    """
+    Stands in for a photo or video's metadata, returning values read from
+    the metadata cache in place of reading them from the file.
+
+    Values not in the cache are read from the file's metadata, which is
+    loaded only when first needed. Those values are then cached too.
+    Metadata functions that return other kinds of data, like previews,
+    are passed through to the file's metadata.
+    """
+
+    # Types of metadata values that can be cached
+    cacheable = (str, int, float, datetime, type(None))
+
+    def __init__(self, values: Dict[Tuple, Any],
+                 load: Callable[[], Optional[Any]],
+                 key: Optional[Tuple[str, int, float, str]],
+                 metadata: Optional[Any]=None) -> None:
+        """
+        :param values: metadata values, indexed by metadata function name
+         and arguments
+        :param load: function to load the file's metadata, returning None
+         if it could not be loaded
+        :param key: the file's uri, size, modification time and metadata
+         reader, or None if values read from the file should not be cached
+        :param metadata: the file's metadata, if it has already been loaded
+        """
+
+        self.values = values
+        self.key = key
+        self._load = load
+        self._metadata = metadata
+        self._loaded = metadata is not None
+        # Whether values have been read from the file that are not yet cached
+        self.changed = False
+
+    @property
+    def metadata(self) -> Optional[Any]:
+        if not self._loaded:
+            self._loaded = True
+            self._metadata = self._load()
+        return self._metadata
+
+    def _value(self, name: str, missing: Any, **kwargs) -> Any:
+        key = (name, ) + tuple(sorted(kwargs.items()))
+        try:
+            value = self.values[key]
+        except KeyError:
+            metadata = self.metadata
+            if metadata is None:
+                return missing
+            value = getattr(metadata, name)(missing=None, **kwargs)
+            if isinstance(value, self.cacheable):
+                self.values[key] = value
+                self.changed = True
+        return missing if value is None else value
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.metadata, name)
+
+    def date_time(self, missing: Optional[Any]='', **kwargs) -> Union[datetime, Any]:
+        return self._value('date_time', missing, **kwargs)
+
+    def timestamp(self, missing: Any='') -> Union[float, Any]:
+        return self._value('timestamp', missing)
+
+    def sub_seconds(self, missing: Any='00') -> Union[str, Any]:
+        return self._value('sub_seconds', missing)
+
+    def orientation(self, missing: Any='') -> Union[str, Any]:
+        return self._value('orientation', missing)
+
+    def rotation(self, missing: Any=0) -> Union[int, Any]:
+        return self._value('rotation', missing)
+
+    def aperture(self, missing: Any='') -> Union[str, Any]:
+        return self._value('aperture', missing)
+
+    def iso(self, missing: Any='') -> Union[str, Any]:
+        return self._value('iso', missing)
+
+    def exposure_time(self, alternativeFormat: bool=False, missing: Any='') -> Union[str, Any]:
+        return self._value('exposure_time', missing, alternativeFormat=alternativeFormat)
+
+    def focal_length(self, missing: Any='') -> Union[str, Any]:
+        return self._value('focal_length', missing)
+
+    def camera_make(self, missing: Any='') -> Union[str, Any]:
+        return self._value('camera_make', missing)
+
+    def camera_model(self, missing: Any='') -> Union[str, Any]:
+        return self._value('camera_model', missing)
+
+    def short_camera_model(self, includeCharacters: str='', missing: Any='') -> Union[str, Any]:
+        return self._value('short_camera_model', missing, includeCharacters=includeCharacters)
+
+    def camera_serial(self, missing: Any='') -> Union[str, Any]:
+        return self._value('camera_serial', missing)
+
+    def shutter_count(self, missing: Any='') -> Union[str, Any]:
+        return self._value('shutter_count', missing)
+
+    def file_number(self, missing: Any='') -> Union[str, Any]:
+        return self._value('file_number', missing)
+
+    def owner_name(self, missing: Any='') -> Union[str, Any]:
+        return self._value('owner_name', missing)
+
+    def copyright(self, missing: Any='') -> Union[str, Any]:
+        return self._value('copyright', missing)
+
+    def artist(self, missing: Any='') -> Union[str, Any]:
+        return self._value('artist', missing)
+
+    def codec(self, missing: Any='') -> Union[str, Any]:
+        return self._value('codec', missing)
+
+    def width(self, missing: Any='') -> Union[str, Any]:
+        return self._value('width', missing)
+
+    def height(self, missing: Any='') -> Union[str, Any]:
+        return self._value('height', missing)
+
+    def length(self, missing: Any='') -> Union[str, Any]:
+        return self._value('length', missing)
+
+    def frames_per_second(self, missing: Any='') -> Union[str, Any]:
+        return self._value('frames_per_second', missing)
+
+
+class MetadataCacheSql:
+    """
+    Cache of the metadata values used to generate thumbnails, file names
+    and subfolder names, so that a file's metadata need not be read again
+    each time the file is scanned or downloaded.
+
+    Values are cached as they are read, and written to the database in
+    batches. Call flush() before the process exits.
+    """
+
+    # Files whose values are cached or used are recorded in the database
+    # in batches, rather than writing to the database for each file
+    write_batch_size = 50
+    write_batch_time = 5.0  # seconds
+
+    def __init__(self) -> None:
+        cache_dir = get_program_cache_directory(create_if_not_exist=True)
+        self.valid = cache_dir is not None
+        if not self.valid:
+            return
+        try:
+            self.metadata_db = MetadataCacheSQL(cache_dir)
+        except sqlite3.Error as e:
+            logging.error("Failed to open the metadata cache in %s: %s", cache_dir, e)
+            self.valid = False
+            return
+        self.md5 = MD5Name()
+        # Values not yet written to the database, indexed by uri, size,
+        # modification time and metadata reader
+        self.pending = {}  # type: Dict[Tuple[str, int, float, str], Dict[Tuple, Any]]
+        # Files whose values were used but that use is not yet recorded in
+        # the database: time used, uri, size, mtime, metadata reader
+        self.accessed = []  # type: List[Tuple[float, str, int, float, str]]
+        self.pending_since = 0.0
+        # Cache statistics not yet added to those in the database
+        self.hits = self.misses = 0
+
+    def _key(self, rpd_file, force_exiftool: bool) -> Tuple[str, int, float, str]:
+        if rpd_file.file_type == FileType.video:
+            reader = 'video'
+        elif force_exiftool or fileformats.use_exiftool_on_photo(
+                rpd_file.extension, preview_extraction_irrelevant=True):
+            reader = 'exiftool'
+        else:
+            reader = 'exiv2'
+        uri = self.md5.get_uri(rpd_file.full_file_name, rpd_file.camera_model)
+        return uri, rpd_file.size, rpd_file.modification_time, reader
+
+    def _get_values(self, key: Tuple[str, int, float, str]) -> Optional[Dict[Tuple, Any]]:
+        values = self.pending.get(key)
+        if values is None:
+            try:
+                values = self.metadata_db.get_values(*key)
+            except (sqlite3.Error, pickle.PickleError, RetryError) as e:
+                logging.warning("Could not read from metadata cache: %s", e)
+                values = None
+        if values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._add_pending(accessed=key)
+        return values
+
+    def _add_pending(self, accessed: Optional[Tuple[str, int, float, str]]=None,
+                     key: Optional[Tuple[str, int, float, str]]=None,
+                     values: Optional[Dict[Tuple, Any]]=None) -> None:
+        now = time.time()
+        if not (self.pending or self.accessed):
+            self.pending_since = now
+        if accessed is not None:
+            self.accessed.append((now, ) + accessed)
+        if key is not None:
+            self.pending[key] = values
+        if (len(self.pending) + len(self.accessed) >= self.write_batch_size or
+                now - self.pending_since >= self.write_batch_time):
+            self.flush()
+
+    def load_metadata(self, rpd_file, complete: bool=True, **kwargs) -> bool:
+        """
+        Assign the file's metadata to the rpd file, using values in the
+        cache in place of reading them from the file, where possible.
+
+        The file's metadata is loaded only if it is not in the cache, or
+        when a value is needed that is not in the cache.
+
+        :param rpd_file: photo or video
+        :param complete: whether the metadata is loaded from the file's
+         complete contents. If False, values are used from the cache but
+         not added to it, because they may be incomplete.
+        :param kwargs: arguments to pass to the rpd file's load_metadata()
+        :return: True if successful, False otherwise
+        """
+
+        if not self.valid:
+            return rpd_file.load_metadata(**kwargs)
+
+        key = self._key(rpd_file, kwargs.get('force_exiftool', False))
+        values = self._get_values(key)
+
+        def load() -> Optional[Any]:
+            cached_metadata = rpd_file.metadata
+            if rpd_file.load_metadata(**kwargs):
+                metadata = rpd_file.metadata
+            else:
+                metadata = None
+            rpd_file.metadata = cached_metadata
+            return metadata
+
+        if not complete:
+            key = None
+        if values is None:
+            # Read from the file now, so failure to load it is reported to the caller
+            metadata = load()
+            if metadata is None:
+                return False
+            rpd_file.metadata = CachedMetadata({}, load, key, metadata)
+        else:
+            rpd_file.metadata = CachedMetadata(values, load, key)
+        return True
+
+    def record(self, rpd_file) -> None:
+        """
+        Cache the values read from the file's metadata. Call before
+        purging the rpd file's metadata.
+
+        :param rpd_file: photo or video
+        """
+
+        metadata = rpd_file.metadata
+        if (self.valid and isinstance(metadata, CachedMetadata) and metadata.changed and
+                metadata.key is not None):
+            metadata.changed = False
+            self._add_pending(key=metadata.key, values=metadata.values)
+
+    def flush(self) -> None:
+        """
+        Write values not yet cached to the database, along with when
+        cached values were last used and the cache statistics gathered
+        since the last flush
+        """
+
+        if not self.valid or not (self.pending or self.accessed or self.hits or self.misses):
+            return
+        statistics = dict(hits=self.hits, misses=self.misses)
+        try:
+            self.metadata_db.record(
+                [key + (values, ) for key, values in self.pending.items()], self.accessed,
+                statistics
+            )
+        except (sqlite3.Error, pickle.PickleError, RetryError) as e:
+            logging.warning("Could not write to metadata cache: %s", e)
+        if self.hits or self.misses:
+            logging.debug(
+                "Metadata cache: %s hits, %s misses since last update", self.hits, self.misses
+            )
+        self.pending = {}
+        self.accessed = []
+        self.hits = self.misses = 0
+
+    def statistics(self) -> MetadataCacheStatistics:
+        """
+        :return: the number of cache hits and misses, in all processes
+         using the cache
+        """
+
+        if not self.valid:
+            return MetadataCacheStatistics(0, 0)
+        self.flush()
+        statistics = self.metadata_db.statistics()
+        return MetadataCacheStatistics(statistics.get('hits', 0), statistics.get('misses', 0))
+
+    def cleanup_cache(self, days: int=30) -> None:
+        """
+        Remove the values of all files whose values have not been used
+        for x days
+
+        :param how many days to remove from
+        """
+
+        if self.valid:
+            self.flush()
+            count = self.metadata_db.delete_not_accessed_since(time.time() - 60 * 60 * 24 * days)
+            if count:
+                logging.debug(
+                    'Deleted metadata of %s files that had not been accessed for %s or more days',
+                    count, days
+                )
+
+
+class ThumbnailCacheEvictor(threading.Thread):
+    """
+    Keep the thumbnail cache within its maximum size, removing the least
+    recently used thumbnails in the background while the program runs
+    """
+
+    def __init__(self, max_size: int, interval: float=600.0) -> None:
+        """
+        :param max_size: maximum bytes thumbnails may use
+        :param interval: time in seconds between checks of the cache size
+        """
+
+        super().__init__(name='ThumbnailCacheEvictor', daemon=True)
+        self.max_size = max_size
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        cache = ThumbnailCacheSql(create_table_if_not_exists=False)
+        while not self.stop_event.is_set():
+            try:
+                cache.evict_lru(self.max_size, stop_event=self.stop_event)
+            except (sqlite3.OperationalError, RetryError, OSError) as e:
+                logging.warning("Could not evict thumbnails from the thumbnail cache: %s", e)
+            self.stop_event.wait(self.interval)
+        if cache.valid:
+            cache.packed.close()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
 
 
 if __name__ == '__main__':
@@ -27,6 +27,8 @@ import os
 import io
 from collections import namedtuple
 import re
+import queue
+import threading
 from typing import Optional, List, Tuple, Union
 
 import gphoto2 as gp
@@ -591,6 +593,14 @@ class Camera:
          and the bytes that were copied
         """
 
+        if not return_file_bytes:
+            self.stream_file_by_chunks(
+                dir_name=dir_name, file_name=file_name, size=size,
+                dest_full_filename=dest_full_filename, progress_callback=progress_callback,
+                check_for_command=check_for_command, chunk_size=chunk_size
+            )
+            return None
+
         src_bytes = None
         view = memoryview(bytearray(size))
         amount_downloaded = 0
@@ -635,6 +645,116 @@ class Camera:
         if return_file_bytes:
             return src_bytes
 
+    def stream_file_by_chunks(self, dir_name: str,
+                              file_name: str,
+                              size: int,
+                              dest_full_filename: str,
+                              progress_callback,
+                              check_for_command,
+                              checksum=None,
+                              chunk_size=1048576) -> None:
+        """
+        Save a file from the camera to disk, writing each chunk as it is read.
+
+        Unlike save_file_by_chunks(), memory use is constant regardless of the
+        size of the file. Chunks are written (and the checksum updated) in a
+        background thread, so the next chunk is read from the camera while the
+        previous chunk is being written.
+
+        :param dir_name: directory on the camera
+        :param file_name: the photo or video
+        :param size: the size of the file in bytes
+        :param dest_full_filename: full path including filename where
+         the file will be saved
+        :param progress_callback: a function with which to update
+         copy progress
+        :param check_for_command: a function with which to check to see
+         if the execution should pause, resume or stop
+        :param checksum: if not None, an object with a hashlib style update()
+         method, which is updated with each chunk as it is written
+        :param chunk_size: the size of the chunks to copy. The default
+         is 1MB.
+        """
+
+        try:
+            dest_file = io.open(dest_full_filename, 'wb')
+        except (OSError, PermissionError) as ex:
+            self._log_save_error(dir_name, file_name, ex)
+            raise CameraProblemEx(code=CameraErrorCode.write, py_exception=ex)
+
+        # Three buffers: one being read into, one being written, and one spare so
+        # the reader rarely waits on the writer
+        free_buffers = queue.Queue()  # type: queue.Queue
+        for i in range(3):
+            free_buffers.put(memoryview(bytearray(chunk_size)))
+        to_write = queue.Queue()  # type: queue.Queue
+        write_errors = []
+
+        def write_chunks() -> None:
+            while True:
+                item = to_write.get()
+                if item is None:
+                    return
+                buffer, length = item
+                if not write_errors:
+                    try:
+                        chunk = buffer[:length]
+                        dest_file.write(chunk)
+                        if checksum is not None:
+                            checksum.update(chunk)
+                    except (OSError, PermissionError) as ex:
+                        write_errors.append(ex)
+                free_buffers.put(buffer)
+
+        writer = threading.Thread(target=write_chunks, daemon=True)
+        writer.start()
+
+        amount_downloaded = 0
+        try:
+            for offset in range(0, size, chunk_size):
+                check_for_command()
+                if write_errors:
+                    break
+                length = min(chunk_size, size - offset)
+                buffer = free_buffers.get()
+                try:
+                    bytes_read = gp.check_result(
+                        self.camera.file_read(
+                            dir_name, file_name, gp.GP_FILE_TYPE_NORMAL, offset,
+                            buffer[:length], self.context
+                        )
+                    )
+                except gp.GPhoto2Error as ex:
+                    logging.error(
+                        'Error copying file %s from camera %s: %s',
+                        os.path.join(dir_name, file_name), self.display_name,
+                        gphoto2_named_error(ex.code)
+                    )
+                    if progress_callback is not None:
+                        progress_callback(size, size)
+                    raise CameraProblemEx(code=CameraErrorCode.read, gp_exception=ex)
+                to_write.put((buffer, bytes_read))
+                amount_downloaded += bytes_read
+                if progress_callback is not None:
+                    progress_callback(amount_downloaded, size)
+        finally:
+            to_write.put(None)
+            writer.join()
+            try:
+                dest_file.close()
+            except (OSError, PermissionError) as ex:
+                write_errors.append(ex)
+
+        if write_errors:
+            self._log_save_error(dir_name, file_name, write_errors[0])
+            raise CameraProblemEx(code=CameraErrorCode.write, py_exception=write_errors[0])
+
+    def _log_save_error(self, dir_name: str, file_name: str, ex: Exception) -> None:
+        logging.error(
+            'Error saving file %s from camera %s. Error %s: %s',
+            os.path.join(dir_name, file_name), self.display_name, ex.errno, ex.strerror
+        )
+
     def get_thumbnail(self, dir_name: str,
                       file_name: str,
                       ignore_embedded_thumbnail=False,
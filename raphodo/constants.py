@@ -241,6 +241,12 @@ class BackupStatus(Enum):
     backup_completed = 2
 
 
+class ChecksumAlgorithm(IntEnum):
+    md5 = 1
+    blake2b = 2
+    xxh64 = 3
+
+
 class ThumbnailSize(IntEnum):
     width = 160
     height = 120
@@ -800,6 +806,16 @@ class ScalingDetected(Enum):
     undetected = 4
 
 
+class MessageField(Enum):
+    integer = 1
+    boolean = 2
+    string = 3
+    # Binary data sent in a 0MQ frame of its own, e.g. a thumbnail
+    payload = 4
+    # Any other value, which is pickled
+    pickled = 5
+
+
 # Use the character . to for download_name and path to indicate the user manually marked a
 # file as previously downloaded
 manually_marked_previously_downloaded = '.'
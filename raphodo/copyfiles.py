@@ -27,9 +27,9 @@ import errno
 import io
 import shutil
 import stat
-import hashlib
 import logging
 import pickle
+import fcntl
 from operator import attrgetter
 from itertools import chain
 from collections import defaultdict
@@ -49,8 +49,11 @@ from raphodo.camera import (
 from raphodo.interprocess import (
     WorkerInPublishPullPipeline, CopyFilesArguments, CopyFilesResults
 )
-from raphodo.constants import (FileType, DownloadStatus, CameraErrorCode)
-from raphodo.utilities import (GenerateRandomFileName, create_temp_dirs, same_device)
+from raphodo.serialization import encode_message
+from raphodo.constants import (FileType, DownloadStatus, CameraErrorCode, ChecksumAlgorithm)
+from raphodo.utilities import (
+    GenerateRandomFileName, create_temp_dirs, same_device, new_checksum, file_checksum
+)
 from raphodo.rpdfile import RPDFile
 from raphodo.problemnotification import (
     CopyingProblems, CameraFileReadProblem, FileWriteProblem, FileMoveProblem, FileDeleteProblem,
@@ -122,9 +125,35 @@ def copy_camera_file_metadata(mtime: float, dst: str) -> Optional[Tuple]:
         return inst,  # note the comma: return a Tuple
 
 
+# ioctl request to clone a file's extents (reflink) on e.g. btrfs and xfs
+FICLONE = 0x40049409
+
+# Error codes indicating a kernel copy mechanism cannot be used for this pair of files,
+# meaning the copy should fall back to the next (slower) mechanism
+_kernel_copy_unsupported = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.ENOTTY, errno.EPERM,
+    getattr(errno, 'EOPNOTSUPP', errno.ENOSYS), getattr(errno, 'ENOTSUP', errno.ENOSYS),
+}
+
+
 class FileCopy:
     """
     Used by classes CopyFilesWorker and BackupFilesWorker
+
+    Files are copied using the fastest mechanism available, in this order:
+
+    1. reflink (clone the source's extents), when source and destination are on the
+       same file system
+    2. os.copy_file_range()
+    3. os.sendfile()
+    4. read() and write() in Python
+
+    The first three keep file contents in the kernel. Each mechanism that is found
+    to be unsupported is not tried again for the life of the worker.
+
+    When a file must be verified, its contents are needed in Python to calculate its
+    checksum, so the read() / write() loop is used. The checksum is calculated
+    incrementally as each chunk is copied.
     """
     def __init__(self):
         self.io_buffer = 1024 * 1024
@@ -134,6 +163,14 @@ class FileCopy:
         self.bytes_downloaded = 0
         self.total_downloaded = 0
 
+        self.checksum_algorithm = ChecksumAlgorithm.md5
+        # Checksum of the most recently copied file, when verifying files
+        self.checksum = None  # type: Optional[str]
+
+        self.reflink_supported = hasattr(fcntl, 'ioctl')
+        self.copy_file_range_supported = hasattr(os, 'copy_file_range')
+        self.sendfile_supported = hasattr(os, 'sendfile')
+
     def cleanup_pre_stop(self):
         if self.dest is not None:
             self.dest.close()
@@ -143,34 +180,142 @@ class FileCopy:
     def init_copy_progress(self) -> None:
         self.bytes_downloaded = 0
 
+    def reflink(self, source: str, destination: str, total: int) -> bool:
+        """
+        Attempt to clone the source file's extents into the destination file
+
+        :return: True if the clone succeeded, else False
+        """
+
+        if not self.reflink_supported or not total:
+            return False
+        try:
+            if not same_device(source, os.path.dirname(destination)):
+                return False
+            fcntl.ioctl(self.dest.fileno(), FICLONE, self.src.fileno())
+        except OSError as e:
+            if e.errno not in _kernel_copy_unsupported:
+                raise
+            if e.errno in (errno.ENOSYS, errno.ENOTTY):
+                self.reflink_supported = False
+            return False
+        return True
+
+    def kernel_copy(self, total: int) -> int:
+        """
+        Copy the source to the destination using copy_file_range() or sendfile(), in
+        chunks of the same size as the Python read / write loop, so that the checks for
+        pause / stop and the progress updates occur as often.
+
+        :param total: size of the file in bytes
+        :return: the number of bytes copied, which will be less than the size of the
+         file if neither mechanism is supported
+        """
+
+        src_fd = self.src.fileno()
+        dest_fd = self.dest.fileno()
+        amount_downloaded = 0
+
+        while self.copy_file_range_supported:
+            self.check_for_controller_directive()
+            try:
+                copied = os.copy_file_range(
+                    src_fd, dest_fd, self.io_buffer, amount_downloaded, amount_downloaded
+                )
+            except OSError as e:
+                if e.errno not in _kernel_copy_unsupported:
+                    raise
+                if amount_downloaded == 0 and e.errno != errno.EXDEV:
+                    self.copy_file_range_supported = False
+                break
+            if not copied:
+                return amount_downloaded
+            amount_downloaded += copied
+            self.update_progress(amount_downloaded, total)
+
+        if not self.sendfile_supported:
+            return amount_downloaded
+
+        # sendfile() writes at the current position in the destination
+        os.lseek(dest_fd, amount_downloaded, os.SEEK_SET)
+        while True:
+            self.check_for_controller_directive()
+            try:
+                copied = os.sendfile(dest_fd, src_fd, amount_downloaded, self.io_buffer)
+            except OSError as e:
+                if e.errno not in _kernel_copy_unsupported:
+                    raise
+                if amount_downloaded == 0:
+                    self.sendfile_supported = False
+                return amount_downloaded
+            if not copied:
+                return amount_downloaded
+            amount_downloaded += copied
+            self.update_progress(amount_downloaded, total)
+
+    def copy_chunks(self, total: int, amount_downloaded: int=0, checksum=None) -> int:
+        """
+        Copy the source to the destination by reading and writing in Python,
+        starting at the offset amount_downloaded.
+
+        :param checksum: if not None, checksum object updated with each chunk
+         that is copied
+        :return: the number of bytes copied
+        """
+
+        if amount_downloaded:
+            self.src.seek(amount_downloaded)
+            self.dest.seek(amount_downloaded)
+
+        while True:
+            # first check if process is being stopped or paused
+            self.check_for_controller_directive()
+
+            chunk = self.src.read(self.io_buffer)
+            if chunk:
+                self.dest.write(chunk)
+                if checksum is not None:
+                    checksum.update(chunk)
+                amount_downloaded += len(chunk)
+                self.update_progress(amount_downloaded, total)
+            else:
+                break
+
+        return amount_downloaded
+
     def copy_from_filesystem(self, source: str, destination: str, rpd_file: RPDFile) -> bool:
-        src_chunks = []
+        """
+        Copy a file, and if the file is being verified, calculate its checksum, which
+        is stored in self.checksum.
+
+        :return: True if the copy succeeded, else False
+        """
+
+        self.checksum = None
         try:
             self.dest = io.open(destination, 'wb', self.io_buffer)
             self.src = io.open(source, 'rb', self.io_buffer)
             total = rpd_file.size
             amount_downloaded = 0
 
-            while True:
+            if not self.verify_file:
                 # first check if process is being stopped or paused
                 self.check_for_controller_directive()
-
-                chunk = self.src.read(self.io_buffer)
-                if chunk:
-                    self.dest.write(chunk)
-                    if self.verify_file:
-                        src_chunks.append(chunk)
-                    amount_downloaded += len(chunk)
+                if self.reflink(source, destination, total):
+                    amount_downloaded = os.fstat(self.src.fileno()).st_size
                     self.update_progress(amount_downloaded, total)
                 else:
-                    break
+                    amount_downloaded = self.kernel_copy(total)
+                    if amount_downloaded < os.fstat(self.src.fileno()).st_size:
+                        self.copy_chunks(total, amount_downloaded)
+            else:
+                checksum = new_checksum(self.checksum_algorithm)
+                self.copy_chunks(total, checksum=checksum)
+                self.checksum = checksum.hexdigest()
+
             self.dest.close()
             self.src.close()
 
-            if self.verify_file:
-                src_bytes = b''.join(src_chunks)
-                rpd_file.md5 = hashlib.md5(src_bytes).hexdigest()
-
             return True
         except (OSError, FileNotFoundError, PermissionError) as e:
             self.problems.append(
@@ -205,12 +350,11 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
     def terminate_camera_removed(self) -> None:
         self.cleanup_pre_stop()
-        self.content = pickle.dumps(
+        self.content = encode_message(
             CopyFilesResults(
                 scan_id=self.scan_id,
                 camera_removed=True
-            ),
-            pickle.HIGHEST_PROTOCOL
+            )
         )
         self.send_message_to_sink()
         self.disconnect_logging()
@@ -233,11 +377,10 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         encountered.
         """
 
-        self.content = pickle.dumps(
+        self.content = encode_message(
             CopyFilesResults(
                 scan_id=self.scan_id, problems=self.problems
-            ),
-            pickle.HIGHEST_PROTOCOL
+            )
         )
         self.send_message_to_sink()
 
@@ -253,12 +396,11 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
         chunk_downloaded = amount_downloaded - self.bytes_downloaded
         if (chunk_downloaded > self.batch_size_bytes) or (amount_downloaded == total):
             self.bytes_downloaded = amount_downloaded
-            self.content = pickle.dumps(
+            self.content = encode_message(
                 CopyFilesResults(
                     scan_id=self.scan_id,
                     total_downloaded=self.total_downloaded + amount_downloaded,
-                    chunk_downloaded=chunk_downloaded),
-               pickle.HIGHEST_PROTOCOL)
+                    chunk_downloaded=chunk_downloaded))
             self.send_message_to_sink()
 
             # if amount_downloaded == total:
@@ -266,15 +408,20 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
     def copy_from_camera(self, rpd_file: RPDFile) -> bool:
 
+        if self.verify_file:
+            checksum = new_checksum(self.checksum_algorithm)
+        else:
+            checksum = None
+
         try:
-            src_bytes = self.camera.save_file_by_chunks(
+            self.camera.stream_file_by_chunks(
                 dir_name=rpd_file.path,
                 file_name=rpd_file.name,
                 size=rpd_file.size,
                 dest_full_filename=rpd_file.temp_full_file_name,
                 progress_callback=self.update_progress,
                 check_for_command=self.check_for_controller_directive,
-                return_file_bytes=self.verify_file
+                checksum=checksum
             )
         except CameraProblemEx as e:
             name = rpd_file.name
@@ -288,11 +435,15 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                 self.problems.append(FileWriteProblem(name=name, uri=uri, exception=e.py_exception))
             return False
 
-        if self.verify_file:
-            rpd_file.md5 = hashlib.md5(src_bytes).hexdigest()
+        if checksum is not None:
+            self.assign_checksum(rpd_file, checksum.hexdigest())
 
         return True
 
+    def assign_checksum(self, rpd_file: RPDFile, checksum: Optional[str]) -> None:
+        rpd_file.checksum = checksum
+        rpd_file.checksum_algorithm = self.checksum_algorithm
+
     def copy_associate_file(self, rpd_file: RPDFile, temp_name: str,
                             dest_dir: str, associate_file_fullname: str,
                             file_type: str) -> Optional[str]:
@@ -351,6 +502,7 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
         self.scan_id = args.scan_id
         self.verify_file = args.verify_file
+        self.checksum_algorithm = args.checksum_algorithm
 
         self.camera = None
 
@@ -400,13 +552,12 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
             args.photo_download_folder, args.video_download_folder)
 
         # Notify main process of temp directory names
-        self.content = pickle.dumps(
+        self.content = encode_message(
             CopyFilesResults(
                 scan_id=args.scan_id,
                 photo_temp_dir=photo_temp_dir or '',
                 video_temp_dir=video_temp_dir or ''
-            ),
-            pickle.HIGHEST_PROTOCOL
+            )
         )
         self.send_message_to_sink()
 
@@ -459,10 +610,10 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                                 name=rpd_file.name, uri=rpd_file.get_uri(), exception=inst
                             )
                         )
-                    if self.verify_file:
-                        rpd_file.md5 = hashlib.md5(
-                            open(temp_full_file_name, 'rb').read()
-                        ).hexdigest()
+                    if self.verify_file and copy_succeeded:
+                        self.assign_checksum(
+                            rpd_file, file_checksum(temp_full_file_name, self.checksum_algorithm)
+                        )
                     self.update_progress(rpd_file.size, rpd_file.size)
                 else:
                     # The download folder changed since the scan occurred, and is now
@@ -472,6 +623,8 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                     source = rpd_file.cache_full_file_name
                     destination = temp_full_file_name
                     copy_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
+                    if self.verify_file and copy_succeeded:
+                        self.assign_checksum(rpd_file, self.checksum)
                     try:
                         os.remove(source)
                     except (OSError, PermissionError, FileNotFoundError) as e:
@@ -516,6 +669,8 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
                     source = rpd_file.full_file_name
                     destination = rpd_file.temp_full_file_name
                     copy_succeeded = self.copy_from_filesystem(source, destination, rpd_file)
+                    if self.verify_file and copy_succeeded:
+                        self.assign_checksum(rpd_file, self.checksum)
 
             # increment this amount regardless of whether the copy actually
             # succeeded or not. It's necessary to keep the user informed.
@@ -564,14 +719,13 @@ class CopyFilesWorker(WorkerInPublishPullPipeline, FileCopy):
 
             download_count = idx + 1
 
-            self.content = pickle.dumps(
+            self.content = encode_message(
                 CopyFilesResults(
                     copy_succeeded=copy_succeeded,
                     rpd_file=rpd_file,
                     download_count=download_count,
                     mdata_exceptions=mdata_exceptions
-                ),
-                pickle.HIGHEST_PROTOCOL
+                )
             )
             self.send_message_to_sink()
 
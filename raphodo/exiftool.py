@@ -59,6 +59,8 @@ The function set_pdeathsig is used to automatically terminate the process when t
 program exits.
 Added call to exiftool_version_info()
 Added execute_binary()
+Added ExifToolBatch
+Read output into a growing buffer instead of concatenating bytes
 """
 
 from __future__ import unicode_literals
@@ -69,6 +71,8 @@ import os
 import json
 import warnings
 import codecs
+import time
+from collections import OrderedDict
 
 from raphodo.programversions import exiftool_version_info
 from raphodo.utilities import set_pdeathsig
@@ -91,6 +95,9 @@ sentinel = b"{ready}"
 # some cases.
 block_size = 4096
 
+# Bytes removed from the start and end of exiftool's output, as bytes.strip() does
+_whitespace = frozenset(b" \t\n\r\x0b\x0c")
+
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
 def _fscodec():
@@ -216,6 +223,19 @@ class ExifTool(object):
         del self._process
         self.running = False
 
+    def kill(self):
+        """Kill the ``exiftool`` process of this instance, for instance
+        when it has stopped responding.
+
+        If the subprocess isn't running, this method will do nothing.
+        """
+        if not self.running:
+            return
+        self._process.kill()
+        self._process.communicate()
+        del self._process
+        self.running = False
+
     def __enter__(self):
         self.start()
         return self
@@ -245,15 +265,47 @@ class ExifTool(object):
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
+        output = self._execute(params)
+        return bytes(output)
+
+    def _execute(self, params):
+        """Run the parameters and return exiftool's output as a
+        bytes-like object, excluding the sentinel.
+
+        The output is read directly into a buffer that doubles in size
+        as needed, so reading large outputs such as preview images takes
+        time linear in their size.
+        """
         if not self.running:
             raise ValueError("ExifTool instance not running.")
         self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
         self._process.stdin.flush()
-        output = b""
         fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+        output = bytearray(block_size)
+        length = 0
+        while True:
+            if length == len(output):
+                output.extend(bytes(length))
+            with memoryview(output) as view, view[length:] as free:
+                read = os.readv(fd, [free])
+            if not read:
+                raise ValueError("ExifTool process closed its output.")
+            length += read
+            # Only the end of the output that might contain the sentinel
+            # needs to be searched
+            if output[max(0, length - 32):length].strip().endswith(sentinel):
+                break
+
+        end = length
+        while end and output[end - 1] in _whitespace:
+            end -= 1
+        del output[end - len(sentinel):]
+        start = 0
+        while start < len(output) and output[start] in _whitespace:
+            start += 1
+        if start:
+            del output[:start]
+        return output
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -277,16 +329,16 @@ class ExifTool(object):
         respective Python version – as raw strings in Python 2.x and
         as Unicode strings in Python 3.x.
         """
-        params = map(fsencode, params)
-        return json.loads(self.execute(b"-j", b"-n", *params).decode("utf-8"))
+        params = tuple(map(fsencode, params))
+        return json.loads(str(self._execute((b"-j", b"-n") + params), "utf-8"))
 
     def execute_json_no_formatting(self, *params):
-        params = map(fsencode, params)
-        return json.loads(self.execute(b"-j", *params).decode("utf-8"))
+        params = tuple(map(fsencode, params))
+        return json.loads(str(self._execute((b"-j",) + params), "utf-8"))
 
     def execute_binary(self, *params):
-        params = map(fsencode, params)
-        return self.execute(b"-b", *params)
+        params = tuple(map(fsencode, params))
+        return bytes(self._execute((b"-b",) + params))
 
     def get_metadata_batch(self, filenames):
         """Return all meta-data for the given files.
@@ -360,3 +412,102 @@ class ExifTool(object):
         ``None`` if this tag was not found in the file.
         """
         return self.get_tag_batch(tag, [filename])[0]
+
+
+class ExifToolBatch(object):
+    """Collect metadata requests for many files and read them with one
+    ``exiftool`` request.
+
+    Callers queue the files whose metadata they are going to need with
+    :py:meth:`queue()`.  When :py:meth:`get_metadata()` is next called
+    for a file that has not already been read, that file and as many
+    queued files as the current batch size allows are passed to
+    ``exiftool`` in a single ``-j`` request, and the results are held
+    until each caller asks for its file.
+
+    The batch size adapts to how long ``exiftool`` takes to answer: it
+    halves when a batch takes longer than the target latency, and
+    doubles when a batch is answered in less than half of it.
+
+    All other methods are those of the wrapped :py:class:`ExifTool`
+    instance, so an instance of this class can be used wherever an
+    :py:class:`ExifTool` instance is expected.
+    """
+
+    def __init__(self, et_process, target_latency=0.5, initial_batch_size=8,
+                 max_batch_size=64):
+        """
+
+        :param et_process: running ExifTool instance
+        :param target_latency: the time in seconds a batch should take
+        :param initial_batch_size: number of files in the first batch
+        :param max_batch_size: maximum number of files in a batch
+        """
+        self.et_process = et_process
+        self.target_latency = target_latency
+        self.max_batch_size = max_batch_size
+        self.batch_size = min(initial_batch_size, max_batch_size)
+        self.pending = OrderedDict()
+        self.results = {}
+        self.unread = set()
+
+    def __getattr__(self, name):
+        return getattr(self.et_process, name)
+
+    def queue(self, filenames):
+        """Queue files whose metadata will be needed soon.
+
+        :param filenames: iterable of file names
+        """
+        for filename in filenames:
+            if filename not in self.results and filename not in self.unread:
+                self.pending[filename] = None
+
+    def clear(self):
+        """Forget queued files and any metadata not yet collected."""
+        self.pending.clear()
+        self.results.clear()
+        self.unread.clear()
+
+    def _read_batch(self, filename):
+        self.pending.pop(filename, None)
+        batch = [filename]
+        while self.pending and len(batch) < self.batch_size:
+            batch.append(self.pending.popitem(last=False)[0])
+
+        start = time.perf_counter()
+        try:
+            metadata = self.et_process.execute_json(*batch)
+        except ValueError:
+            if len(batch) == 1:
+                raise
+            # One malformed file can spoil the output for the entire batch
+            metadata = []
+            self.batch_size = max(1, self.batch_size // 2)
+        else:
+            elapsed = time.perf_counter() - start
+            if elapsed > self.target_latency:
+                self.batch_size = max(1, self.batch_size // 2)
+            elif elapsed < self.target_latency / 2 and len(batch) == self.batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+
+        for d in metadata:
+            self.results[d.get("SourceFile")] = d
+        # Files exiftool did not return metadata for as part of the batch
+        # are read individually when they are asked for
+        self.unread.update(name for name in batch if name not in self.results)
+
+    def get_metadata(self, filename):
+        """Return meta-data for a single file, reading it together with
+        queued files if it has not already been read.
+
+        The returned dictionary has the format described in the
+        documentation of :py:meth:`ExifTool.execute_json()`.
+        """
+        if filename not in self.results and filename not in self.unread:
+            self._read_batch(filename)
+        try:
+            return self.results.pop(filename)
+        except KeyError:
+            self.unread.discard(filename)
+            return self.et_process.get_metadata(filename)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Pool of ExifTool processes shared by every process in the program.
+
+Starting ExifTool takes several hundred milliseconds, and each instance
+uses its own memory. Instead of every worker starting its own instance,
+the pool runs in a process of its own and the workers send their ExifTool
+commands to it using ExifToolClient, which has the same methods as
+ExifTool.
+
+Requests wait in a queue until one of the pool's ExifTool processes is
+free. ExifTool processes are started only when requests are waiting and
+no process is free, up to a maximum. A request that takes longer than its
+timeout has its ExifTool process killed, and a new one is started for the
+next request.
+
+The main process tells its child processes the port the pool listens on
+using an environment variable, so that any worker can use the pool
+without it being passed on the command line.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import argparse
+import itertools
+import logging
+import os
+import signal
+import threading
+import time
+import warnings
+from collections import deque
+from typing import Dict, List, Optional
+
+import zmq
+
+from raphodo.exiftool import ExifTool
+from raphodo.interprocess import ProcessLoggerPublisher
+
+# Environment variable holding the port of the pool's frontend
+pool_port_variable = 'RPD_EXIFTOOL_POOL_PORT'
+
+# Default time in seconds a request may take once it is running, and also
+# the time it may wait in the queue before it is run
+request_timeout = 30.0
+
+backend_address = 'inproc://exiftool_pool'
+
+
+def get_exiftool() -> ExifTool:
+    """
+    :return: a client of the ExifTool pool if it is running, else a new
+     ExifTool instance. Either must be started before use.
+    """
+
+    port = os.environ.get(pool_port_variable)
+    if port:
+        return ExifToolClient(port=int(port))
+    return ExifTool()
+
+
+class ExifToolClient(ExifTool):
+    """
+    Send ExifTool commands to the ExifTool pool, which runs them using
+    whichever of its ExifTool processes is free.
+
+    Starting and terminating an instance connects to and disconnects from
+    the pool. Failed requests, and those the pool does not answer in time,
+    raise ValueError.
+    """
+
+    def __init__(self, port: int, timeout: float=request_timeout) -> None:
+        """
+        :param port: port the pool's frontend is listening on
+        :param timeout: time in seconds a request may take once it is
+         running, and also the time it may wait in the pool's queue
+        """
+
+        super().__init__()
+        self.port = port
+        self.timeout = timeout
+        self.request_ids = itertools.count()
+
+    def start(self) -> None:
+        if self.running:
+            warnings.warn("ExifTool client already connected; doing nothing.")
+            return
+
+        self.socket = zmq.Context.instance().socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect("tcp://localhost:{}".format(self.port))
+        self.running = True
+
+    def terminate(self) -> None:
+        if not self.running:
+            return
+        self.socket.close()
+        del self.socket
+        self.running = False
+
+    def kill(self) -> None:
+        self.terminate()
+
+    def _execute(self, params):
+        if not self.running:
+            raise ValueError("ExifTool client not connected.")
+
+        request_id = str(next(self.request_ids)).encode()
+        self.socket.send_multipart(
+            [b'', request_id, str(self.timeout).encode()] + list(params)
+        )
+
+        # The request may wait in the queue for as long as it may run
+        deadline = time.monotonic() + self.timeout * 2 + 1
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.socket.poll(remaining * 1000):
+                raise ValueError("ExifTool pool did not respond in time.")
+            empty, reply_id, status, output = self.socket.recv_multipart(copy=False)
+            if reply_id.bytes == request_id:
+                break
+            # Otherwise it is the reply to an earlier request that timed out
+
+        if status.bytes != b'OK':
+            raise ValueError("ExifTool pool could not run the request: {}".format(
+                status.bytes.decode())
+            )
+        return output.buffer
+
+
+class ExifToolThread(threading.Thread):
+    """
+    Run requests from the pool using one ExifTool process
+    """
+
+    def __init__(self, context: zmq.Context, identity: bytes) -> None:
+        super().__init__(daemon=True)
+        self.context = context
+        self.identity = identity
+        self.et_process = ExifTool()
+        # Process id of the ExifTool process, used by the pool to kill it
+        self.pid = None  # type: Optional[int]
+
+    def run(self) -> None:
+        socket = self.context.socket(zmq.REQ)
+        socket.identity = self.identity
+        socket.connect(backend_address)
+        # ExifTool is started in this thread so it is terminated should the
+        # thread unexpectedly exit
+        self.start_exiftool()
+        socket.send(b'READY')
+
+        while True:
+            frames = socket.recv_multipart()
+            if frames[0] == b'STOP':
+                break
+            client, request_id = frames[:2]
+            if self.et_process.running and self.et_process._process.poll() is not None:
+                # The pool killed the process just after its last request finished
+                self.et_process.kill()
+            if not self.et_process.running:
+                self.start_exiftool()
+            try:
+                output = self.et_process._execute(tuple(frames[2:]))
+                status = b'OK'
+            except (ValueError, OSError):
+                # The pool killed the process because the request timed out,
+                # or it failed on its own
+                self.et_process.kill()
+                output = b''
+                status = b'ERROR'
+            socket.send_multipart([client, request_id, status, output], copy=False)
+
+        self.et_process.terminate()
+        socket.close()
+
+    def start_exiftool(self) -> None:
+        self.et_process.start()
+        if self.et_process.running:
+            self.pid = self.et_process._process.pid
+        else:
+            self.pid = None
+
+
+class ExifToolPool:
+    """
+    Queue requests from clients and distribute them to the ExifTool threads
+    """
+
+    def __init__(self, context: zmq.Context,
+                 frontend: zmq.Socket,
+                 controller: zmq.Socket,
+                 max_processes: int) -> None:
+
+        self.context = context
+        self.frontend = frontend
+        self.controller = controller
+        self.max_processes = max(max_processes, 1)
+
+        self.backend = context.socket(zmq.ROUTER)
+        self.backend.bind(backend_address)
+
+        self.threads = {}  # type: Dict[bytes, ExifToolThread]
+        self.idle = deque()
+        self.starting = 0
+        # When each busy thread's request must finish by
+        self.deadlines = {}  # type: Dict[bytes, float]
+        self.killed = set()
+        # Requests waiting for a thread, and when they were received
+        self.requests = deque()
+
+    def run(self) -> None:
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        poller.register(self.controller, zmq.POLLIN)
+
+        while True:
+            socks = dict(poller.poll(1000))
+            if self.controller in socks:
+                self.controller.recv()
+                break
+            if self.backend in socks:
+                self.handle_backend(self.backend.recv_multipart(copy=False))
+            if self.frontend in socks:
+                self.requests.append((time.monotonic(), self.frontend.recv_multipart()))
+            self.kill_expired()
+            self.dispatch()
+
+        self.stop()
+
+    def handle_backend(self, frames: List[zmq.Frame]) -> None:
+        identity = frames[0].bytes
+        if frames[2].bytes == b'READY':
+            self.starting -= 1
+        else:
+            del self.deadlines[identity]
+            self.killed.discard(identity)
+            self.frontend.send_multipart([frames[2], b''] + frames[3:], copy=False)
+        self.idle.append(identity)
+
+    def dispatch(self) -> None:
+        now = time.monotonic()
+        while self.requests and self.idle:
+            received, frames = self.requests.popleft()
+            client, empty, request_id, timeout = frames[:4]
+            timeout = float(timeout)
+            if now - received > timeout:
+                # The client has stopped waiting for a reply
+                self.frontend.send_multipart([client, b'', request_id, b'TIMEOUT', b''])
+                continue
+            identity = self.idle.popleft()
+            self.backend.send_multipart([identity, b'', client, request_id] + frames[4:])
+            self.deadlines[identity] = now + timeout
+
+        # Start ExifTool processes only when requests are waiting for one
+        while len(self.requests) > self.starting and len(self.threads) < self.max_processes:
+            self.start_thread()
+
+    def start_thread(self) -> None:
+        identity = str(len(self.threads)).encode()
+        logging.debug("Starting ExifTool process %s", identity.decode())
+        thread = ExifToolThread(self.context, identity)
+        self.threads[identity] = thread
+        self.starting += 1
+        thread.start()
+
+    def kill_expired(self) -> None:
+        # Handle replies that arrived since polling, so that a process whose
+        # request has just finished is not killed
+        while self.backend.poll(0):
+            self.handle_backend(self.backend.recv_multipart(copy=False))
+
+        now = time.monotonic()
+        for identity, deadline in self.deadlines.items():
+            if deadline < now and identity not in self.killed:
+                logging.warning(
+                    "Killing ExifTool process %s because its request timed out",
+                    identity.decode()
+                )
+                self.killed.add(identity)
+                self.kill_exiftool(identity)
+
+    def kill_exiftool(self, identity: bytes) -> None:
+        pid = self.threads[identity].pid
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def stop(self) -> None:
+        for identity in self.idle:
+            self.backend.send_multipart([identity, b'', b'STOP'])
+        # Busy threads are not waited for: their ExifTool processes are
+        # killed, and the threads end with this process
+        for identity in self.deadlines:
+            self.kill_exiftool(identity)
+        for identity in self.idle:
+            self.threads[identity].join(timeout=2)
+        self.backend.close(linger=0)
+
+
+def run_pool() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--receive", required=True)
+    parser.add_argument("--controller", required=True)
+    parser.add_argument("--logging", required=True)
+    args = parser.parse_args()
+
+    context = zmq.Context.instance()
+    frontend = context.socket(zmq.ROUTER)
+    frontend_port = frontend.bind_to_random_port('tcp://*')
+
+    reply = context.socket(zmq.REP)
+    reply.connect("tcp://localhost:{}".format(args.receive))
+
+    controller = context.socket(zmq.PULL)
+    controller.connect("tcp://localhost:{}".format(args.controller))
+
+    logger_publisher = ProcessLoggerPublisher(
+        context=context, name='ExifToolPool', notification_port=args.logging
+    )
+
+    max_processes = int(reply.recv())
+    logging.debug("ExifTool pool will use up to %s ExifTool processes", max_processes)
+    reply.send(str(frontend_port).encode())
+    reply.close()
+
+    pool = ExifToolPool(context, frontend, controller, max_processes)
+    pool.run()
+
+    logging.debug("ExifTool pool stopped")
+    frontend.close()
+    controller.close()
+    logger_publisher.close()
+
+
+if __name__ == "__main__":
+    run_pool()
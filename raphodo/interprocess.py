@@ -26,6 +26,7 @@ import pickle
 import os
 import shlex
 import time
+import math
 from collections import deque, namedtuple
 from typing import Optional, Set, List, Dict, Sequence, Any, Tuple, Union
 
@@ -52,9 +53,10 @@ from raphodo.devices import Device
 from raphodo.utilities import CacheDirs, set_pdeathsig
 from raphodo.constants import (
     RenameAndMoveStatus, ExtractionTask, ExtractionProcessing, CameraErrorCode, FileType,
-    FileExtension, BackupStatus
+    FileExtension, BackupStatus, ChecksumAlgorithm, MessageField
 )
-from raphodo.proximity import TemporalProximityGroups
+from raphodo.serialization import register_message, decode_message
+from raphodo.proximity import TemporalProximityGroups, TimelineDiff
 from raphodo.storage import StorageSpace
 from raphodo.iplogging import ZeroMQSocketHandler
 from raphodo.viewutils import ThumbnailDataForProximity
@@ -310,8 +312,10 @@ class PullPipelineManager(ProcessManager, QObject):
                 break
             if self.receiver_socket in socks:
                 # Receive messages from the workers
-                # (or the terminate socket)
-                worker_id, directive, content = self.receiver_socket.recv_multipart()
+                # (or the terminate socket). Frames after the first three are
+                # payloads of an encoded message, which are not copied.
+                frames = self.receiver_socket.recv_multipart(copy=False)
+                worker_id, directive, content = (frame.bytes for frame in frames[:3])
 
                 if directive == b'cmd':
                     command = content
@@ -342,6 +346,7 @@ class PullPipelineManager(ProcessManager, QObject):
                 else:
                     assert directive == b'data'
                     self.content = content
+                    self.payloads = [frame.buffer for frame in frames[3:]]
                     self.process_sink_data()
 
             if self.thread_controller in socks:
@@ -372,7 +377,7 @@ class PullPipelineManager(ProcessManager, QObject):
             logging.critical("%s received unknown directive %s", directive.decode())
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content)
+        data = decode_message(self.content, self.payloads)
         self.message.emit(data)
 
     def terminate_sink(self) -> None:
@@ -452,6 +457,7 @@ class LoadBalancerWorkerManager(ProcessManager):
         self.no_workers = no_workers
         self.backend_port = backend_port
         self.sink_port = sink_port
+        self.next_worker_id = 0
 
     def _get_command_line(self, worker_id: int) -> str:
         cmd = self._get_cmd()
@@ -466,7 +472,51 @@ class LoadBalancerWorkerManager(ProcessManager):
 
     def start_workers(self) -> None:
         for worker_id in range(self.no_workers):
-            self.add_worker(worker_id)
+            self.start_worker()
+
+    def start_worker(self) -> int:
+        """
+        Start a worker with a worker id that has not been used before
+
+        :return: the worker id
+        """
+
+        worker_id = self.next_worker_id
+        self.next_worker_id += 1
+        self.add_worker(worker_id)
+        return worker_id
+
+    def remove_worker(self, worker_id: int) -> None:
+        """
+        Wait for a worker that has stopped to exit, and stop monitoring it
+
+        :param worker_id: the worker that has stopped
+        """
+
+        p = self.processes[worker_id]  # type: psutil.Process
+        try:
+            p.wait(timeout=2)
+        except psutil.TimeoutExpired:
+            logging.warning("Terminating process %s that did not exit when stopped", p.pid)
+            p.terminate()
+        self.workers.remove(worker_id)
+        del self.processes[worker_id]
+
+    def worker_memory(self) -> Optional[int]:
+        """
+        :return: mean resident memory of the workers in bytes, or None if
+         it cannot be determined
+        """
+
+        memory = []
+        for worker_id in self.workers:
+            try:
+                memory.append(self.processes[worker_id].memory_info().rss)
+            except psutil.Error:
+                pass
+        if memory:
+            return sum(memory) // len(memory)
+        return None
 
     def zombie_workers(self) -> List[int]:
         return [
@@ -475,14 +525,105 @@ class LoadBalancerWorkerManager(ProcessManager):
         ]
 
 
+class WorkerPoolPolicy:
+    """
+    Determines how many load balancer workers should be running.
+
+    Using Little's law, the number of workers needed is the rate at which
+    tasks arrive multiplied by how long each task takes. Tasks waiting for
+    a worker increase the number needed. Workers are added only while there
+    is memory available for them, and are removed one at a time and only
+    when idle, so that short lulls in the work do not cause workers to be
+    repeatedly stopped and started.
+    """
+
+    # Allowance for variation in the arrival rate and task duration
+    headroom = 1.25
+
+    def __init__(self, min_workers: int,
+                 max_workers: int,
+                 memory_reserve: int=512 * 1024 * 1024) -> None:
+        """
+        :param min_workers: fewest workers to run
+        :param max_workers: most workers to run
+        :param memory_reserve: system memory in bytes that should remain
+         available after starting workers
+        """
+
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.memory_reserve = memory_reserve
+
+    def workers_needed(self, current: int,
+                       idle: int,
+                       backlog: int,
+                       arrival_rate: float,
+                       latency: Optional[float],
+                       worker_memory: Optional[int],
+                       available_memory: int) -> int:
+        """
+        >>> policy = WorkerPoolPolicy(min_workers=1, max_workers=8)
+        >>> gb = 1024 ** 3
+        >>> policy.workers_needed(2, 0, 0, 20.0, 0.25, gb // 4, 8 * gb)
+        7
+        >>> policy.workers_needed(2, 0, 10, 20.0, 0.25, gb // 4, 8 * gb)
+        8
+        >>> policy.workers_needed(2, 0, 10, 20.0, 0.25, gb // 4, gb)
+        4
+        >>> policy.workers_needed(4, 2, 0, 0.0, 0.25, gb // 4, 8 * gb)
+        3
+        >>> policy.workers_needed(4, 0, 0, 0.0, 0.25, gb // 4, 8 * gb)
+        4
+        >>> policy.workers_needed(4, 3, 0, 0.0, None, gb // 4, 8 * gb)
+        3
+        >>> policy.workers_needed(1, 1, 0, 0.0, None, None, 8 * gb)
+        1
+
+        :param current: number of workers running
+        :param idle: number of workers without a task
+        :param backlog: number of tasks waiting for a worker
+        :param arrival_rate: tasks received per second
+        :param latency: mean seconds a worker takes to complete a task, or
+         None if unknown
+        :param worker_memory: mean memory used by a worker in bytes, or None
+         if unknown
+        :param available_memory: system memory available in bytes
+        :return: the number of workers that should be running
+        """
+
+        if not arrival_rate:
+            needed = 0
+        elif latency is None:
+            needed = current
+        else:
+            needed = math.ceil(arrival_rate * latency * self.headroom)
+        if backlog:
+            needed = max(needed, current + backlog)
+
+        if worker_memory:
+            affordable = current + (available_memory - self.memory_reserve) // worker_memory
+            needed = min(needed, affordable)
+
+        needed = max(self.min_workers, min(self.max_workers, needed))
+
+        if needed < current:
+            # Only idle workers can be stopped
+            needed = current - 1 if idle else current
+        return needed
+
+
 class LRUQueue:
     """LRUQueue class using ZMQStream/IOLoop for event dispatching"""
 
+    # How often in seconds to determine how many workers should be running
+    scale_interval = 2.0
+
     def __init__(self, backend_socket: zmq.Socket,
                  frontend_socket: zmq.Socket,
                  controller_socket: zmq.Socket,
                  worker_type: str,
-                 process_manager: LoadBalancerWorkerManager) -> None:
+                 process_manager: LoadBalancerWorkerManager,
+                 policy: Optional[WorkerPoolPolicy]=None) -> None:
 
         self.worker_type = worker_type
         self.process_manager = process_manager
@@ -491,6 +632,25 @@ class LRUQueue:
         self.terminating_workers = set()  # type: Set[bytes]
         self.stopped_workers = set()  # type: Set[int]
 
+        # Tasks waiting for a worker. Tasks are received from the frontend
+        # until the backlog is full, so its length indicates the demand for
+        # workers.
+        self.tasks = deque()
+        self.max_backlog = max(process_manager.no_workers, 1) * 2
+        self.receiving = False
+
+        # Workers being stopped because they are no longer needed
+        self.retiring_workers = set()  # type: Set[bytes]
+        # When each busy worker was sent its task
+        self.task_started = {}  # type: Dict[bytes, float]
+
+        # Statistics since the number of workers was last evaluated
+        self.tasks_received = 0
+        self.tasks_completed = 0
+        self.total_latency = 0.0
+        self.stats_start = time.time()
+        self.policy = policy
+
         self.backend = ZMQStream(backend_socket)
         self.frontend = ZMQStream(frontend_socket)
         self.controller = ZMQStream(controller_socket)
@@ -498,9 +658,12 @@ class LRUQueue:
         self.controller.on_recv(self.handle_controller)
 
         self.loop = ioloop.IOLoop.instance()
+        if self.policy is not None:
+            self.loop.add_timeout(time.time() + self.scale_interval, self.scale_workers)
 
     def handle_controller(self, msg):
         self.terminating = True
+        self.tasks.clear()
 
         while len(self.workers):
             worker_identity = self.workers.popleft()
@@ -518,6 +681,21 @@ class LRUQueue:
         # Queue worker address for LRU routing
         worker_identity, empty, client_addr = msg[:3]
 
+        if worker_identity in self.retiring_workers:
+            assert msg[-1] == b'STOPPED'
+            self.retiring_workers.remove(worker_identity)
+            self.process_manager.remove_worker(get_worker_id_from_identity(worker_identity))
+            logging.debug(
+                "%s load balancer worker %s has stopped", self.worker_type,
+                worker_identity.decode()
+            )
+            return
+
+        started = self.task_started.pop(worker_identity, None)
+        if started is not None:
+            self.tasks_completed += 1
+            self.total_latency += time.time() - started
+
         # add worker back to the list of workers
         self.workers.append(worker_identity)
 
@@ -547,19 +725,85 @@ class LRUQueue:
                             logging.debug("Process %s is sleeping", pid)
                 self.loop.add_timeout(time.time()+0.5, self.loop.stop)
 
-        if len(self.workers) == 1:
-            # on first recv, start accepting frontend messages
-            self.frontend.on_recv(self.handle_frontend)
+        self.dispatch()
 
     def handle_frontend(self, request):
-        #  Dequeue and drop the next worker address
-        worker_identity = self.workers.popleft()
+        self.tasks.append(request)
+        self.tasks_received += 1
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        """
+        Send waiting tasks to idle workers, and receive tasks from the
+        frontend only while there is room for them in the backlog
+        """
+
+        if self.terminating:
+            return
 
-        message = [worker_identity, b''] + request
-        self.backend.send_multipart(message)
-        if len(self.workers) == 0:
+        while self.tasks and self.workers:
+            #  Dequeue and drop the next worker address
+            worker_identity = self.workers.popleft()
+            message = [worker_identity, b''] + self.tasks.popleft()
+            self.backend.send_multipart(message)
+            self.task_started[worker_identity] = time.time()
+
+        if len(self.tasks) < self.max_backlog:
+            if not self.receiving:
+                self.frontend.on_recv(self.handle_frontend)
+                self.receiving = True
+        elif self.receiving:
             # stop receiving until workers become available again
             self.frontend.stop_on_recv()
+            self.receiving = False
+
+    def scale_workers(self) -> None:
+        """
+        Start or stop workers according to the worker pool policy, and
+        schedule the next evaluation
+        """
+
+        if self.terminating:
+            return
+
+        now = time.time()
+        elapsed = now - self.stats_start
+        arrival_rate = self.tasks_received / elapsed
+        if self.tasks_completed:
+            latency = self.total_latency / self.tasks_completed
+        else:
+            latency = None
+        # Workers that are starting are not yet idle or busy
+        current = len(self.process_manager.workers) - len(self.retiring_workers)
+        available_memory = psutil.virtual_memory().available
+
+        needed = self.policy.workers_needed(
+            current=current, idle=len(self.workers), backlog=len(self.tasks),
+            arrival_rate=arrival_rate, latency=latency,
+            worker_memory=self.process_manager.worker_memory(),
+            available_memory=available_memory
+        )
+
+        if needed != current:
+            logging.info(
+                "%s load balancer changing from %s to %s workers (backlog %s, %.1f tasks per "
+                "second, latency %s, available memory %s MB)",
+                self.worker_type, current, needed, len(self.tasks), arrival_rate,
+                'unknown' if latency is None else '{:.2f}s'.format(latency),
+                available_memory // 1024 // 1024
+            )
+            for i in range(needed - current):
+                self.process_manager.start_worker()
+            for i in range(current - needed):
+                # Stop the worker that has been idle the shortest time
+                worker_identity = self.workers.pop()
+                self.backend.send_multipart([worker_identity, b'', b'cmd', b'STOP'])
+                self.retiring_workers.add(worker_identity)
+
+        self.tasks_received = self.tasks_completed = 0
+        self.total_latency = 0.0
+        self.stats_start = now
+        self.loop.add_timeout(now + self.scale_interval, self.scale_workers)
 
 
 class LoadBalancer:
@@ -606,8 +850,13 @@ class LoadBalancer:
         process_manager = process_manager(no_workers, backend_port, sink_port, logging_port)
         process_manager.start_workers()
 
+        # Start with the maximum number of workers, so thumbnails are generated
+        # as quickly as possible when the program starts. Thereafter scale the
+        # number of workers to match the work.
+        policy = WorkerPoolPolicy(min_workers=1, max_workers=no_workers)
+
         # create queue with the sockets
-        queue = LRUQueue(backend, frontend, controller, worker_type, process_manager)
+        queue = LRUQueue(backend, frontend, controller, worker_type, process_manager, policy)
 
         # start reactor, which is an infinite loop
         ioloop.IOLoop.instance().start()
@@ -673,8 +922,72 @@ class LoadBalancerManager(ProcessManager, QObject):
             self.logging_port
         )
 
+class ExifToolPoolManager(ProcessManager):
+    """
+    Launches and requests termination of the ExifTool pool process
+    """
+
+    # How long in seconds to wait for the pool to report the port it is using
+    start_timeout = 10
+
+    def __init__(self, max_processes: int, logging_port: int) -> None:
+        super().__init__(logging_port=logging_port, thread_name='')
+        self.max_processes = max_processes
+        self._process_name = 'ExifTool Pool Manager'
+        self._process_to_run = 'exiftoolpool.py'
+
+    def start(self) -> Optional[int]:
+        """
+        Start the pool and wait for it to be ready
+
+        :return: port the pool's frontend is listening on, or None if the
+         pool could not be started
+        """
+
+        context = zmq.Context.instance()
+        self.controller_socket = context.socket(zmq.PUSH)
+        self.controller_port = self.controller_socket.bind_to_random_port('tcp://*')
+
+        requester = context.socket(zmq.REQ)
+        requester.setsockopt(zmq.LINGER, 0)
+        self.requester_port = requester.bind_to_random_port('tcp://*')
+
+        self.add_worker(0)
+        requester.send(str(self.max_processes).encode())
+        if requester.poll(self.start_timeout * 1000):
+            frontend_port = int(requester.recv())
+        else:
+            logging.error("The ExifTool pool did not start")
+            self.forcefully_terminate()
+            frontend_port = None
+        requester.close()
+        return frontend_port
+
+    def stop(self) -> None:
+        self.controller_socket.send(b'STOP')
+        try:
+            self.processes[0].wait(timeout=3)
+        except psutil.TimeoutExpired:
+            self.forcefully_terminate()
+        self.controller_socket.close()
+
+    def _get_command_line(self, worker_id: int) -> str:
+        cmd = self._get_cmd()
+
+        return '{} --receive {} --controller {} --logging {}'.format(
+            cmd,
+            self.requester_port,
+            self.controller_port,
+            self.logging_port
+        )
+
+
 DAEMON_WORKER_ID = 0
 
+# Worker id of the backup process that backs up to every backup device at once.
+# Backup devices' ids start at zero and increase, so this can never clash with one.
+FAN_OUT_BACKUP_WORKER_ID = -1
+
 
 class PushPullDaemonManager(PullPipelineManager):
     """
@@ -924,8 +1237,8 @@ class WorkerProcess():
         )
 
     def send_message_to_sink(self) -> None:
-
-        self.sender.send_multipart([self.worker_id, b'data', self.content])
+        # self.content holds the frames of an encoded message
+        self.sender.send_multipart([self.worker_id, b'data'] + self.content, copy=False)
 
     def initialise_process(self) -> None:
         # Wait to receive "START" message
@@ -993,7 +1306,7 @@ class DaemonProcess(WorkerProcess):
         # Must use a dummy value for the worker id, as there is only ever one
         # instance.
         self.sender.send_multipart(
-            [make_filter_from_worker_id(DAEMON_WORKER_ID), b'data', self.content]
+            [make_filter_from_worker_id(DAEMON_WORKER_ID), b'data'] + self.content, copy=False
         )
 
 
@@ -1305,7 +1618,8 @@ class CopyFilesArguments:
                   files: List[RPDFile],
                   verify_file: bool,
                   generate_thumbnails: bool,
-                  log_gphoto2: bool) -> None:
+                  log_gphoto2: bool,
+                  checksum_algorithm: ChecksumAlgorithm=ChecksumAlgorithm.md5) -> None:
         self.scan_id = scan_id
         self.device = device
         self.photo_download_folder = photo_download_folder
@@ -1313,6 +1627,7 @@ class CopyFilesArguments:
         self.files = files
         self.generate_thumbnails = generate_thumbnails
         self.verify_file = verify_file
+        self.checksum_algorithm = checksum_algorithm
         self.log_gphoto2 = log_gphoto2
 
 
@@ -1424,12 +1739,24 @@ class RenameAndMoveFileResults:
 
 
 class OffloadData:
+    """
+    Work for the offload process.
+
+    When generating the Timeline, thumbnail_rows and removed_uids are the files
+    added, changed or removed since the Timeline was last generated, unless reset
+    is True, in which case thumbnail_rows contains every file.
+    """
+
     def __init__(self, thumbnail_rows: Optional[Sequence[ThumbnailDataForProximity]]=None,
                  proximity_seconds: int=None,
                  rpd_files: Optional[Sequence[RPDFile]]=None,
                  strip_characters: Optional[bool]=None,
-                 folders_preview: Optional[FoldersPreview]=None) -> None:
+                 folders_preview: Optional[FoldersPreview]=None,
+                 removed_uids: Optional[Sequence[bytes]]=None,
+                 reset: bool=False) -> None:
         self.thumbnail_rows = thumbnail_rows
+        self.removed_uids = removed_uids
+        self.reset = reset
         self.proximity_seconds = proximity_seconds
         self.rpd_files = rpd_files
         self.strip_characters = strip_characters
@@ -1438,18 +1765,29 @@ class OffloadData:
 
 class OffloadResults:
     def __init__(self, proximity_groups: Optional[TemporalProximityGroups]=None,
-                 folders_preview: Optional[FoldersPreview]=None) -> None:
+                 folders_preview: Optional[FoldersPreview]=None,
+                 proximity_diff: Optional[TimelineDiff]=None) -> None:
         self.proximity_groups = proximity_groups
+        self.proximity_diff = proximity_diff
         self.folders_preview = folders_preview
 
 
 class BackupArguments:
     """
     Pass start up data to the back up process
+
+    If fan_out is True, the process backs up to every backup device, reading
+    each file once, and path and device_name are not used. The backup devices
+    are instead specified with each file to be backed up.
     """
-    def __init__(self, path: str, device_name: str) -> None:
+    def __init__(self, path: str, device_name: str, fan_out: bool=False) -> None:
         self.path = path
         self.device_name = device_name
+        self.fan_out = fan_out
+
+
+# A backup device as specified to a fan out backup process
+BackupDestination = namedtuple('BackupDestination', 'device_id path device_name do_backup')
 
 
 class BackupFileData:
@@ -1464,7 +1802,13 @@ class BackupFileData:
                  verify_file: Optional[bool]=None,
                  download_count: Optional[int]=None,
                  save_fdo_thumbnail: Optional[int]=None,
-                 message: Optional[BackupStatus]=None) -> None:
+                 message: Optional[BackupStatus]=None,
+                 destinations: Optional[List[BackupDestination]]=None) -> None:
+        """
+        :param destinations: the backup devices to back up to, used only by
+         fan out backup processes. The value of do_backup for each destination
+         overrides the value of do_backup.
+        """
         self.rpd_file = rpd_file
         self.move_succeeded = move_succeeded
         self.do_backup = do_backup
@@ -1474,6 +1818,7 @@ class BackupFileData:
         self.download_count = download_count
         self.save_fdo_thumbnail = save_fdo_thumbnail
         self.message = message
+        self.destinations = destinations
 
 
 class BackupResults:
@@ -1512,7 +1857,8 @@ class GenerateThumbnailsArguments:
                  camera: Optional[str]=None,
                  port: Optional[str]=None,
                  entire_video_required: Optional[bool]=None,
-                 entire_photo_required: Optional[bool]=None) -> None:
+                 entire_photo_required: Optional[bool]=None,
+                 thumbnail_ring: Optional[str]=None) -> None:
         """
         List of files for which thumbnails are to be generated.
         All files  are assumed to have the same scan id.
@@ -1539,6 +1885,8 @@ class GenerateThumbnailsArguments:
          to extract the thumbnail
         :param entire_photo_required: if the entire photo is required
          to extract the thumbnail
+        :param thumbnail_ring: path of the thumbnail ring to which
+         thumbnails for the main process should be written
         """
 
         self.rpd_files = rpd_files
@@ -1557,6 +1905,7 @@ class GenerateThumbnailsArguments:
         self.log_gphoto2 = log_gphoto2
         self.entire_video_required = entire_video_required
         self.entire_photo_required = entire_photo_required
+        self.thumbnail_ring = thumbnail_ring
 
 
 class GenerateThumbnailsResults:
@@ -1564,15 +1913,95 @@ class GenerateThumbnailsResults:
                  thumbnail_bytes: Optional[bytes]=None,
                  scan_id: Optional[int]=None,
                  cache_dirs: Optional[CacheDirs]=None,
-                 camera_removed: Optional[bool]=None,) -> None:
+                 camera_removed: Optional[bool]=None,
+                 thumbnail_slot: Optional[int]=None) -> None:
         self.rpd_file = rpd_file
-        # If thumbnail_bytes is None, there is no thumbnail
+        # If thumbnail_bytes and thumbnail_slot are None, there is no thumbnail
         self.thumbnail_bytes = thumbnail_bytes
+        # Slot in the thumbnail ring holding the thumbnail
+        self.thumbnail_slot = thumbnail_slot
         self.scan_id = scan_id
         self.cache_dirs = cache_dirs
         self.camera_removed = camera_removed
 
 
+# The messages sent most often from worker processes to the main process,
+# which are encoded more compactly than if they were pickled
+
+register_message(
+    ScanResults, code=1, version=1, fields=(
+        ('rpd_files', MessageField.pickled),
+        ('file_type_counter', MessageField.pickled),
+        ('file_size_sum', MessageField.pickled),
+        ('error_code', MessageField.pickled),
+        ('scan_id', MessageField.integer),
+        ('optimal_display_name', MessageField.string),
+        ('storage_space', MessageField.pickled),
+        ('storage_descriptions', MessageField.pickled),
+        ('sample_photo', MessageField.pickled),
+        ('sample_video', MessageField.pickled),
+        ('problems', MessageField.pickled),
+        ('fatal_error', MessageField.boolean),
+        ('camera_removed', MessageField.boolean),
+        ('entire_video_required', MessageField.boolean),
+        ('entire_photo_required', MessageField.boolean),
+    )
+)
+
+register_message(
+    CopyFilesResults, code=2, version=1, fields=(
+        ('scan_id', MessageField.integer),
+        ('photo_temp_dir', MessageField.string),
+        ('video_temp_dir', MessageField.string),
+        ('total_downloaded', MessageField.integer),
+        ('chunk_downloaded', MessageField.integer),
+        ('copy_succeeded', MessageField.boolean),
+        ('rpd_file', MessageField.pickled),
+        ('download_count', MessageField.integer),
+        ('mdata_exceptions', MessageField.pickled),
+        ('problems', MessageField.pickled),
+        ('camera_removed', MessageField.boolean),
+    )
+)
+
+register_message(
+    RenameAndMoveFileResults, code=3, version=1, fields=(
+        ('move_succeeded', MessageField.boolean),
+        ('rpd_file', MessageField.pickled),
+        ('download_count', MessageField.integer),
+        ('stored_sequence_no', MessageField.integer),
+        ('downloads_today', MessageField.pickled),
+        ('problems', MessageField.pickled),
+    )
+)
+
+register_message(
+    BackupResults, code=4, version=1, fields=(
+        ('scan_id', MessageField.integer),
+        ('device_id', MessageField.integer),
+        ('total_downloaded', MessageField.integer),
+        ('chunk_downloaded', MessageField.integer),
+        ('backup_succeeded', MessageField.boolean),
+        ('do_backup', MessageField.boolean),
+        ('rpd_file', MessageField.pickled),
+        ('backup_full_file_name', MessageField.string),
+        ('mdata_exceptions', MessageField.pickled),
+        ('problems', MessageField.pickled),
+    )
+)
+
+register_message(
+    GenerateThumbnailsResults, code=5, version=2, fields=(
+        ('rpd_file', MessageField.pickled),
+        ('thumbnail_bytes', MessageField.payload),
+        ('scan_id', MessageField.integer),
+        ('cache_dirs', MessageField.pickled),
+        ('camera_removed', MessageField.boolean),
+        ('thumbnail_slot', MessageField.integer),
+    )
+)
+
+
 class ThumbnailExtractorArgument:
     def __init__(self, rpd_file: RPDFile,
                  task: ExtractionTask,
@@ -1585,7 +2014,8 @@ class ThumbnailExtractorArgument:
                  file_to_work_on_is_temporary: bool,
                  write_fdo_thumbnail: bool,
                  send_thumb_to_main: bool,
-                 force_exiftool: bool) -> None:
+                 force_exiftool: bool,
+                 thumbnail_ring: Optional[str]=None) -> None:
         self.rpd_file = rpd_file
         self.task = task
         self.processing = processing
@@ -1598,6 +2028,7 @@ class ThumbnailExtractorArgument:
         self.write_fdo_thumbnail = write_fdo_thumbnail
         self.send_thumb_to_main = send_thumb_to_main
         self.force_exiftool = force_exiftool
+        self.thumbnail_ring = thumbnail_ring
 
 
 class RenameMoveFileManager(PushPullDaemonManager):
@@ -1616,7 +2047,7 @@ class RenameMoveFileManager(PushPullDaemonManager):
         self._process_to_run = 'renameandmovefile.py'
 
     def process_sink_data(self):
-        data = pickle.loads(self.content)  # type: RenameAndMoveFileResults
+        data = decode_message(self.content, self.payloads)  # type: RenameAndMoveFileResults
         if data.move_succeeded is not None:
 
             self.message.emit(data.move_succeeded, data.rpd_file, data.download_count)
@@ -1647,7 +2078,7 @@ class ThumbnailDaemonManager(PushPullDaemonManager):
         self._process_to_run = 'thumbnaildaemon.py'
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content) # type: GenerateThumbnailsResults
+        data = decode_message(self.content, self.payloads)  # type: GenerateThumbnailsResults
         if data.thumbnail_bytes is None:
             thumbnail = QPixmap()
         else:
@@ -1665,6 +2096,7 @@ class OffloadManager(PushPullDaemonManager):
     """
 
     message = pyqtSignal(TemporalProximityGroups)
+    timelineDiff = pyqtSignal(TimelineDiff)
     downloadFolders = pyqtSignal(FoldersPreview)
 
     def __init__(self, logging_port: int) -> None:
@@ -1673,9 +2105,11 @@ class OffloadManager(PushPullDaemonManager):
         self._process_to_run = 'offload.py'
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content)  # type: OffloadResults
+        data = decode_message(self.content, self.payloads)  # type: OffloadResults
         if data.proximity_groups is not None:
             self.message.emit(data.proximity_groups)
+        elif data.proximity_diff is not None:
+            self.timelineDiff.emit(data.proximity_diff)
         elif data.folders_preview is not None:
             self.downloadFolders.emit(data.folders_preview)
 
@@ -1700,7 +2134,7 @@ class ScanManager(PublishPullPipelineManager):
         self._process_to_run = 'scan.py'
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content)  # type: ScanResults
+        data = decode_message(self.content, self.payloads)  # type: ScanResults
         if data.rpd_files is not None:
             assert data.file_type_counter
             assert data.file_size_sum
@@ -1743,6 +2177,11 @@ class BackupManager(PublishPullPipelineManager):
     handles both the photos and the videos. However if photos are being
     backed up to one drive, and videos to another, there would be a
     worker process for each drive (2 in total).
+
+    Alternatively, a single fan out worker process backs up to every
+    device. It reads each downloaded file once, and writes it to all the
+    devices concurrently. Its results are reported per device, in the
+    same way as those of the per device worker processes.
     """
     message = pyqtSignal(int, bool, bool, RPDFile, str, 'PyQt_PyObject')
     bytesBackedUp = pyqtSignal('PyQt_PyObject', 'PyQt_PyObject')
@@ -1754,7 +2193,7 @@ class BackupManager(PublishPullPipelineManager):
         self._process_to_run = 'backupfile.py'
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content) # type: BackupResults
+        data = decode_message(self.content, self.payloads)  # type: BackupResults
         if data.total_downloaded is not None:
             assert data.scan_id is not None
             assert data.chunk_downloaded >= 0
@@ -1790,7 +2229,7 @@ class CopyFilesManager(PublishPullPipelineManager):
         self._process_to_run = 'copyfiles.py'
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content) # type: CopyFilesResults
+        data = decode_message(self.content, self.payloads)  # type: CopyFilesResults
         if data.total_downloaded is not None:
             assert data.scan_id is not None
             if data.chunk_downloaded < 0:
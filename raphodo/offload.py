@@ -26,6 +26,7 @@ import pickle
 import sys
 import logging
 import locale
+from typing import Optional
 try:
     # Use the default locale as defined by the LANG variable
     locale.setlocale(locale.LC_ALL, '')
@@ -34,7 +35,8 @@ except locale.Error:
 
 from PyQt5.QtGui import QGuiApplication
 from raphodo.interprocess import (DaemonProcess, OffloadData, OffloadResults, DownloadDestination)
-from raphodo.proximity import TemporalProximityGroups
+from raphodo.serialization import encode_message
+from raphodo.proximity import TemporalProximityGroups, ProximityIndex
 from raphodo.viewutils import ThumbnailDataForProximity
 from raphodo.folderspreview import FoldersPreview
 
@@ -42,6 +44,43 @@ from raphodo.folderspreview import FoldersPreview
 class OffloadWorker(DaemonProcess):
     def __init__(self) -> None:
         super().__init__('Offload')
+        # Timeline state, kept between requests so it can be updated incrementally
+        self.proximity_index = None  # type: Optional[ProximityIndex]
+        self.proximity_groups = None  # type: Optional[TemporalProximityGroups]
+        self.generation = 0
+
+    def generate_timeline(self, data: OffloadData) -> OffloadResults:
+        """
+        Update the proximity groups with the files added, changed or removed, and
+        regenerate the Timeline.
+
+        :return: the entire Timeline when it is reset, else the changes since the
+         Timeline was last generated
+        """
+
+        if data.reset or self.proximity_index is None:
+            self.proximity_index = ProximityIndex(temporal_span=data.proximity_seconds)
+            self.proximity_groups = None
+        else:
+            self.proximity_index.set_temporal_span(data.proximity_seconds)
+            if data.removed_uids:
+                self.proximity_index.remove(data.removed_uids)
+        if data.thumbnail_rows:
+            self.proximity_index.add(data.thumbnail_rows)
+
+        groups = TemporalProximityGroups(
+            thumbnail_rows=self.proximity_index.thumbnail_rows(),
+            temporal_span=data.proximity_seconds,
+            groups=self.proximity_index.groups()
+        )
+        self.generation += 1
+        groups.generation = self.generation
+
+        previous = self.proximity_groups
+        self.proximity_groups = groups
+        if previous is None:
+            return OffloadResults(proximity_groups=groups)
+        return OffloadResults(proximity_diff=groups.diff(previous))
 
     def run(self) -> None:
         try:
@@ -51,14 +90,8 @@ class OffloadWorker(DaemonProcess):
                 self.check_for_command(directive, content)
 
                 data = pickle.loads(content) # type: OffloadData
-                if data.thumbnail_rows:
-                    groups = TemporalProximityGroups(
-                        thumbnail_rows=data.thumbnail_rows, temporal_span=data.proximity_seconds
-                    )
-                    self.content = pickle.dumps(
-                        OffloadResults(proximity_groups=groups),
-                        pickle.HIGHEST_PROTOCOL
-                    )
+                if data.proximity_seconds is not None:
+                    self.content = encode_message(self.generate_timeline(data))
                     self.send_message_to_sink()
                 else:
                     assert data.folders_preview
@@ -66,9 +99,8 @@ class OffloadWorker(DaemonProcess):
                     data.folders_preview.generate_subfolders(
                         rpd_files=data.rpd_files, strip_characters=data.strip_characters
                     )
-                    self.content = pickle.dumps(
-                        OffloadResults(folders_preview=data.folders_preview),
-                        pickle.HIGHEST_PROTOCOL
+                    self.content = encode_message(
+                        OffloadResults(folders_preview=data.folders_preview)
                     )
                     self.send_message_to_sink()
 
@@ -330,6 +330,12 @@ class Preferences:
         # pre 0.9.3a1 value: device_without_dcim_autodetection=False, is now replaced by
         # scan_specific_folders
         folders_to_scan=['DCIM', 'PRIVATE', 'MP_ROOT'],
+        # Number of threads used to walk folders on a device or This Computer
+        # concurrently. A value of 1 walks them one after another.
+        scan_threads=1,
+        # Read only those directories on This Computer that have changed since they
+        # were last scanned
+        incremental_scan=True,
         ignored_paths=['.Trash', '.thumbnails', 'THMBNL', '__MACOSX'],
         use_re_ignored_paths=False,
         volume_whitelist=[''],
@@ -343,6 +349,7 @@ class Preferences:
         video_backup_identifier=xdg_videos_identifier(),
         backup_photo_location=os.path.expanduser('~'),
         backup_video_location=os.path.expanduser('~'),
+        backup_fan_out=False,
     )
     automation_defaults = dict(
         auto_download_at_startup=False,
@@ -351,14 +358,21 @@ class Preferences:
         auto_exit=False,
         auto_exit_force=False,
         move=False,
-        verify_file=False
+        verify_file=False,
+        checksum_algorithm=int(constants.ChecksumAlgorithm.blake2b)
     )
     performance_defaults = dict(
         generate_thumbnails=True,
         use_thumbnail_cache=True,
         save_fdo_thumbnails=True,
         max_cpu_cores=max(available_cpu_count(physical_only=True), 2),
-        keep_thumbnails_days=30
+        keep_thumbnails_days=30,
+        # Maximum size of the thumbnail cache in megabytes
+        max_thumbnail_cache_size=2048,
+        # Maximum number of thumbnails kept in memory for display
+        max_thumbnails_in_memory=2000,
+        # Maximum number of ExifTool processes shared by the program's processes
+        max_exiftool_processes=max(available_cpu_count(physical_only=True), 2)
     )
     error_defaults = dict(
         conflict_resolution=int(constants.ConflictResolution.skip),
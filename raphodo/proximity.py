@@ -19,18 +19,24 @@
 __author__ = 'Damon Lynch'
 __copyright__ = "Copyright 2015-2020, Damon Lynch"
 
-from collections import (namedtuple, defaultdict, deque, Counter)
+from collections import (namedtuple, defaultdict, Counter)
 from operator import attrgetter
 import locale
-from datetime import datetime
+from datetime import datetime, date
 import logging
 from itertools import groupby
 import pickle
 from pprint import pprint
-from typing import Dict, List, Tuple, Set, Optional, DefaultDict
+from typing import Dict, List, Tuple, Set, Optional, DefaultDict, Iterable, Sequence
 
 import arrow.arrow
 from arrow.arrow import Arrow
+try:
+    import numpy as np
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+from sortedcontainers import SortedList
 
 from PyQt5.QtCore import (
     QAbstractTableModel, QModelIndex, Qt, QSize, QSizeF, QRect, QItemSelection, QItemSelectionModel,
@@ -66,6 +72,105 @@ ProximityRow = namedtuple(
 
 UidTime = namedtuple('UidTime', 'ctime, arrowtime, uid, previously_downloaded')
 
+# start and end are Arrow times. days is a tuple of ((year, month, day), [uid, uid, ...])
+# for each calendar day in the group, in chronological order. text is the short and long
+# form of the text displayed for the group.
+ProximityGroup = namedtuple('ProximityGroup', 'start, end, uids, new_file, days, text')
+
+_epoch_ordinal = date(1970, 1, 1).toordinal()
+_seconds_per_hour = 3600
+_microseconds_per_day = 86400 * 1000000
+
+
+def proximity_group_text(start: Arrow, end: Arrow) -> Tuple[str, str]:
+    """
+    :return: the text that will appear in the right-most column of the Timeline,
+     and its tooltip
+    """
+
+    return (
+        humanize_time_span(start, end, insert_cr_on_long_line=True),
+        humanize_time_span(start, end, long_format=True)
+    )
+
+
+def _utc_offset(timestamp: float) -> int:
+    """
+    :return: the local time zone's offset from UTC in seconds at the timestamp,
+     determined exactly as it is for the Arrow times displayed in the Timeline
+    """
+
+    return int(arrow.get(timestamp).to('local').utcoffset().total_seconds())
+
+
+def local_days(ctimes: 'np.ndarray') -> 'np.ndarray':
+    """
+    Vectorized determination of the local calendar day of each timestamp.
+
+    Equivalent to arrow.get(ctime).to('local') for every timestamp, without
+    creating an Arrow for each of them.
+
+    The local time zone offset changes only when daylight savings time starts or
+    ends. The offset is determined at the start and end of each hour in which
+    there is a timestamp. If they are the same, the offset is the same for every
+    timestamp in that hour. If not, the offset is determined individually for
+    the timestamps in that hour.
+
+    :param ctimes: timestamps in seconds since the epoch
+    :return: days since the epoch in local time, one for each timestamp
+    """
+
+    # Round to microseconds, half to even, as datetime does
+    fraction, whole = np.modf(ctimes)
+    microseconds = whole.astype(np.int64) * 1000000 + np.round(fraction * 1e6).astype(np.int64)
+
+    hours = np.floor(ctimes / _seconds_per_hour)
+    unique_hours, hour_index = np.unique(hours, return_inverse=True)
+    hour_offsets = np.empty(len(unique_hours), dtype=np.int64)
+    offset_cache = {}  # type: Dict[float, int]
+
+    def hour_offset(hour: float) -> int:
+        if hour not in offset_cache:
+            offset_cache[hour] = _utc_offset(hour * _seconds_per_hour)
+        return offset_cache[hour]
+
+    transition_hours = []
+    for i, hour in enumerate(unique_hours.tolist()):
+        start = hour_offset(hour)
+        if start != hour_offset(hour + 1):
+            transition_hours.append(i)
+        hour_offsets[i] = start
+
+    offsets = hour_offsets[hour_index.ravel()]
+    if transition_hours:
+        for i in np.flatnonzero(np.isin(hour_index, transition_hours)).tolist():
+            offsets[i] = _utc_offset(float(ctimes[i]))
+
+    return (microseconds + offsets * 1000000) // _microseconds_per_day
+
+
+def local_year_month_day(ctimes: Sequence[float]) -> List[Tuple[int, int, int]]:
+    """
+    :param ctimes: timestamps in seconds since the epoch
+    :return: the local year, month and day of each timestamp
+    """
+
+    if have_numpy:
+        dates = {}  # type: Dict[int, Tuple[int, int, int]]
+        y_m_d = []
+        for day in local_days(np.array(ctimes, dtype=np.float64)).tolist():
+            if day not in dates:
+                d = date.fromordinal(day + _epoch_ordinal)
+                dates[day] = d.year, d.month, d.day
+            y_m_d.append(dates[day])
+        return y_m_d
+    else:
+        y_m_d = []
+        for ctime in ctimes:
+            t = arrow.get(ctime).to('local')
+            y_m_d.append((t.year, t.month, t.day))
+        return y_m_d
+
 
 def humanize_time_span(start: Arrow, end: Arrow,
                        strip_leading_zero_from_time: bool=True,
@@ -325,14 +430,27 @@ def invalidRowFont() -> QFont:
     return font
 
 
+# (font key, text): (width, height) of the text's bounding rectangle.
+# Shared by every ProximityDisplayValues in the process, so measurements made
+# generating one Timeline are reused when it is next generated.
+_text_sizes = {}  # type: Dict[Tuple[str, str], Tuple[float, float]]
+_max_text_sizes = 20000
+
+
 class ProximityDisplayValues:
     """
     Temporal Proximity cell sizes.
 
     Calculated in different process to that of main window.
+
+    Text measurements are memoized. The measurements used by this Timeline are
+    pickled along with it, and added to the memo of the process it is unpickled in.
     """
 
     def __init__(self):
+        # Text measurements made or reused when calculating this Timeline's sizes
+        self.text_sizes = {}  # type: Dict[Tuple[str, str], Tuple[float, float]]
+
         self.depth = None
         self.row_heights = []  # type: List[int]
         self.col_widths = None  # type: Optional[Tuple[int]]
@@ -396,6 +514,8 @@ class ProximityDisplayValues:
         self.invalidRowFontMetrics = QFontMetricsF(self.invalidRowFont)
         self.invalidRowHeightMin = self.invalidRowFontMetrics.height() + \
                                    self.proximityMetrics.height()
+        self.proximity_font_key = self.proximityFont.key()
+        self.month_font_key = self.monthFont.key()
 
     def prepare_for_pickle(self) -> None:
         self.proximityFont = self.proximityMetrics = None
@@ -405,10 +525,38 @@ class ProximityDisplayValues:
         self.dayFont = None
         self.invalidRowFont = self.invalidRowFontMetrics = None
 
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        if len(_text_sizes) + len(self.text_sizes) > _max_text_sizes:
+            _text_sizes.clear()
+        _text_sizes.update(self.text_sizes)
+
+    def text_size(self, metrics: QFontMetricsF, font_key: str, text: str) -> Tuple[float, float]:
+        """
+        Measure text, using the memoized measurement if there is one.
+
+        :param metrics: metrics of the font the text is displayed in
+        :param font_key: the font's key
+        :param text: the text to measure
+        :return: width and height of the text's bounding rectangle
+        """
+
+        key = (font_key, text)
+        size = self.text_sizes.get(key)
+        if size is None:
+            size = _text_sizes.get(key)
+            if size is None:
+                boundingRect = metrics.boundingRect(text)  # type: QRectF
+                size = boundingRect.width(), boundingRect.height()
+                if len(_text_sizes) >= _max_text_sizes:
+                    _text_sizes.clear()
+                _text_sizes[key] = size
+            self.text_sizes[key] = size
+        return size
+
     def get_month_size(self, month: str) -> QSizeF:
-        boundingRect = self.monthMetrics.boundingRect(month)  # type: QRectF
-        height = boundingRect.height()
-        width = boundingRect.width() * self.month_kerning
+        width, height = self.text_size(self.monthMetrics, self.month_font_key, month)
+        width = width * self.month_kerning
         size = QSizeF(width, height)
         return size
 
@@ -437,26 +585,28 @@ class ProximityDisplayValues:
         Column 1 cell sizes are fixed.
         """
 
-        dayMetrics = QFontMetricsF(dayFont())
+        dayMetrics = QFontMetricsF(self.dayFont)
+        day_font_key = self.dayFont.key()
         day_width = 0
         day_height = 0
         for day in range(10, 32):
-            rect = dayMetrics.boundingRect(str(day))
-            day_width = max(day_width, rect.width())
-            day_height = max(day_height, rect.height())
+            width, height = self.text_size(dayMetrics, day_font_key, str(day))
+            day_width = max(day_width, width)
+            day_height = max(day_height, height)
 
         self.max_day_height = day_height
         self.max_day_width = day_width
 
         weekday_width = 0
         weekday_height = 0
-        weekdayMetrics = QFontMetricsF(weekdayFont())
+        weekdayMetrics = QFontMetricsF(self.weekdayFont)
+        weekday_font_key = self.weekdayFont.key()
         for i in range(1, 7):
             dt = datetime(2015, 11, i)  # Year and month are totally irrelevant, only want day
             weekday = dt.strftime('%a').upper()
-            rect = weekdayMetrics.boundingRect(str(weekday))
-            weekday_width = max(weekday_width, rect.width())
-            weekday_height = max(weekday_height, rect.height())
+            width, height = self.text_size(weekdayMetrics, weekday_font_key, str(weekday))
+            weekday_width = max(weekday_width, width)
+            weekday_height = max(weekday_height, height)
 
         self.max_weekday_height = weekday_height
         self.max_weekday_width = weekday_width
@@ -469,9 +619,11 @@ class ProximityDisplayValues:
         text = text.split('\n')
         width = height = 0
         for t in text:
-            boundingRect = self.proximityMetrics.boundingRect(t)  # type: QRectF
-            width = max(width, boundingRect.width())
-            height += boundingRect.height()
+            text_width, text_height = self.text_size(
+                self.proximityMetrics, self.proximity_font_key, t
+            )
+            width = max(width, text_width)
+            height += text_height
         size = QSizeF(
             width  + self.col2_text_left_margin + self.col2_right_margin,
             height + self.col2_v_padding
@@ -677,6 +829,263 @@ class MetaUid:
         return tuple(valid)
 
 
+class ProximityIndex:
+    """
+    Proximity groups that are updated incrementally as files are added or
+    removed, or the temporal span changes.
+
+    Files are kept sorted by time, along with the gap between each file and the
+    file before it. A file starts a new proximity group when that gap is greater
+    than the temporal span. Each operation regenerates only the proximity groups
+    it affects.
+
+    Lives in the offload process.
+    """
+
+    def __init__(self, temporal_span: int) -> None:
+        self.temporal_span = temporal_span
+        # (ctime, uid) of every file
+        self.entries = SortedList()
+        # uid: ThumbnailDataForProximity
+        self.data = {}  # type: Dict[bytes, ThumbnailDataForProximity]
+        # uid: (year, month, day)
+        self.year_month_day = {}  # type: Dict[bytes, Tuple[int, int, int]]
+        # (gap, (ctime, uid)) for every file except the first, where gap is the
+        # time in seconds since the file before it
+        self.gaps = SortedList()
+        # (ctime, uid) of the first file in each proximity group
+        self.starts = SortedList()
+        # (ctime, uid) of the first file in the group: ProximityGroup
+        self.groups_cache = {}  # type: Dict[Tuple[float, bytes], ProximityGroup]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _add_start(self, key: Tuple[float, bytes]) -> None:
+        # A group cached under this key is stale, even if the key was a group
+        # start when the groups were last generated
+        self.groups_cache.pop(key, None)
+        self.starts.add(key)
+
+    def _discard_start(self, key: Tuple[float, bytes]) -> None:
+        self.groups_cache.pop(key, None)
+        self.starts.discard(key)
+
+    def _link(self, prev_key: Optional[Tuple[float, bytes]], key: Tuple[float, bytes]) -> None:
+        if prev_key is None:
+            self._add_start(key)
+        else:
+            gap = key[0] - prev_key[0]
+            self.gaps.add((gap, key))
+            if gap > self.temporal_span:
+                self._add_start(key)
+
+    def _unlink(self, prev_key: Optional[Tuple[float, bytes]], key: Tuple[float, bytes]) -> None:
+        if prev_key is not None:
+            self.gaps.remove((key[0] - prev_key[0], key))
+        self._discard_start(key)
+
+    def _neighbors(self, index: int) -> Tuple[Optional[Tuple[float, bytes]],
+                                              Optional[Tuple[float, bytes]]]:
+        prev_key = self.entries[index - 1] if index > 0 else None
+        next_key = self.entries[index] if index < len(self.entries) else None
+        return prev_key, next_key
+
+    def _invalidate(self, key: Optional[Tuple[float, bytes]]) -> None:
+        """
+        Discard the cached value of the proximity group containing the file
+        """
+
+        if key is not None:
+            index = self.starts.bisect_right(key)
+            if index:
+                self.groups_cache.pop(self.starts[index - 1], None)
+
+    def add(self, thumbnail_rows: Sequence[ThumbnailDataForProximity]) -> None:
+        """
+        Add files, replacing any already in the index with the same uid
+        """
+
+        self.remove([row.uid for row in thumbnail_rows if row.uid in self.data])
+
+        y_m_d = local_year_month_day([row.ctime for row in thumbnail_rows])
+        for row, ymd in zip(thumbnail_rows, y_m_d):
+            self.data[row.uid] = row
+            self.year_month_day[row.uid] = ymd
+
+        if not self.entries:
+            self._load(thumbnail_rows)
+            return
+
+        for row in thumbnail_rows:
+            key = (row.ctime, row.uid)
+            prev_key, next_key = self._neighbors(self.entries.bisect_left(key))
+            if next_key is not None:
+                self._unlink(prev_key, next_key)
+            self.entries.add(key)
+            self._link(prev_key, key)
+            if next_key is not None:
+                self._link(key, next_key)
+            for k in (prev_key, key, next_key):
+                self._invalidate(k)
+
+    def _load(self, thumbnail_rows: Sequence[ThumbnailDataForProximity]) -> None:
+        """
+        Populate an empty index in bulk
+        """
+
+        keys = sorted((row.ctime, row.uid) for row in thumbnail_rows)
+        self.entries.update(keys)
+        gaps = [(key[0] - prev_key[0], key) for prev_key, key in zip(keys, keys[1:])]
+        self.gaps.update(gaps)
+        self.starts.update(key for gap, key in gaps if gap > self.temporal_span)
+        if keys:
+            self.starts.add(keys[0])
+
+    def remove(self, uids: Iterable[bytes]) -> None:
+        for uid in uids:
+            row = self.data.pop(uid)
+            del self.year_month_day[uid]
+            key = (row.ctime, uid)
+            index = self.entries.index(key)
+            prev_key = self.entries[index - 1] if index > 0 else None
+            next_key = self.entries[index + 1] if index + 1 < len(self.entries) else None
+            self._invalidate(key)
+            self._unlink(prev_key, key)
+            if next_key is not None:
+                self._unlink(key, next_key)
+            self.entries.remove(key)
+            if next_key is not None:
+                self._link(prev_key, next_key)
+            for k in (prev_key, next_key):
+                self._invalidate(k)
+
+    def set_temporal_span(self, temporal_span: int) -> None:
+        """
+        Change the temporal span, regenerating only groups that are merged or split
+        """
+
+        old_span = self.temporal_span
+        if temporal_span == old_span:
+            return
+        self.temporal_span = temporal_span
+
+        lower = min(old_span, temporal_span)
+        upper = max(old_span, temporal_span)
+        toggled = []
+        for gap, key in self.gaps.irange(minimum=(lower, )):
+            if gap > upper:
+                break
+            if gap > lower:
+                toggled.append(key)
+
+        for key in toggled:
+            index = self.entries.index(key)
+            # The group before the gap is always affected, whether it is split or merged
+            self._invalidate(self.entries[index - 1])
+            if temporal_span > old_span:
+                self._discard_start(key)
+            else:
+                self._add_start(key)
+
+    def thumbnail_rows(self) -> List[ThumbnailDataForProximity]:
+        """
+        :return: every file, sorted by time
+        """
+
+        return [self.data[uid] for ctime, uid in self.entries]
+
+    def groups(self) -> List[ProximityGroup]:
+        """
+        :return: the proximity groups in chronological order, generating only those
+         that are not cached
+        """
+
+        groups = []  # type: List[ProximityGroup]
+        cache = {}  # type: Dict[Tuple[float, bytes], ProximityGroup]
+        starts = list(self.starts)
+        for index, start in enumerate(starts):
+            group = self.groups_cache.get(start)
+            if group is None:
+                end = starts[index + 1] if index + 1 < len(starts) else None
+                group = self._make_group(start, end)
+            cache[start] = group
+            groups.append(group)
+        self.groups_cache = cache
+        return groups
+
+    def _make_group(self, start: Tuple[float, bytes],
+                    end: Optional[Tuple[float, bytes]]) -> ProximityGroup:
+        keys = list(self.entries.irange(minimum=start, maximum=end, inclusive=(True, False)))
+        uids = [uid for ctime, uid in keys]
+        start_time = arrow.get(keys[0][0]).to('local')
+        if len(keys) == 1:
+            end_time = start_time
+        else:
+            end_time = arrow.get(keys[-1][0]).to('local')
+        days = tuple((y_m_d, list(day)) for y_m_d, day in groupby(uids, self.year_month_day.get))
+        if len(days) == 1:
+            days = ((days[0][0], uids), )
+        return ProximityGroup(
+            start=start_time, end=end_time, uids=uids,
+            new_file=any(not self.data[uid].previously_downloaded for uid in uids), days=days,
+            text=proximity_group_text(start_time, end_time)
+        )
+
+
+class TimelineDiff:
+    """
+    The changes between two generations of the Timeline.
+
+    The Timeline rows first_row to first_row + removed_rows - 1 are replaced by rows.
+    Values indexed by Timeline row and column are sent as the keys removed and
+    the items added or changed.
+    """
+
+    def __init__(self, base_generation: int,
+                 generation: int,
+                 first_row: int,
+                 removed_rows: int,
+                 rows: List[ProximityRow],
+                 changes: Tuple[Tuple[List, Dict], ...],
+                 col1_col2_uid: List[Tuple[int, int, bytes]],
+                 spans: List[Tuple[int, int, int]],
+                 display_values: ProximityDisplayValues,
+                 dominant_file_type: FileType,
+                 depth: int,
+                 invalid_rows: Tuple[int]) -> None:
+        self.base_generation = base_generation
+        self.generation = generation
+        self.first_row = first_row
+        self.removed_rows = removed_rows
+        self.rows = rows
+        self.changes = changes
+        # Only the uids whose cells have changed
+        self.col1_col2_uid = col1_col2_uid
+        self.spans = spans
+        self.display_values = display_values
+        self.dominant_file_type = dominant_file_type
+        self.depth = depth
+        self.invalid_rows = invalid_rows
+
+    def __repr__(self) -> str:
+        return 'TimelineDiff(generation %s -> %s: rows %s-%s replaced with %s rows)' % (
+            self.base_generation, self.generation, self.first_row,
+            self.first_row + self.removed_rows - 1, len(self.rows)
+        )
+
+
+def _dict_diff(old: Dict, new: Dict) -> Tuple[List, Dict]:
+    """
+    :return: the keys removed from old, and the items added or changed in new
+    """
+
+    missing = object()
+    removed = [key for key in old if key not in new]
+    changed = {key: value for key, value in new.items() if old.get(key, missing) != value}
+    return removed, changed
+
+
 class TemporalProximityGroups:
     """
     Generates values to be displayed in Timeline view.
@@ -690,36 +1099,31 @@ class TemporalProximityGroups:
 
     # @profile
     def __init__(self, thumbnail_rows: List[ThumbnailDataForProximity],
-                 temporal_span: int = 3600):
+                 temporal_span: int = 3600,
+                 groups: Optional[List[ProximityGroup]]=None):
+        """
+        :param thumbnail_rows: files to display in the Timeline
+        :param temporal_span: maximum gap in seconds between files in the same
+         proximity group
+        :param groups: proximity groups already generated from the files, e.g.
+         by ProximityIndex, in which case the files must be sorted by time
+        """
+
         self.rows = []  # type: List[ProximityRow]
 
+        # Incremented by the offload process each time the Timeline is generated
+        self.generation = 0
+
         self.invalid_rows = tuple()  # type: Tuple[int]
 
         # Store uids for each table cell
         self.uids = MetaUid()
 
         self.file_types_in_cell = dict()  # type: Dict[Tuple[int, int], str]
-        times_by_proximity = defaultdict(list)  # type: DefaultDict[int, Arrow]
 
         # The rows the user sees in column 2 can span more than one row of the Timeline.
         # Each day always spans at least one row in the Timeline, possibly more.
 
-        # group_no: no days spanned
-        day_spans_by_proximity = dict()  # type: Dict[int, int]
-        # group_no: (
-        uids_by_day_in_proximity_group = dict()  # type: Dict[int, Tuple[Tuple[int, int, int], List[bytes]]]
-
-        # uid: (year, month, day)
-        year_month_day = dict()  # type: Dict[bytes, Tuple[int, int, int]]
-
-        # group_no: List[uid]
-        uids_by_proximity = defaultdict(list)  # type: Dict[int, List[bytes, ...]]
-        # Determine if proximity group contains any files have not been previously downloaded
-        new_files_by_proximity = defaultdict(set)  # type: Dict[int, Set[bool]]
-
-        # Text that will appear in column 2 -- they proximity groups
-        text_by_proximity = deque()
-
         # (year, month, day): [uid, uid, ...]
         self.day_groups = defaultdict(list)  # type: DefaultDict[Tuple[int, int, int], List[bytes]]
         # (year, month): [uid, uid, ...]
@@ -757,93 +1161,24 @@ class TemporalProximityGroups:
 
         thumbnail_rows.sort(key=attrgetter('ctime'))
 
-        # Generate an arrow date time for every timestamp we have
-        uid_times = [
-            UidTime(
-                tr.ctime, arrow.get(tr.ctime).to('local'), tr.uid, tr.previously_downloaded
-            )
-            for tr in thumbnail_rows
-        ]
-
         self.thumbnail_types = tuple(row.file_type for row in thumbnail_rows)
 
         now = arrow.now().to('local')
-        current_year = now.year
-        current_month = now.month
-
-        # Phase 1: Associate unique ids with their year, month and day
-        for x in uid_times:
-            t = x.arrowtime  # type: Arrow
-            year = t.year
-            month = t.month
-            day = t.day
-
-            # Could use arrow.floor here, but it's extremely slow
-            self.day_groups[(year, month, day)].append(x.uid)
-            self.month_groups[(year, month)].append(x.uid)
-            self.year_groups[year].append(x.uid)
-            if year != current_year:
-                # the Timeline contains an entry from the previous year to now
-                self._previous_year = True
-            if month != current_month or self._previous_year:
-                # the Timeline contains an entry from the previous month to now
-                self._previous_month = True
-            # Remember this extracted value
-            year_month_day[x.uid] = year, month, day
 
-        # Phase 2: Identify the proximity groups
-        group_no = 0
-        prev = uid_times[0]
-
-        times_by_proximity[group_no].append(prev.arrowtime)
-        uids_by_proximity[group_no].append(prev.uid)
-        new_files_by_proximity[group_no].add(not prev.previously_downloaded)
-
-        if len(uid_times) > 1:
-            for current in uid_times[1:]:
-                ctime = current.ctime
-                if ctime - prev.ctime > temporal_span:
-                    group_no += 1
-                times_by_proximity[group_no].append(current.arrowtime)
-                uids_by_proximity[group_no].append(current.uid)
-                new_files_by_proximity[group_no].add(not current.previously_downloaded)
-                prev = current
-
-        # Phase 3: Generate the proximity group's text that will appear in
-        # the right-most column and its tooltips.
-
-        # Also calculate the days spanned by each proximity group.
-        # If the days spanned is greater than 1, meaning the number of calendar days
-        # in the proximity group is more than 1, then also keep a copy of the group
-        # where it is broken into separate calendar days
-
-        # The iteration order doesn't really matter here, so can get away with the
-        # potentially unsorted output of dict.items()
-        for group_no, group in times_by_proximity.items():
-            start = group[0]  # type: Arrow
-            end = group[-1]  # type: Arrow
-
-            # Generate the text
-            short_form = humanize_time_span(start, end, insert_cr_on_long_line=True)
-            long_form = humanize_time_span(start, end, long_format=True)
-            text_by_proximity.append((short_form, long_form))
-
-            # Calculate the number of calendar days spanned by this proximity group
-            # e.g. 2015-12-1 12:00 - 2015-12-2 15:00 = 2 days
-            if len(group) > 1:
-                span = len(list(Arrow.span_range('day', start, end)))
-                day_spans_by_proximity[group_no] = span
-                if span > 1:
-                    # break the proximity group members into calendar days
-                    uids_by_day_in_proximity_group[group_no] = tuple(
-                        (y_m_d, list(day))
-                        for y_m_d, day in groupby(
-                            uids_by_proximity[group_no], year_month_day.get
-                        )
-                    )
-            else:
-                # start == end
-                day_spans_by_proximity[group_no] = 1
+        # Phases 1 to 3: Associate unique ids with their year, month and day,
+        # and identify the proximity groups
+        if groups is not None:
+            self.associate_days(groups=groups, current_year=now.year, current_month=now.month)
+        elif have_numpy:
+            groups = self.make_groups_vectorized(
+                thumbnail_rows=thumbnail_rows, temporal_span=temporal_span,
+                current_year=now.year, current_month=now.month
+            )
+        else:
+            groups = self.make_groups(
+                thumbnail_rows=thumbnail_rows, temporal_span=temporal_span,
+                current_year=now.year, current_month=now.month
+            )
 
         # Phase 4: Generate the rows to be displayed in the Timeline
 
@@ -857,53 +1192,45 @@ class TemporalProximityGroups:
         self.prev_row_month = (0, 0)
         self.prev_row_day = (0, 0, 0)
 
-        # Iterating through the groups in order is critical. Cannot use dict.items() here.
-        for group_no in range(len(day_spans_by_proximity)):
-
-            span = day_spans_by_proximity[group_no]
+        # Iterating through the groups in order is critical.
+        for group in groups:
 
             timeline_row += 1
 
-            proximity_group_times = times_by_proximity[group_no]
-            atime = proximity_group_times[0]  # type: Arrow
-            uid = uids_by_proximity[group_no][0]  # type: bytes
-            y_m_d = year_month_day[uid]
-
-            col2_text, tooltip_col2_text = text_by_proximity.popleft()
-            new_file = any(new_files_by_proximity[group_no])
+            col2_text, tooltip_col2_text = group.text
+            new_file = group.new_file
 
             self.rows.append(
                 self.make_row(
-                    atime=atime,
+                    atime=group.start,
                     col2_text=col2_text,
                     new_file=new_file,
-                    y_m_d= y_m_d,
+                    y_m_d=group.days[0][0],
                     timeline_row=timeline_row,
                     thumbnail_index=thumbnail_index,
                     tooltip_col2_text=tooltip_col2_text,
                 )
             )
 
-            uids = uids_by_proximity[group_no]
-            self.uids[(timeline_row, 2)] = uids
+            self.uids[(timeline_row, 2)] = group.uids
 
             # self.dump_row(group_no)
 
-            if span == 1:
-                thumbnail_index += len(proximity_group_times)
+            if len(group.days) == 1:
+                thumbnail_index += len(group.uids)
                 continue
 
-            thumbnail_index += len(uids_by_day_in_proximity_group[group_no][0])
+            thumbnail_index += len(group.days[0])
 
             # For any proximity groups that span more than one Timeline row because they span
             # more than one calender day, add the day to the Timeline, with blank values
             # for the proximity group (column 2).
             i = 0
-            for y_m_d, day in uids_by_day_in_proximity_group[group_no][1:]:
+            for y_m_d, day in group.days[1:]:
                 i += 1
 
                 timeline_row += 1
-                thumbnail_index += len(uids_by_day_in_proximity_group[group_no][i])
+                thumbnail_index += len(group.days[i])
                 atime = arrow.get(*y_m_d)
 
                 self.rows.append(
@@ -989,6 +1316,223 @@ class TemporalProximityGroups:
         else:
             logging.info('Timeline validation passed')
 
+    def associate_days(self, groups: List[ProximityGroup],
+                       current_year: int,
+                       current_month: int) -> None:
+        """
+        Associate unique ids with their year, month and day using proximity
+        groups that have already been generated.
+
+        :param groups: the proximity groups, in chronological order
+        :param current_year: the year right now
+        :param current_month: the month right now
+        """
+
+        for group in groups:
+            for (year, month, day), uids in group.days:
+                self.day_groups[(year, month, day)].extend(uids)
+                self.month_groups[(year, month)].extend(uids)
+                self.year_groups[year].extend(uids)
+                if year != current_year:
+                    self._previous_year = True
+                if month != current_month or self._previous_year:
+                    self._previous_month = True
+
+    def make_groups(self, thumbnail_rows: List[ThumbnailDataForProximity],
+                    temporal_span: int,
+                    current_year: int,
+                    current_month: int) -> List[ProximityGroup]:
+        """
+        Associate unique ids with their year, month and day, and identify the
+        proximity groups, creating an Arrow for every timestamp.
+
+        :param thumbnail_rows: rows sorted by ctime
+        :param temporal_span: maximum gap in seconds between files in the same group
+        :param current_year: the year right now
+        :param current_month: the month right now
+        :return: the proximity groups, in chronological order
+        """
+
+        # Generate an arrow date time for every timestamp we have
+        uid_times = [
+            UidTime(
+                tr.ctime, arrow.get(tr.ctime).to('local'), tr.uid, tr.previously_downloaded
+            )
+            for tr in thumbnail_rows
+        ]
+
+        # uid: (year, month, day)
+        year_month_day = dict()  # type: Dict[bytes, Tuple[int, int, int]]
+
+        # Phase 1: Associate unique ids with their year, month and day
+        for x in uid_times:
+            t = x.arrowtime  # type: Arrow
+            year = t.year
+            month = t.month
+            day = t.day
+
+            # Could use arrow.floor here, but it's extremely slow
+            self.day_groups[(year, month, day)].append(x.uid)
+            self.month_groups[(year, month)].append(x.uid)
+            self.year_groups[year].append(x.uid)
+            if year != current_year:
+                # the Timeline contains an entry from the previous year to now
+                self._previous_year = True
+            if month != current_month or self._previous_year:
+                # the Timeline contains an entry from the previous month to now
+                self._previous_month = True
+            # Remember this extracted value
+            year_month_day[x.uid] = year, month, day
+
+        # Phase 2: Identify the proximity groups
+        times_by_proximity = defaultdict(list)  # type: DefaultDict[int, List[Arrow]]
+        # group_no: List[uid]
+        uids_by_proximity = defaultdict(list)  # type: Dict[int, List[bytes, ...]]
+        # Determine if proximity group contains any files have not been previously downloaded
+        new_files_by_proximity = defaultdict(set)  # type: Dict[int, Set[bool]]
+
+        group_no = 0
+        prev = uid_times[0]
+
+        times_by_proximity[group_no].append(prev.arrowtime)
+        uids_by_proximity[group_no].append(prev.uid)
+        new_files_by_proximity[group_no].add(not prev.previously_downloaded)
+
+        if len(uid_times) > 1:
+            for current in uid_times[1:]:
+                ctime = current.ctime
+                if ctime - prev.ctime > temporal_span:
+                    group_no += 1
+                times_by_proximity[group_no].append(current.arrowtime)
+                uids_by_proximity[group_no].append(current.uid)
+                new_files_by_proximity[group_no].add(not current.previously_downloaded)
+                prev = current
+
+        # Phase 3: Generate the proximity group's text that will appear in
+        # the right-most column and its tooltips.
+
+        # Also calculate the days spanned by each proximity group.
+        # If the days spanned is greater than 1, meaning the number of calendar days
+        # in the proximity group is more than 1, then break the group into separate
+        # calendar days
+        groups = []  # type: List[ProximityGroup]
+        for group_no in range(len(times_by_proximity)):
+            group = times_by_proximity[group_no]
+            uids = uids_by_proximity[group_no]
+            start = group[0]  # type: Arrow
+            end = group[-1]  # type: Arrow
+
+            # Calculate the number of calendar days spanned by this proximity group
+            # e.g. 2015-12-1 12:00 - 2015-12-2 15:00 = 2 days
+            if len(group) > 1 and len(list(Arrow.span_range('day', start, end))) > 1:
+                # break the proximity group members into calendar days
+                days = tuple(
+                    (y_m_d, list(day)) for y_m_d, day in groupby(uids, year_month_day.get)
+                )
+            else:
+                days = ((year_month_day[uids[0]], uids), )
+
+            groups.append(
+                ProximityGroup(
+                    start=start, end=end, uids=uids,
+                    new_file=any(new_files_by_proximity[group_no]), days=days,
+                    text=proximity_group_text(start, end)
+                )
+            )
+
+        return groups
+
+    def make_groups_vectorized(self, thumbnail_rows: List[ThumbnailDataForProximity],
+                               temporal_span: int,
+                               current_year: int,
+                               current_month: int) -> List[ProximityGroup]:
+        """
+        Identical in output to make_groups(), but computes gaps and calendar days in
+        bulk using NumPy. Arrow times are created only for the start and end of each
+        proximity group, i.e. only for what is displayed.
+
+        :param thumbnail_rows: rows sorted by ctime
+        :param temporal_span: maximum gap in seconds between files in the same group
+        :param current_year: the year right now
+        :param current_month: the month right now
+        :return: the proximity groups, in chronological order
+        """
+
+        length = len(thumbnail_rows)
+        ctimes = np.fromiter((tr.ctime for tr in thumbnail_rows), dtype=np.float64, count=length)
+        new_files = np.fromiter(
+            (not tr.previously_downloaded for tr in thumbnail_rows), dtype=np.bool_, count=length
+        )
+        uids = [tr.uid for tr in thumbnail_rows]
+
+        # Phase 1: Associate unique ids with their year, month and day, a calendar
+        # day at a time
+        days = local_days(ctimes)
+        day_starts = np.flatnonzero(np.diff(days)) + 1
+        day_bounds = np.concatenate(([0], day_starts, [length])).tolist()
+        # start index of the calendar day: (year, month, day)
+        day_y_m_d = {}  # type: Dict[int, Tuple[int, int, int]]
+
+        for day_start, day_end, day in zip(
+                day_bounds[:-1], day_bounds[1:], days[day_bounds[:-1]].tolist()):
+            d = date.fromordinal(day + _epoch_ordinal)
+            year = d.year
+            month = d.month
+            day_uids = uids[day_start:day_end]
+            self.day_groups[(year, month, d.day)].extend(day_uids)
+            self.month_groups[(year, month)].extend(day_uids)
+            self.year_groups[year].extend(day_uids)
+            if year != current_year:
+                self._previous_year = True
+            if month != current_month or self._previous_year:
+                self._previous_month = True
+            day_y_m_d[day_start] = year, month, d.day
+
+        # Phase 2: Identify the proximity groups
+        group_starts = np.flatnonzero(np.diff(ctimes) > temporal_span) + 1
+        group_bounds = np.concatenate(([0], group_starts, [length])).tolist()
+        new_file_by_group = np.logical_or.reduceat(new_files, group_bounds[:-1]).tolist()
+
+        # Phase 3: Generate the text for each group, and break groups spanning more
+        # than one calendar day into days
+        groups = []  # type: List[ProximityGroup]
+        day_index = 0
+        for group_start, group_end, new_file in zip(
+                group_bounds[:-1], group_bounds[1:], new_file_by_group):
+            # Find the calendar day the group starts in
+            while day_bounds[day_index + 1] <= group_start:
+                day_index += 1
+            group_uids = uids[group_start:group_end]
+            if day_bounds[day_index + 1] >= group_end:
+                group_days = ((day_y_m_d[day_bounds[day_index]], group_uids), )
+            else:
+                group_days = []
+                i = day_index
+                while day_bounds[i] < group_end:
+                    group_days.append(
+                        (
+                            day_y_m_d[day_bounds[i]],
+                            uids[max(day_bounds[i], group_start):min(day_bounds[i + 1], group_end)]
+                        )
+                    )
+                    i += 1
+                group_days = tuple(group_days)
+
+            start = arrow.get(float(ctimes[group_start])).to('local')
+            if group_end - group_start == 1:
+                end = start
+            else:
+                end = arrow.get(float(ctimes[group_end - 1])).to('local')
+
+            groups.append(
+                ProximityGroup(
+                    start=start, end=end, uids=group_uids, new_file=new_file, days=group_days,
+                    text=proximity_group_text(start, end)
+                )
+            )
+
+        return groups
+
     def make_file_types_in_cell_text(self, slice_start: int, slice_end: int) -> str:
         c = FileTypeCounter(self.thumbnail_types[slice_start:slice_end])
         return c.summarize_file_count()[0]
@@ -1051,6 +1595,87 @@ class TemporalProximityGroups:
             tooltip_date_col2=tooltip_col2_text
         )
 
+    def _indexed_values(self) -> Tuple[Dict, ...]:
+        """
+        :return: values indexed by Timeline row and column, or that refer to Timeline rows
+        """
+
+        return (
+            self.file_types_in_cell, self.row_span_for_column_starts_at_row,
+            self.proximity_view_cell_id_col1, self.proximity_view_cell_id_col2
+        ) + self.uids._uids + self.uids._no_uids + (self.uids._col2_row_index, )
+
+    def diff(self, previous: 'TemporalProximityGroups') -> TimelineDiff:
+        """
+        Determine what has changed since the previous generation of the Timeline.
+
+        :param previous: the previous generation
+        :return: changes that, when applied to the previous generation, yield this one
+        """
+
+        old_rows = previous.rows
+        new_rows = self.rows
+        length = min(len(old_rows), len(new_rows))
+        first = 0
+        while first < length and old_rows[first] == new_rows[first]:
+            first += 1
+        last = 0
+        while last < length - first and old_rows[-last - 1] == new_rows[-last - 1]:
+            last += 1
+
+        changes = tuple(
+            _dict_diff(old, new)
+            for old, new in zip(previous._indexed_values(), self._indexed_values())
+        )
+
+        old_cells = {uid: (col1, col2) for col1, col2, uid in previous.col1_col2_uid}
+        col1_col2_uid = [
+            (col1, col2, uid) for col1, col2, uid in self.col1_col2_uid
+            if old_cells.get(uid) != (col1, col2)
+        ]
+
+        return TimelineDiff(
+            base_generation=previous.generation, generation=self.generation,
+            first_row=first, removed_rows=len(old_rows) - first - last,
+            rows=new_rows[first:len(new_rows) - last], changes=changes,
+            col1_col2_uid=col1_col2_uid, spans=self.spans, display_values=self.display_values,
+            dominant_file_type=self.dominant_file_type, depth=self.depth(),
+            invalid_rows=self.invalid_rows
+        )
+
+    def apply_changes(self, diff: TimelineDiff) -> None:
+        """
+        Apply everything in the diff except the replacement of the rows
+        """
+
+        for values, (removed, changed) in zip(self._indexed_values(), diff.changes):
+            for key in removed:
+                del values[key]
+            values.update(changed)
+
+        cells = {uid: (col1, col2) for col1, col2, uid in self.col1_col2_uid}
+        for col1, col2, uid in diff.col1_col2_uid:
+            cells[uid] = col1, col2
+        col2_row_index = self.uids._col2_row_index
+        self.col1_col2_uid = [
+            (col1, col2, uid) for uid, (col1, col2) in cells.items() if uid in col2_row_index
+        ]
+
+        self.spans = diff.spans
+        self.display_values = diff.display_values
+        self.dominant_file_type = diff.dominant_file_type
+        self._depth = diff.depth
+        self.invalid_rows = diff.invalid_rows
+        self.generation = diff.generation
+
+    def apply_diff(self, diff: TimelineDiff) -> None:
+        """
+        Update this generation of the Timeline to the generation in the diff
+        """
+
+        self.rows[diff.first_row:diff.first_row + diff.removed_rows] = diff.rows
+        self.apply_changes(diff)
+
     def __len__(self) -> int:
         return len(self.rows)
 
@@ -1271,6 +1896,35 @@ class TemporalProximityModel(QAbstractTableModel):
             for first, last in runs(rows_to_update):
                 self.dataChanged.emit(self.index(first, 2), self.index(last, 2))
 
+    def applyDiff(self, diff: TimelineDiff) -> None:
+        """
+        Update the Timeline with the changes since it was last generated, removing
+        and inserting only the rows that changed
+        """
+
+        groups = self.groups
+        first = diff.first_row
+        if diff.removed_rows == len(diff.rows):
+            groups.apply_diff(diff)
+            if diff.rows:
+                self.dataChanged.emit(
+                    self.index(first, 0), self.index(first + len(diff.rows) - 1, 2)
+                )
+            return
+
+        if diff.removed_rows:
+            self.beginRemoveRows(QModelIndex(), first, first + diff.removed_rows - 1)
+            del groups.rows[first:first + diff.removed_rows]
+            self.endRemoveRows()
+
+        if diff.rows:
+            self.beginInsertRows(QModelIndex(), first, first + len(diff.rows) - 1)
+            groups.rows[first:first] = diff.rows
+            groups.apply_changes(diff)
+            self.endInsertRows()
+        else:
+            groups.apply_changes(diff)
+
 
 class TemporalProximityDelegate(QStyledItemDelegate):
     """
@@ -2053,6 +2707,77 @@ class TemporalProximity(QWidget):
 
         self.temporalProximityModel.groups = proximity_groups
 
+        self.assignDisplayValues(proximity_groups)
+
+        self.temporalProximityModel.endResetModel()
+
+        self.resizeTimeline(proximity_groups)
+
+        self.setState(TemporalProximityState.generated)
+
+        # Has the user manually set any files as previously downloaded while the Timeline was
+        # generating?
+        if self.uids_manually_set_previously_downloaded:
+            self.temporalProximityModel.updatePreviouslyDownloaded(
+                uids=self.uids_manually_set_previously_downloaded
+            )
+            self.uids_manually_set_previously_downloaded = []
+
+        return True
+
+    def applyDiff(self, diff: TimelineDiff) -> bool:
+        """
+        Update the Timeline with the changes since the generation it displays
+
+        :param diff: changes generated by the offload process
+        :return: True if Timeline was updated, False if not updated due to
+         current state
+        """
+
+        groups = self.temporalProximityModel.groups
+        if groups is None or groups.generation != diff.base_generation:
+            logging.debug(
+                "Timeline generation %s cannot be updated with %s",
+                None if groups is None else groups.generation, diff
+            )
+            self.rapidApp.generateTemporalProximityTableData(
+                reason="the Timeline it was generated from is not displayed", reset=True
+            )
+            return False
+
+        logging.debug("Updating Timeline with %s", diff)
+
+        # Always keep the Timeline in step with the offload process, even when it is
+        # about to be regenerated
+        self.temporalProximityModel.applyDiff(diff)
+        self.thumbnailModel.assignProximityGroups(diff.col1_col2_uid)
+
+        if self.state == TemporalProximityState.regenerate:
+            self.rapidApp.generateTemporalProximityTableData(
+                reason="a change was made while it was already generating"
+            )
+            return False
+        if self.state == TemporalProximityState.ctime_rebuild:
+            return False
+
+        self.assignDisplayValues(groups)
+        self.resizeTimeline(groups)
+
+        self.setState(TemporalProximityState.generated)
+
+        if self.uids_manually_set_previously_downloaded:
+            self.temporalProximityModel.updatePreviouslyDownloaded(
+                uids=self.uids_manually_set_previously_downloaded
+            )
+            self.uids_manually_set_previously_downloaded = []
+
+        return True
+
+    def assignDisplayValues(self, proximity_groups: TemporalProximityGroups) -> None:
+        """
+        Assign the Timeline's depth, row spans and formatting hints to the view
+        """
+
         depth = proximity_groups.depth()
         self.temporalProximityDelegate.depth = depth
         if depth in (0, 1):
@@ -2069,10 +2794,15 @@ class TemporalProximity(QWidget):
         for column, row, row_span in proximity_groups.spans:
             self.temporalProximityView.setSpan(row, column, row_span, 1)
 
-        self.temporalProximityModel.endResetModel()
+    def resizeTimeline(self, proximity_groups: TemporalProximityGroups) -> None:
+        """
+        Set row heights and column widths, changing only those that differ
+        """
 
+        depth = proximity_groups.depth()
         for idx, height in enumerate(proximity_groups.display_values.row_heights):
-            self.temporalProximityView.setRowHeight(idx, height)
+            if self.temporalProximityView.rowHeight(idx) != height:
+                self.temporalProximityView.setRowHeight(idx, height)
         for idx, width in enumerate(proximity_groups.display_values.col_widths):
             self.temporalProximityView.setColumnWidth(idx, width)
 
@@ -2088,18 +2818,6 @@ class TemporalProximity(QWidget):
         frame_width = QSplitter().lineWidth() * 2
         self.temporalProximityView.setMinimumWidth(min_width + scrollbar_width + frame_width)
 
-        self.setState(TemporalProximityState.generated)
-
-        # Has the user manually set any files as previously downloaded while the Timeline was
-        # generating?
-        if self.uids_manually_set_previously_downloaded:
-            self.temporalProximityModel.updatePreviouslyDownloaded(
-                uids=self.uids_manually_set_previously_downloaded
-            )
-            self.uids_manually_set_previously_downloaded = []
-
-        return True
-
     @pyqtSlot(int)
     def temporalValueChanged(self, minutes: int) -> None:
         self.prefs.set_proximity(minutes=minutes)
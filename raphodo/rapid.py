@@ -112,7 +112,7 @@ from raphodo.interprocess import (
     BackupFileData, OffloadData, ProcessLoggingManager, ThumbnailDaemonData, ThreadNames,
     OffloadManager, CopyFilesManager, ThumbnailDaemonManager,
     ScanManager, BackupManager, stop_process_logging_manager, RenameMoveFileManager,
-    create_inproc_msg)
+    create_inproc_msg, BackupDestination, FAN_OUT_BACKUP_WORKER_ID, ExifToolPoolManager)
 from raphodo.devices import (
     Device, DeviceCollection, BackupDevice, BackupDeviceCollection, FSMetadataErrors
 )
@@ -124,18 +124,19 @@ from raphodo.constants import (
     DisplayingFilesOfType, DownloadingFileTypes, RememberThisMessage, RightSideButton,
     CheckNewVersionDialogState, CheckNewVersionDialogResult, RememberThisButtons,
     BackupStatus, CompletedDownloads, disable_version_check, FileManagerType, ScalingAction,
-    ScalingDetected
+    ScalingDetected, ChecksumAlgorithm
 )
 from raphodo.thumbnaildisplay import (
     ThumbnailView, ThumbnailListModel, ThumbnailDelegate, DownloadStats, MarkedSummary
 )
 from raphodo.devicedisplay import (DeviceModel, DeviceView, DeviceDelegate)
-from raphodo.proximity import (TemporalProximityGroups, TemporalProximity)
+from raphodo.proximity import (TemporalProximityGroups, TemporalProximity, TimelineDiff)
 from raphodo.utilities import (
     same_device, make_internationalized_list, thousands, addPushButtonLabelSpacer,
     make_html_path_non_breaking, prefs_list_from_gconftool2_string,
     pref_bool_from_gconftool2_string, extract_file_from_tar, format_size_for_user,
-    is_snap, version_check_disabled, installed_using_pip, getQtSystemTranslation
+    is_snap, version_check_disabled, installed_using_pip, getQtSystemTranslation,
+    available_checksum_algorithm
 )
 from raphodo.rememberthisdialog import RememberThisDialog
 import raphodo.utilities
@@ -144,7 +145,7 @@ from raphodo.rpdfile import (
 )
 import raphodo.fileformats as fileformats
 import raphodo.downloadtracker as downloadtracker
-from raphodo.cache import ThumbnailCacheSql
+from raphodo.cache import ThumbnailCacheSql, ThumbnailCacheEvictor, MetadataCacheSql
 from raphodo.programversions import gexiv2_version, exiv2_version, EXIFTOOL_VERSION
 from raphodo.metadatavideo import pymedia_version_info, libmediainfo_missing
 from raphodo.camera import (
@@ -173,7 +174,7 @@ from raphodo.renamepanel import RenamePanel
 from raphodo.jobcodepanel import JobCodePanel
 from raphodo.backuppanel import BackupPanel
 import raphodo
-import raphodo.exiftool as exiftool
+from raphodo.exiftoolpool import get_exiftool, pool_port_variable
 from raphodo.newversion import (
     NewVersion, NewVersionCheckDialog, version_details, DownloadNewVersionDialog
 )
@@ -185,7 +186,8 @@ from raphodo.problemnotification import (
 )
 from raphodo.viewutils import (
     standardIconSize, qt5_screen_scale_environment_variable, QT5_VERSION, validateWindowSizeLimit,
-    validateWindowPosition, scaledIcon, any_screen_scaled, standardMessageBox
+    validateWindowPosition, scaledIcon, any_screen_scaled, standardMessageBox,
+    ThumbnailDataForProximity
 )
 from raphodo import viewutils
 import raphodo.didyouknow as didyouknow
@@ -666,10 +668,6 @@ class RapidWindow(QMainWindow):
 
         self.prefs.verify_file = False
 
-        logging.debug("Starting main ExifTool process")
-        self.exiftool_process = exiftool.ExifTool()
-        self.exiftool_process.start()
-
         self.prefs.validate_max_CPU_cores()
         self.prefs.validate_ignore_unhandled_file_exts()
 
@@ -791,6 +789,20 @@ class RapidWindow(QMainWindow):
 
         logging.debug("Stage 2 initialization")
 
+        # Start the ExifTool pool before any process that uses ExifTool, so
+        # that they all use it instead of starting their own ExifTool process
+        logging.debug("Starting ExifTool pool")
+        self.exiftool_pool = ExifToolPoolManager(
+            max_processes=self.prefs.max_exiftool_processes, logging_port=logging_port
+        )
+        pool_port = self.exiftool_pool.start()
+        if pool_port is not None:
+            os.environ[pool_port_variable] = str(pool_port)
+        else:
+            self.exiftool_pool = None
+        self.exiftool_process = get_exiftool()
+        self.exiftool_process.start()
+
         if self.prefs.purge_thumbnails:
             cache = ThumbnailCacheSql(create_table_if_not_exists=False)
             logging.info("Purging thumbnail cache...")
@@ -817,9 +829,18 @@ class RapidWindow(QMainWindow):
             # Recreate the cache on the file system
             t = ThumbnailCacheSql(create_table_if_not_exists=True)
 
+        # Keep the thumbnail cache within its maximum size, removing the least
+        # recently used thumbnails in the background
+        self.thumbnail_cache_evictor = ThumbnailCacheEvictor(
+            max_size=self.prefs.max_thumbnail_cache_size * 1024 * 1024
+        )
+        self.thumbnail_cache_evictor.start()
+
         # For meaning of 'Devices', see devices.py
         self.devices = DeviceCollection(self.exiftool_process, self)
         self.backup_devices = BackupDeviceCollection(rapidApp=self)
+        # Whether the worker that backs up to every backup device at once is running
+        self.backup_fan_out_running = False
 
         logging.debug("Starting thumbnail daemon model")
 
@@ -864,6 +885,9 @@ class RapidWindow(QMainWindow):
         self.setCentralWidget(centralWidget)
 
         self.temporalProximity = TemporalProximity(rapidApp=self, prefs=self.prefs)
+        # The files the offload process last used to generate the Timeline,
+        # uid: ThumbnailDataForProximity. None when the Timeline must be generated in full.
+        self.proximity_rows_sent = None  # type: Optional[Dict[bytes, ThumbnailDataForProximity]]
 
         # Respond to the user selecting / deslecting temporal proximity (timeline) cells:
         self.temporalProximity.proximitySelectionHasChanged.connect(
@@ -1030,6 +1054,7 @@ class RapidWindow(QMainWindow):
         self.offloadThread.started.connect(self.offloadmq.run_sink)
         self.offloadmq.sinkStarted.connect(self.initStage5)
         self.offloadmq.message.connect(self.proximityGroupsGenerated)
+        self.offloadmq.timelineDiff.connect(self.proximityGroupsChanged)
         self.offloadmq.moveToThread(self.offloadThread)
 
         QTimer.singleShot(0, self.offloadThread.start)
@@ -3301,6 +3326,9 @@ Do you want to proceed with the download?
             generate_thumbnails = True
 
         verify_file = self.prefs.verify_file
+        checksum_algorithm = available_checksum_algorithm(
+            ChecksumAlgorithm(self.prefs.checksum_algorithm)
+        )
 
         # Initiate copy files process
 
@@ -3313,7 +3341,8 @@ Do you want to proceed with the download?
             files=files,
             verify_file=verify_file,
             generate_thumbnails=generate_thumbnails,
-            log_gphoto2=self.log_gphoto2
+            log_gphoto2=self.log_gphoto2,
+            checksum_algorithm=checksum_algorithm
         )
 
         self.sendStartWorkerToThread(self.copy_controller, worker_id=scan_id, data=copyfiles_args)
@@ -3593,6 +3622,7 @@ Do you want to proceed with the download?
     def sendBackupStartFinishMessageToWorkers(self, message: BackupStatus) -> None:
         if self.prefs.backup_files:
             download_types = self.download_files.download_types
+            destinations = []
             for path in self.backup_devices:
                 backup_type = self.backup_devices[path].backup_type
                 if (
@@ -3601,10 +3631,24 @@ Do you want to proceed with the download?
                             download_types == DownloadingFileTypes.photos_and_videos
                         ) or backup_type == download_types):
                     device_id = self.backup_devices.device_id(path)
-                    data = BackupFileData(message=message)
-                    self.sendDataMessageToThread(
-                        self.backup_controller, worker_id=device_id, data=data
-                    )
+                    if self.backup_fan_out_running:
+                        destinations.append(self.backupDestination(path, do_backup=True))
+                    else:
+                        data = BackupFileData(message=message)
+                        self.sendDataMessageToThread(
+                            self.backup_controller, worker_id=device_id, data=data
+                        )
+            if destinations:
+                data = BackupFileData(message=message, destinations=destinations)
+                self.sendDataMessageToThread(
+                    self.backup_controller, worker_id=FAN_OUT_BACKUP_WORKER_ID, data=data
+                )
+
+    def backupDestination(self, path: str, do_backup: bool) -> BackupDestination:
+        return BackupDestination(
+            device_id=self.backup_devices.device_id(path), path=path,
+            device_name=self.backup_devices.name(path), do_backup=do_backup
+        )
 
     def backupFile(self, rpd_file: RPDFile, move_succeeded: bool, download_count: int) -> None:
         if self.prefs.backup_device_autodetection:
@@ -3620,6 +3664,8 @@ Do you want to proceed with the download?
         else:
             logging.debug("Backing up video %s", rpd_file.download_name)
 
+        destinations = []
+
         for path in self.backup_devices:
             backup_type = self.backup_devices[path].backup_type
             do_backup = (
@@ -3641,6 +3687,10 @@ Do you want to proceed with the download?
             # but the code is more simpler
             # TODO: investigate a more optimal approach!
 
+            if self.backup_fan_out_running:
+                destinations.append(self.backupDestination(path, do_backup=do_backup))
+                continue
+
             device_id = self.backup_devices.device_id(path)
             data = BackupFileData(
                 rpd_file=rpd_file,
@@ -3654,6 +3704,23 @@ Do you want to proceed with the download?
             )
             self.sendDataMessageToThread(self.backup_controller, worker_id=device_id, data=data)
 
+        if destinations:
+            # Read the file once, and write it to every backup device
+            data = BackupFileData(
+                rpd_file=rpd_file,
+                move_succeeded=move_succeeded,
+                do_backup=any(destination.do_backup for destination in destinations),
+                path_suffix=path_suffix,
+                backup_duplicate_overwrite=self.prefs.backup_duplicate_overwrite,
+                verify_file=self.prefs.verify_file,
+                download_count=download_count,
+                save_fdo_thumbnail=self.prefs.save_fdo_thumbnails,
+                destinations=destinations
+            )
+            self.sendDataMessageToThread(
+                self.backup_controller, worker_id=FAN_OUT_BACKUP_WORKER_ID, data=data
+            )
+
     @pyqtSlot(int, bool, bool, RPDFile, str, 'PyQt_PyObject')
     def fileBackedUp(self, device_id: int,
                      backup_succeeded: bool,
@@ -4648,11 +4715,20 @@ Do you want to proceed with the download?
 
         QTimer.singleShot(0, self.close)
 
-    def generateTemporalProximityTableData(self, reason: str) -> None:
+    def generateTemporalProximityTableData(self, reason: str, reset: bool=False) -> None:
         """
         Initiate Timeline generation if it's right to do so
+
+        Only the files added, changed or removed since the Timeline was last generated
+        are sent to the offload process, unless the Timeline must be generated in full.
+
+        :param reason: why the Timeline is being generated, for logging
+        :param reset: if True, generate the Timeline in full
         """
 
+        if reset:
+            self.proximity_rows_sent = None
+
         if self.temporalProximity.state == TemporalProximityState.ctime_rebuild:
             logging.info(
                 "Was tasked to generate Timeline because %s, but ignoring request "
@@ -4665,7 +4741,20 @@ Do you want to proceed with the download?
             logging.info("Generating Timeline because %s", reason)
 
             self.temporalProximity.setState(TemporalProximityState.generating)
-            data = OffloadData(thumbnail_rows=rows, proximity_seconds=self.prefs.proximity_seconds)
+            current = {row.uid: row for row in rows}
+            sent = self.proximity_rows_sent
+            if sent is None:
+                data = OffloadData(
+                    thumbnail_rows=rows, proximity_seconds=self.prefs.proximity_seconds,
+                    reset=True
+                )
+            else:
+                data = OffloadData(
+                    thumbnail_rows=[row for row in rows if sent.get(row.uid) != row],
+                    removed_uids=[uid for uid in sent if uid not in current],
+                    proximity_seconds=self.prefs.proximity_seconds
+                )
+            self.proximity_rows_sent = current
             self.sendToOffload(data=data)
         else:
             logging.info(
@@ -4679,6 +4768,10 @@ Do you want to proceed with the download?
         if self.temporalProximity.setGroups(proximity_groups=proximity_groups):
             self.thumbnailModel.assignProximityGroups(proximity_groups.col1_col2_uid)
 
+    @pyqtSlot(TimelineDiff)
+    def proximityGroupsChanged(self, diff: TimelineDiff) -> None:
+        self.temporalProximity.applyDiff(diff=diff)
+
     def closeEvent(self, event) -> None:
         logging.debug("Close event activated")
 
@@ -4725,7 +4818,7 @@ Do you want to proceed with the download?
         # write settings before closing error log window
         self.errorLog.done(0)
 
-        logging.debug("Terminating main ExifTool process")
+        logging.debug("Disconnecting main process from ExifTool")
         self.exiftool_process.terminate()
 
         self.sendStopToThread(self.offload_controller)
@@ -4768,6 +4861,10 @@ Do you want to proceed with the download?
         if not self.thumbnaildaemonmqThread.wait(2000):
             self.sendTerminateToThread(self.thumbnail_deamon_controller)
 
+        if self.exiftool_pool is not None:
+            logging.debug("Stopping ExifTool pool")
+            self.exiftool_pool.stop()
+
         # Tell logging thread to stop: uses slightly different approach
         # than other threads
         stop_process_logging_manager(info_port=self.logging_port)
@@ -4779,9 +4876,23 @@ Do you want to proceed with the download?
         self.cleanAllTempDirs()
         logging.debug("Cleaning any device cache dirs and sample video")
         self.devices.delete_cache_dirs_and_sample_video()
+        self.thumbnail_cache_evictor.stop()
         tc = ThumbnailCacheSql(create_table_if_not_exists=False)
+        statistics = tc.statistics()
+        logging.debug(
+            "Thumbnail cache: %s hits, %s misses, %s evictions", statistics.hits,
+            statistics.misses, statistics.evictions
+        )
         logging.debug("Cleaning up Thumbnail cache")
         tc.cleanup_cache(days=self.prefs.keep_thumbnails_days)
+        mc = MetadataCacheSql()
+        statistics = mc.statistics()
+        lookups = statistics.hits + statistics.misses
+        logging.debug(
+            "Metadata cache: %s hits, %s misses (%.0f%% hit rate)", statistics.hits,
+            statistics.misses, statistics.hits / lookups * 100 if lookups else 0.0
+        )
+        mc.cleanup_cache(days=self.prefs.keep_thumbnails_days)
 
         Notify.uninit()
 
@@ -5478,10 +5589,18 @@ Do you want to proceed with the download?
         self.backupPanel.setupBackupDisplay()
 
     def removeBackupDevice(self, path: str) -> None:
-        device_id = self.backup_devices.device_id(path)
-        self.sendStopWorkerToThread(self.backup_controller, worker_id=device_id)
+        if not self.backup_fan_out_running:
+            device_id = self.backup_devices.device_id(path)
+            self.sendStopWorkerToThread(self.backup_controller, worker_id=device_id)
         del self.backup_devices[path]
 
+    def stopBackupFanOut(self) -> None:
+        if self.backup_fan_out_running:
+            self.sendStopWorkerToThread(
+                self.backup_controller, worker_id=FAN_OUT_BACKUP_WORKER_ID
+            )
+            self.backup_fan_out_running = False
+
     def resetupBackupDevices(self) -> None:
         """
         Change backup preferences in response to preference change.
@@ -5499,6 +5618,7 @@ Do you want to proceed with the download?
         # Clear all existing backup devices
         for path in self.backup_devices.all_paths():
             self.removeBackupDevice(path)
+        self.stopBackupFanOut()
         self.download_tracker.set_no_backup_devices(0, 0)
         self.backupPanel.resetBackupDisplay()
 
@@ -5582,6 +5702,19 @@ Do you want to proceed with the download?
                 logging.warning("This Computer download path is not specified")
 
     def addDeviceToBackupManager(self, path: str) -> None:
+        if self.prefs.backup_fan_out:
+            # One worker backs up to every backup device. It is told which devices
+            # to back up to along with each file.
+            if not self.backup_fan_out_running:
+                self.backup_controller.send_multipart(
+                    create_inproc_msg(
+                        b'START_WORKER', worker_id=FAN_OUT_BACKUP_WORKER_ID,
+                        data=BackupArguments(path='', device_name='', fan_out=True)
+                    )
+                )
+                self.backup_fan_out_running = True
+            return
+
         device_id = self.backup_devices.device_id(path)
         self.backup_controller.send_multipart(create_inproc_msg(b'START_WORKER',
                                 worker_id=device_id,
@@ -44,15 +44,18 @@ try:
 except locale.Error:
     pass
 
-
+from tenacity import RetryError
 
 import raphodo.exiftool as exiftool
+from raphodo.exiftoolpool import get_exiftool
 import raphodo.generatename as gn
 from raphodo.preferences import DownloadsTodayTracker, Preferences
 from raphodo.constants import ConflictResolution, FileType, DownloadStatus, RenameAndMoveStatus
 from raphodo.interprocess import RenameAndMoveFileData, RenameAndMoveFileResults, DaemonProcess
+from raphodo.serialization import encode_message
 from raphodo.rpdfile import RPDFile, Photo, Video
 from raphodo.rpdsql import DownloadedSQL
+from raphodo.cache import MetadataCacheSql
 from raphodo.utilities import stdchannel_redirected, datetime_roughly_equal, platform_c_maxint
 from raphodo.problemnotification import (
     FileAlreadyExistsProblem, IdentifierAddedProblem, RenamingProblems, make_href,
@@ -160,18 +163,28 @@ class SyncRawJpeg:
 
 def load_metadata(rpd_file: Union[Photo, Video],
                   et_process: exiftool.ExifTool,
-                  problems: RenamingProblems) -> bool:
+                  problems: RenamingProblems,
+                  metadata_cache: Optional[MetadataCacheSql]=None) -> bool:
     """
     Loads the metadata for the file.
 
     :param rpd_file: photo or video
     :param et_process: the daemon ExifTool process
     :param problems: problems encountered renaming the file
+    :param metadata_cache: if specified, metadata values are taken from
+     the cache where possible, rather than read from the file
     :return True if operation succeeded, false otherwise
     """
     if rpd_file.metadata is None:
-        if not rpd_file.load_metadata(full_file_name=rpd_file.temp_full_file_name,
-                                      et_process=et_process):
+        if metadata_cache is not None:
+            loaded = metadata_cache.load_metadata(
+                rpd_file, full_file_name=rpd_file.temp_full_file_name, et_process=et_process
+            )
+        else:
+            loaded = rpd_file.load_metadata(
+                full_file_name=rpd_file.temp_full_file_name, et_process=et_process
+            )
+        if not loaded:
             # Error in reading metadata
 
             problems.append(
@@ -187,7 +200,8 @@ def _generate_name(generator: Union[gn.PhotoName, gn.PhotoSubfolder, gn.VideoNam
                                     gn.VideoSubfolder],
                    rpd_file: Union[Photo, Video], 
                    et_process: exiftool.ExifTool,
-                   problems: RenamingProblems) -> str:
+                   problems: RenamingProblems,
+                   metadata_cache: Optional[MetadataCacheSql]=None) -> str:
     """
     Generate a subfolder or file name.
     
@@ -195,9 +209,10 @@ def _generate_name(generator: Union[gn.PhotoName, gn.PhotoSubfolder, gn.VideoNam
      for the file type (photo or video)
     :param rpd_file: file to work on 
     :param et_process:  the daemon ExifTool process
+    :param metadata_cache: optional cache of metadata values
     :return: the name in string format, emptry string if error
     """
-    do_generation = load_metadata(rpd_file, et_process, problems)
+    do_generation = load_metadata(rpd_file, et_process, problems, metadata_cache)
 
     if do_generation:
         value = generator.generate_name(rpd_file)
@@ -211,13 +226,15 @@ def _generate_name(generator: Union[gn.PhotoName, gn.PhotoSubfolder, gn.VideoNam
 
 def generate_subfolder(rpd_file: Union[Photo, Video],
                        et_process: exiftool.ExifTool,
-                       problems: RenamingProblems) -> None:
+                       problems: RenamingProblems,
+                       metadata_cache: Optional[MetadataCacheSql]=None) -> None:
     """
     Generate subfolder names e.g. 2015/201512
     
     :param rpd_file: file to work on
     :param et_process:  the daemon ExifTool process
     :param problems: problems encountered renaming the file
+    :param metadata_cache: optional cache of metadata values
     """
     
     if rpd_file.file_type == FileType.photo:
@@ -225,18 +242,22 @@ def generate_subfolder(rpd_file: Union[Photo, Video],
     else:
         generator = gn.VideoSubfolder(rpd_file.subfolder_pref_list, problems=problems)
 
-    rpd_file.download_subfolder = _generate_name(generator, rpd_file, et_process, problems)
+    rpd_file.download_subfolder = _generate_name(
+        generator, rpd_file, et_process, problems, metadata_cache
+    )
 
 
 def generate_name(rpd_file: Union[Photo, Video],
                   et_process: exiftool.ExifTool,
-                  problems: RenamingProblems) -> None:
+                  problems: RenamingProblems,
+                  metadata_cache: Optional[MetadataCacheSql]=None) -> None:
     """
     Generate file names e.g. 20150607-1.cr2
 
     :param rpd_file: file to work on
     :param et_process:  the daemon ExifTool process
     :param problems: problems encountered renaming the file
+    :param metadata_cache: optional cache of metadata values
     """
 
     if rpd_file.file_type == FileType.photo:
@@ -244,7 +265,9 @@ def generate_name(rpd_file: Union[Photo, Video],
     else:
         generator = gn.VideoName(pref_list=rpd_file.name_pref_list, problems=problems)
 
-    rpd_file.download_name = _generate_name(generator, rpd_file, et_process, problems)
+    rpd_file.download_name = _generate_name(
+        generator, rpd_file, et_process, problems, metadata_cache
+    )
 
 
 class RenameMoveFileWorker(DaemonProcess):
@@ -260,7 +283,11 @@ class RenameMoveFileWorker(DaemonProcess):
         self.prefs = Preferences()
 
         self.sync_raw_jpeg = SyncRawJpeg()
-        self.downloaded = DownloadedSQL()
+        # Record downloaded files in batches, rather than one transaction per file
+        self.downloaded = DownloadedSQL(buffer_size=50, buffer_time=2000)
+        # Metadata values read when scanning, so most files' metadata need not
+        # be read again to generate their names
+        self.metadata_cache = MetadataCacheSql()
 
         logging.debug("Start of day is set to %s", self.prefs.day_start)
 
@@ -270,6 +297,24 @@ class RenameMoveFileWorker(DaemonProcess):
         # clarifies any problems with type checking in an IDE
         self.problems = RenamingProblems()
 
+    def flush_downloaded_files(self) -> None:
+        """
+        Write any downloaded files not yet recorded to the database of
+        downloaded files
+        """
+
+        try:
+            self.downloaded.flush()
+        except (sqlite3.OperationalError, RetryError) as e:
+            logging.error(
+                "Database error recording %s downloaded files: %s. Will retry later.",
+                len(self.downloaded.pending), e
+            )
+
+    def cleanup_pre_stop(self) -> None:
+        self.flush_downloaded_files()
+        self.metadata_cache.flush()
+
     def notify_file_already_exists(self, rpd_file: Union[Photo, Video],
                                    identifier: Optional[str]=None) -> None:
         """
@@ -622,7 +667,8 @@ class RenameMoveFileWorker(DaemonProcess):
         failed = False
         sequence_to_use = None
         photo_name, photo_ext = os.path.splitext(rpd_file.name)
-        if not load_metadata(rpd_file, self.exiftool_process, self.problems):
+        if not load_metadata(
+                rpd_file, self.exiftool_process, self.problems, self.metadata_cache):
             failed = True
             rpd_file.status = DownloadStatus.download_failed
             self.check_for_fatal_name_generation_errors(rpd_file)
@@ -687,7 +733,7 @@ class RenameMoveFileWorker(DaemonProcess):
 
         rpd_file.strip_characters = self.prefs.strip_characters
 
-        generate_subfolder(rpd_file, self.exiftool_process, self.problems)
+        generate_subfolder(rpd_file, self.exiftool_process, self.problems, self.metadata_cache)
 
         if rpd_file.download_subfolder:
             logging.debug("Generated subfolder name %s for file %s",
@@ -700,7 +746,7 @@ class RenameMoveFileWorker(DaemonProcess):
             rpd_file.sequences = self.sequences
 
             # generate the file name
-            generate_name(rpd_file, self.exiftool_process, self.problems)
+            generate_name(rpd_file, self.exiftool_process, self.problems, self.metadata_cache)
 
             if rpd_file.name_generation_problem:
                 logging.warning(
@@ -898,11 +944,18 @@ class RenameMoveFileWorker(DaemonProcess):
         )
 
         with stdchannel_redirected(sys.stderr, os.devnull):
-            with exiftool.ExifTool() as self.exiftool_process:
+            with get_exiftool() as self.exiftool_process:
                 while True:
                     if i:
                         logging.debug("Finished %s. Getting next task.", i)
 
+                    # Write downloaded files still held in memory should the next file
+                    # not arrive in time, e.g. because the download is slow
+                    timeout = self.downloaded.flush_timeout()
+                    if timeout is not None and not self.receiver.poll(timeout):
+                        self.flush_downloaded_files()
+                        continue
+
                     # rename file and move to generated subfolder
                     directive, content = self.receiver.recv_multipart()
 
@@ -927,10 +980,12 @@ class RenameMoveFileWorker(DaemonProcess):
                         self.problems = RenamingProblems()
 
                     elif data.message == RenameAndMoveStatus.download_completed:
+                        self.flush_downloaded_files()
+                        self.metadata_cache.flush()
+
                         if len(self.problems):
-                            self.content = pickle.dumps(
-                                RenameAndMoveFileResults(problems=self.problems),
-                                pickle.HIGHEST_PROTOCOL
+                            self.content = encode_message(
+                                RenameAndMoveFileResults(problems=self.problems)
                             )
                             self.send_message_to_sink()
 
@@ -938,12 +993,11 @@ class RenameMoveFileWorker(DaemonProcess):
                         # sequence number and downloads today values. Cannot do it
                         # here because to save QSettings, QApplication should be
                         # used.
-                        self.content = pickle.dumps(
+                        self.content = encode_message(
                             RenameAndMoveFileResults(
                                 stored_sequence_no=self.sequences.stored_sequence_no,
                                 downloads_today=self.downloads_today_tracker.downloads_today
-                            ),
-                            pickle.HIGHEST_PROTOCOL
+                            )
                         )
                         dl_today = self.downloads_today_tracker.get_or_reset_downloads_today()
                         logging.debug("Downloads today: %s", dl_today)
@@ -964,25 +1018,30 @@ class RenameMoveFileWorker(DaemonProcess):
                                         modification_time=rpd_file.modification_time,
                                         download_full_file_name=rpd_file.download_full_file_name
                                     )
-                                except sqlite3.OperationalError as e:
+                                except (sqlite3.OperationalError, RetryError) as e:
                                     # This should never happen because this is the only process
                                     # writing to the database..... but just in case
                                     logging.error(
-                                        "Database error adding download file %s: %s. Will not "
-                                        "retry.",
+                                        "Database error adding download file %s: %s. Will "
+                                        "retry when the next file is recorded.",
                                         rpd_file.download_full_file_name, e
                                     )
                         else:
                             move_succeeded = False
 
+                        try:
+                            self.metadata_cache.record(rpd_file)
+                        except Exception:
+                            logging.exception(
+                                "Could not cache the metadata of %s", rpd_file.full_file_name
+                            )
                         rpd_file.metadata = None
-                        self.content = pickle.dumps(
+                        self.content = encode_message(
                             RenameAndMoveFileResults(
                                 move_succeeded=move_succeeded,
                                 rpd_file=rpd_file,
                                 download_count=download_count
-                            ),
-                            pickle.HIGHEST_PROTOCOL
+                            )
                         )
                         self.send_message_to_sink()
 
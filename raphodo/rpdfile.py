@@ -20,14 +20,16 @@ __author__ = 'Damon Lynch'
 __copyright__ = "Copyright 2011-2020, Damon Lynch"
 
 import os
+import sys
 import time
+import operator
 from datetime import datetime
 import uuid
 import logging
 import mimetypes
 from collections import Counter, UserDict
 import locale
-from typing import Optional, List, Tuple, Union, Any
+from typing import Optional, List, Tuple, Union, Any, Dict
 
 import gi
 
@@ -37,7 +39,7 @@ from gi.repository import GLib
 import raphodo.exiftool as exiftool
 from raphodo.constants import (
     DownloadStatus, FileType, FileExtension, FileSortPriority, ThumbnailCacheStatus, Downloaded,
-    DeviceTimestampTZ, ThumbnailCacheDiskStatus, ExifSource,
+    DeviceTimestampTZ, ThumbnailCacheDiskStatus, ExifSource, ChecksumAlgorithm
 )
 
 from raphodo.storage import get_uri, CameraDetails
@@ -313,11 +315,104 @@ class FileTypeCounter(Counter):
 class RPDFile:
     """
     Base class for photo or video file, with metadata
+
+    An instance is kept for every file found when scanning, and instances
+    are frequently pickled and sent to and from worker processes. To keep
+    them compact, instance attributes are stored in slots rather than a
+    per-instance dict, and are pickled by position, not by name. Attributes
+    that most files never use are stored only once they are assigned.
     """
 
     title = ''
     title_capitalized = ''
 
+    # Default values of attributes that for most files keep their default
+    # value for a long time, or forever. Each is a property whose value is
+    # kept in a dict that is created only when one of them is assigned.
+    # Only immutable values can be defaults.
+    sparse_defaults = dict(
+        job_code=None,
+        # freedesktop.org cache thumbnails
+        fdo_thumbnail_128_name='',
+        fdo_thumbnail_256_name='',
+        # PNG data > 128x128 <= 256x256
+        fdo_thumbnail_256=None,  # type: Optional[bytes]
+
+        # generated values
+
+        cache_full_file_name='',
+        # temporary file used only for video metadata extraction:
+        temp_sample_full_file_name=None,  # type: Optional[str]
+        # if True, the file is a complete copy of the original
+        temp_sample_is_complete_file=False,
+        temp_full_file_name='',
+        temp_thm_full_name='',
+        temp_audio_full_name='',
+        temp_xmp_full_name='',
+        temp_log_full_name='',
+        temp_cache_full_file_chunk='',
+
+        download_start_time=None,
+
+        # Checksum of the file's contents calculated while it was copied from the device,
+        # and the algorithm used to calculate it
+        checksum=None,  # type: Optional[str]
+        checksum_algorithm=None,  # type: Optional[ChecksumAlgorithm]
+
+        download_folder='',
+        download_subfolder='',
+        download_path='',  # os.path.join(download_folder, download_subfolder)
+        download_name='',
+        download_full_file_name='',  # filename with path
+        download_full_base_name='',  # filename with path but no extension
+        download_thm_full_name='',  # name of THM (thumbnail) file with path
+        download_xmp_full_name='',  # name of XMP sidecar with path
+        download_log_full_name='',  # name of LOG associate file with path
+        download_audio_full_name='',  # name of the WAV or MP3 audio file with path
+
+        thm_extension='',
+        audio_extension='',
+        xmp_extension='',
+        log_extension='',
+
+        metadata=None,  # type: Optional[Union[metadataphoto.MetaData, metadatavideo.MetaData, metadataexiftool.MetadataExiftool]]
+        metadata_failure=False,  # type: bool
+
+        # User preference value used for name generation
+        generate_extension_case='',  # type: str
+
+        modified_via_daemon_process=False,
+
+        # If true, there was a name generation problem
+        name_generation_problem=False,
+
+        # Assigned after the file is scanned
+        generate_thumbnail=False,
+        strip_characters=False,
+        sequences=None,
+    )
+
+    # Attributes whose values are the same for many files, e.g. all the files
+    # in a folder or on a device. Identical values are shared when the
+    # instance is unpickled.
+    shared_values = (
+        'path', 'device_display_name', 'device_uri', 'extension', 'mime_type', 'camera_model',
+        'camera_display_name'
+    )
+
+    __slots__ = (
+        'from_camera', 'camera_details', 'device_display_name', 'device_uri', 'camera_model',
+        'camera_port', 'camera_display_name', 'is_mtp_device', 'camera_storage_descriptions',
+        'path', 'name', 'prev_full_name', 'prev_datetime', 'previously_downloaded',
+        'full_file_name', 'raw_exif_bytes', 'exif_source', 'file_type', 'extension',
+        'extension_type', 'mime_type', 'size', '_datetime', '_no_datetime_metadata',
+        'never_read_mdatatime', 'device_timestamp_type', 'mdatatime_caused_ctime_change',
+        '_mtime', '_raw_mtime', '_mdatatime', 'ctime', 'camera_memory_card_identifiers',
+        'thm_full_name', 'audio_file_full_name', 'xmp_file_full_name', 'log_file_full_name',
+        'status', 'problem', 'scan_id', 'uid', 'thumbnail_status', 'thumbnail_cache_status',
+        'subfolder_pref_list', 'name_pref_list', '_sparse'
+    )
+
     def __init__(self, name: str,
                  path: str,
                  size: int,
@@ -503,63 +598,34 @@ class RPDFile:
         self.scan_id = int(scan_id)
         self.uid = uuid.uuid4().bytes
 
-        self.job_code = None
-
         # freedesktop.org cache thumbnails
         # http://specifications.freedesktop.org/thumbnail-spec/thumbnail-spec-latest.html
         self.thumbnail_status = ThumbnailCacheStatus.not_ready  # type: ThumbnailCacheStatus
-        self.fdo_thumbnail_128_name = ''
-        self.fdo_thumbnail_256_name = ''
-        # PNG data > 128x128 <= 256x256
-        self.fdo_thumbnail_256 = None  # type: Optional[bytes]
 
         # Thee status of the file in the Rapid Photo Downloader thumbnail cache
         self.thumbnail_cache_status = thumbnail_cache_status
 
-        # generated values
-
-        self.cache_full_file_name = ''
-        # temporary file used only for video metadata extraction:
-        self.temp_sample_full_file_name = None  # type: Optional[str]
-        # if True, the file is a complete copy of the original
-        self.temp_sample_is_complete_file = False
-        self.temp_full_file_name = ''
-        self.temp_thm_full_name = ''
-        self.temp_audio_full_name = ''
-        self.temp_xmp_full_name = ''
-        self.temp_log_full_name = ''
-        self.temp_cache_full_file_chunk = ''
-
-        self.download_start_time = None
-
-        self.download_folder = ''
-        self.download_subfolder = ''
-        self.download_path = ''  # os.path.join(download_folder, download_subfolder)
-        self.download_name = ''
-        self.download_full_file_name = ''  # filename with path
-        self.download_full_base_name = ''  # filename with path but no extension
-        self.download_thm_full_name = ''  # name of THM (thumbnail) file with path
-        self.download_xmp_full_name = ''  # name of XMP sidecar with path
-        self.download_log_full_name = ''  # name of LOG associate file with path
-        self.download_audio_full_name = ''  # name of the WAV or MP3 audio file with path
-
-        self.thm_extension = ''
-        self.audio_extension = ''
-        self.xmp_extension = ''
-        self.log_extension = ''
-
-        self.metadata = None  # type: Optional[Union[metadataphoto.MetaData, metadatavideo.MetaData, metadataexiftool.MetadataExiftool]]
-        self.metadata_failure = False  # type: bool
-
         # User preference values used for name generation
         self.subfolder_pref_list = []  # type: List[str]
         self.name_pref_list = []  # type: List[str]
-        self.generate_extension_case = ''  # type: str
 
-        self.modified_via_daemon_process = False
+        # Values of attributes in sparse_defaults that have been assigned
+        self._sparse = None  # type: Optional[Dict[str, Any]]
 
-        # If true, there was a name generation problem
-        self.name_generation_problem = False
+    def __getstate__(self) -> Tuple:
+        """
+        :return: values of the attributes in __slots__, in order
+        """
+
+        return _get_rpdfile_state(self)
+
+    def __setstate__(self, state: Tuple) -> None:
+        for member, value in zip(_rpdfile_slot_members, state):
+            member.__set__(self, value)
+        for member in _rpdfile_shared_members:
+            value = member.__get__(self)
+            if type(value) is str:
+                member.__set__(self, sys.intern(value))
 
     def should_write_fdo(self) -> bool:
         """
@@ -814,7 +880,34 @@ class RPDFile:
         )
 
 
+def _sparse_property(name: str, default: Any) -> property:
+    def getter(self: RPDFile) -> Any:
+        sparse = self._sparse
+        if sparse is None:
+            return default
+        return sparse.get(name, default)
+
+    def setter(self: RPDFile, value: Any) -> None:
+        if self._sparse is None:
+            self._sparse = {name: value}
+        else:
+            self._sparse[name] = value
+
+    return property(getter, setter)
+
+
+for _name, _default in RPDFile.sparse_defaults.items():
+    setattr(RPDFile, _name, _sparse_property(_name, _default))
+
+_get_rpdfile_state = operator.attrgetter(*RPDFile.__slots__)
+# Descriptors with which the values of an RPDFile's slots are assigned
+_rpdfile_slot_members = tuple(RPDFile.__dict__[name] for name in RPDFile.__slots__)
+_rpdfile_shared_members = tuple(RPDFile.__dict__[name] for name in RPDFile.shared_values)
+
+
 class Photo(RPDFile):
+    __slots__ = ()
+
     title = _("photo")
     title_capitalized = _("Photo")
 
@@ -867,6 +960,8 @@ class Photo(RPDFile):
 
 
 class Video(RPDFile):
+    __slots__ = ()
+
     title = _("video")
     title_capitalized = _("Video")
 
@@ -895,6 +990,8 @@ class Video(RPDFile):
 
 
 class SamplePhoto(Photo):
+    __slots__ = ()
+
     def __init__(self, sample_name='IMG_1234.CR2', sequences=None):
         mtime = time.time()
         super().__init__(
@@ -923,6 +1020,8 @@ class SamplePhoto(Photo):
 
 
 class SampleVideo(Video):
+    __slots__ = ()
+
     def __init__(self, sample_name='MVI_1234.MOV', sequences=None):
         mtime = time.time()
         super().__init__(
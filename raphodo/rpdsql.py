@@ -24,8 +24,10 @@ __copyright__ = "Copyright 2015-2019, Damon Lynch"
 import sqlite3
 import os
 import datetime
+import time
+import pickle
 from collections import namedtuple
-from typing import Optional, List, Tuple, Any, Sequence
+from typing import Optional, List, Tuple, Any, Sequence, Dict
 import logging
 
 from PyQt5.QtCore import Qt
@@ -35,11 +37,26 @@ from raphodo.storage import get_program_data_directory, get_program_cache_direct
 from raphodo.utilities import divide_list_on_length
 from raphodo.photoattributes import PhotoAttributes
 from raphodo.constants import FileType, Sort, Show
-from raphodo.utilities import runs
+from raphodo.utilities import runs, BloomFilter
 
 FileDownloaded = namedtuple('FileDownloaded', 'download_name, download_datetime')
 
-InCache = namedtuple('InCache', 'md5_name, mdatatime, orientation_unknown, failure')
+# segment, offset and length are None unless the thumbnail is in a packed segment file
+InCache = namedtuple(
+    'InCache', 'md5_name, mdatatime, orientation_unknown, failure, segment, offset, length'
+)
+
+PackedThumbnail = namedtuple('PackedThumbnail', 'md5_name, offset, length')
+
+CachedThumbnail = namedtuple('CachedThumbnail', 'uri, size, mtime, md5_name, segment, length')
+
+# Contents of a directory when it was last scanned: its modification time,
+# names of its subdirectories, names of all other entries in it, and a dict
+# of file name: FileStat for the photos and videos in it
+DirectoryManifest = namedtuple('DirectoryManifest', 'mtime, sub_dirs, names, files')
+
+# The parts of a file's stat result that are used when scanning
+FileStat = namedtuple('FileStat', 'st_mode, st_uid, st_gid, st_size, st_mtime')
 
 ThumbnailRow = namedtuple(
     'ThumbnailRow',
@@ -644,6 +661,10 @@ class ThumbnailRowsSQL:
         self.conn.commit()
 
 
+# Key identifying a file in the database of downloaded files: name, size, modification time
+DownloadedKey = Tuple[str, int, float]
+
+
 class DownloadedSQL:
     """
     Previous file download detection.
@@ -652,20 +673,62 @@ class DownloadedSQL:
     same if the file name (excluding path), size and modification time
     are the same. For performance reasons, Exif information is never
     checked.
+
+    Queries use a connection that stays open for the life of the
+    instance. For scans of many files, query files in batches using
+    files_downloaded(), and optionally load a prefilter first, so files
+    that were never downloaded need not be looked up in the database.
+
+    Writes can be buffered, so that many downloaded files are added to
+    the database in one transaction. Buffered files are written only when
+    another is added, so call flush() when a download completes or the
+    process exits, and when flush_timeout() expires while waiting for
+    the next file.
     """
 
-    def __init__(self, data_dir: str = None) -> None:
+    # Maximum number of files to look up in one query. Each file uses
+    # three of the 999 host parameters SQLite allows by default.
+    batch_query_size = 300
+
+    def __init__(self, data_dir: str = None, buffer_size: int = 1,
+                 buffer_time: int = 0) -> None:
         """
         :param data_dir: where the database is saved. If None, use
          default
+        :param buffer_size: maximum number of downloaded files to hold
+         in memory before writing them to the database. The default of 1
+         writes each file immediately.
+        :param buffer_time: maximum time in milliseconds to hold
+         downloaded files in memory before writing them to the database
         """
         if data_dir is None:
             data_dir = get_program_data_directory(create_if_not_exist=True)
 
         self.db = os.path.join(data_dir, 'downloaded_files.sqlite')
         self.table_name = 'downloaded'
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        # (file name, size) of every downloaded file
+        self.prefilter = None  # type: Optional[BloomFilter]
+        self.buffer_size = buffer_size
+        self.buffer_time = buffer_time
+        # Downloaded files not yet written to the database
+        self.pending = []  # type: List[Tuple[str, int, float, str, datetime.datetime]]
+        self.pending_since = 0.0
         self.update_table()
 
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self.db, detect_types=sqlite3.PARSE_DECLTYPES, timeout=sqlite3_timeout
+            )
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
 
     def update_table(self, reset: bool = False) -> None:
         """
@@ -676,6 +739,10 @@ class DownloadedSQL:
 
         conn = sqlite3.connect(self.db, detect_types=sqlite3.PARSE_DECLTYPES)
 
+        # Write ahead logging allows reading while another process is writing.
+        # The setting persists in the database file.
+        conn.execute("PRAGMA journal_mode=WAL")
+
         if reset:
             conn.execute(r"""DROP TABLE IF EXISTS {tn}""".format(
                 tn=self.table_name)
@@ -704,11 +771,14 @@ class DownloadedSQL:
         conn.commit()
         conn.close()
 
-    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
     def add_downloaded_file(self, name: str, size: int,
                             modification_time: float, download_full_file_name: str) -> None:
         """
-        Add file to database of downloaded files
+        Add file to database of downloaded files.
+
+        If writes are buffered, the file is written to the database only
+        when the buffer is flushed.
+
         :param name: original filename of photo / video, without path
         :param size: file size
         :param modification_time: file modification time
@@ -716,27 +786,120 @@ class DownloadedSQL:
          or the character . that the user manually marked the file
          as previously downloaded
         """
-        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
 
         logging.debug('Adding %s to downloaded files', name)
 
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append(
+            (name, size, modification_time, download_full_file_name, datetime.datetime.now())
+        )
+
+        if len(self.pending) >= self.buffer_size or \
+                (time.monotonic() - self.pending_since) * 1000 >= self.buffer_time:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write any buffered downloaded files to the database in a single
+        transaction.
+        """
+
+        if not self.pending:
+            return
+
+        # Should writing fail, wait for the buffer time before timing out again
+        self.pending_since = time.monotonic()
+        self._write_pending()
+        if self.prefilter is not None:
+            for row in self.pending:
+                self.prefilter.add((row[0], row[1]))
+        self.pending = []
+
+    def flush_timeout(self) -> Optional[int]:
+        """
+        :return: time in milliseconds until buffered downloaded files
+         should be written to the database, or None if no files are
+         buffered
+        """
+
+        if not self.pending:
+            return None
+        elapsed = (time.monotonic() - self.pending_since) * 1000
+        return max(int(self.buffer_time - elapsed), 0)
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def _write_pending(self) -> None:
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+
         try:
-            conn.execute(
-                r"""INSERT OR REPLACE INTO {tn} (file_name, size, mtime,
-                download_name, download_datetime) VALUES (?,?,?,?,?)""".format(tn=self.table_name),
-                (name, size, modification_time, download_full_file_name, datetime.datetime.now())
-            )
+            with conn:
+                conn.executemany(
+                    r"""INSERT OR REPLACE INTO {tn} (file_name, size, mtime,
+                    download_name, download_datetime) VALUES (?,?,?,?,?)""".format(
+                        tn=self.table_name
+                    ),
+                    self.pending
+                )
         except sqlite3.OperationalError as e:
             logging.warning(
-                "Database error adding download file %s: %s. May retry.",
-                download_full_file_name, e
+                "Database error adding %s downloaded files: %s. May retry.", len(self.pending), e
             )
-            conn.close()
             raise sqlite3.OperationalError from e
-        else:
-            conn.commit()
+        finally:
             conn.close()
 
+    def load_prefilter(self) -> None:
+        """
+        Load the names and sizes of all downloaded files into an in memory
+        Bloom filter. Thereafter files that definitely have not been downloaded
+        are not looked up in the database.
+        """
+
+        c = self.conn.cursor()
+        count = c.execute("SELECT COUNT(*) FROM {tn}".format(tn=self.table_name)).fetchone()[0]
+        # Allow for files added while the filter is in use
+        self.prefilter = BloomFilter(capacity=count + 10000)
+        for row in c.execute("SELECT file_name, size FROM {tn}".format(tn=self.table_name)):
+            self.prefilter.add(row)
+        logging.debug("Loaded %s downloaded files into prefilter", count)
+
+    def files_downloaded(self,
+                         files: Sequence[DownloadedKey]) -> Dict[DownloadedKey, FileDownloaded]:
+        """
+        Batch version of file_downloaded()
+
+        :param files: name (not including path), size and modification time
+         of each file to check
+        :return: download name and when it was downloaded, for those files that
+         have previously been downloaded, indexed by file name, size and
+         modification time
+        """
+
+        if self.prefilter is not None:
+            files = [file for file in files if (file[0], file[1]) in self.prefilter]
+
+        downloaded = {}  # type: Dict[DownloadedKey, FileDownloaded]
+        if not files:
+            return downloaded
+
+        c = self.conn.cursor()
+        for batch in divide_list_on_length(files, self.batch_query_size):
+            where = ' OR '.join(['(file_name=? AND size=? AND mtime=?)'] * len(batch))
+            values = [value for file in batch for value in file]
+            c.execute(
+                """SELECT file_name, size, mtime, download_name,
+                download_datetime as [timestamp] FROM {tn} WHERE {where}""".format(
+                    tn=self.table_name, where=where
+                ),
+                values
+            )
+            for name, size, mtime, download_name, download_datetime in c.fetchall():
+                downloaded[(name, size, mtime)] = FileDownloaded(
+                    download_name=download_name, download_datetime=download_datetime
+                )
+        return downloaded
+
     def file_downloaded(self, name: str,
                         size: int, modification_time: float) -> Optional[FileDownloaded]:
         """
@@ -748,8 +911,10 @@ class DownloadedSQL:
         :return: download name (including path) and when it was
          downloaded, else None if never downloaded
         """
-        conn = sqlite3.connect(self.db, detect_types=sqlite3.PARSE_DECLTYPES)
-        c = conn.cursor()
+        if self.prefilter is not None and (name, size) not in self.prefilter:
+            return None
+
+        c = self.conn.cursor()
         c.execute(
             """SELECT download_name, download_datetime as [timestamp] FROM {tn} WHERE
             file_name=? AND size=? AND mtime=?""".format(tn=self.table_name),
@@ -773,6 +938,7 @@ class CacheSQL:
             location = get_program_cache_directory(create_if_not_exist=True)
         self.db = os.path.join(location, self.db_fs_name())
         self.table_name = 'cache'
+        self.statistics_table_name = 'statistics'
         if create_table_if_not_exists:
             self.update_table()
 
@@ -811,12 +977,42 @@ class CacheSQL:
             md5_name TEXT NOT NULL,
             orientation_unknown BOOLEAN NOT NULL,
             failure BOOLEAN NOT NULL,
+            segment INTEGER,
+            offset INTEGER,
+            length INTEGER,
+            last_access REAL,
             PRIMARY KEY (uri, mtime, size)
             )""".format(tn=self.table_name)
         )
 
+        # Tables created before thumbnails could be packed into segment files lack
+        # the columns locating a thumbnail in a segment, and when it was last used
+        columns = {
+            row[1] for row in conn.execute("PRAGMA table_info({tn})".format(tn=self.table_name))
+        }
+        for column, column_type in (
+                ('segment', 'INTEGER'), ('offset', 'INTEGER'), ('length', 'INTEGER'),
+                ('last_access', 'REAL')):
+            if column not in columns:
+                conn.execute(
+                    "ALTER TABLE {tn} ADD COLUMN {column} {column_type}".format(
+                        tn=self.table_name, column=column, column_type=column_type
+                    )
+                )
+
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS {tn} (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+            )""".format(tn=self.statistics_table_name)
+        )
+
         conn.execute("""CREATE INDEX IF NOT EXISTS md5_name_idx ON
         {tn} (md5_name)""".format(tn=self.table_name))
+        conn.execute("""CREATE INDEX IF NOT EXISTS segment_idx ON
+        {tn} (segment)""".format(tn=self.table_name))
+        conn.execute("""CREATE INDEX IF NOT EXISTS last_access_idx ON
+        {tn} (last_access)""".format(tn=self.table_name))
 
         conn.commit()
         conn.close()
@@ -828,7 +1024,10 @@ class CacheSQL:
                       mdatatime: float,
                       md5_name: str,
                       orientation_unknown: bool,
-                      failure: bool) -> None:
+                      failure: bool,
+                      segment: Optional[int]=None,
+                      offset: Optional[int]=None,
+                      length: Optional[int]=None) -> None:
         """
         Add file to database of downloaded files
         :param uri: original filename of photo / video with path
@@ -840,6 +1039,10 @@ class CacheSQL:
          file could not be determined, else False
         :param failure: if True, indicates the thumbnail could not be
          generated, otherwise False
+        :param segment: if the thumbnail is in a packed segment file,
+         the segment's number
+        :param offset: position of the thumbnail in the segment file
+        :param length: length of the thumbnail in bytes
         """
 
         conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
@@ -847,9 +1050,13 @@ class CacheSQL:
         try:
             conn.execute(
                 r"""INSERT OR REPLACE INTO {tn} (uri, size, mtime, mdatatime,
-                md5_name, orientation_unknown, failure) VALUES (?,?,?,?,?,?,?)""".format(
+                md5_name, orientation_unknown, failure, segment, offset, length, last_access)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?)""".format(
                     tn=self.table_name
-                ), (uri, size, mtime, mdatatime, md5_name, orientation_unknown, failure)
+                ), (
+                    uri, size, mtime, mdatatime, md5_name, orientation_unknown, failure,
+                    segment, offset, length, time.time()
+                )
             )
         except sqlite3.OperationalError as e:
             logging.warning("Database error adding thumbnail for %s: %s. May retry.", uri, e)
@@ -877,8 +1084,10 @@ class CacheSQL:
         try:
             c = conn.cursor()
             c.execute(
-                """SELECT md5_name, mdatatime, orientation_unknown, failure FROM {tn} WHERE
-                uri=? AND size=? AND mtime=?""".format(tn=self.table_name), (uri, size, mtime)
+                """SELECT md5_name, mdatatime, orientation_unknown, failure, segment, offset,
+                length FROM {tn} WHERE uri=? AND size=? AND mtime=?""".format(
+                    tn=self.table_name
+                ), (uri, size, mtime)
             )
             row = c.fetchone()
         except sqlite3.OperationalError as e:
@@ -936,15 +1145,379 @@ class CacheSQL:
     def md5_names(self) -> List[Tuple[str]]:
         conn = sqlite3.connect(self.db)
         c = conn.cursor()
-        c.execute('SELECT md5_name FROM {tn}'.format(tn=self.table_name))
+        c.execute('SELECT md5_name FROM {tn} WHERE segment IS NULL'.format(tn=self.table_name))
         rows = c.fetchall()
         return rows
 
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def record_access(self, accessed: Sequence[Tuple[float, str, int, float]],
+                      statistics: Dict[str, int]) -> None:
+        """
+        Record when thumbnails were last used, and add to the cache
+        statistics, in one transaction
+
+        :param accessed: for each thumbnail used, the time it was used
+         followed by its uri, size and modification time
+        :param statistics: amounts to add to each statistic, indexed by
+         statistic name
+        """
+
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                conn.executemany(
+                    """UPDATE {tn} SET last_access=? WHERE uri=? AND size=? AND
+                    mtime=?""".format(tn=self.table_name), accessed
+                )
+                for name, value in statistics.items():
+                    conn.execute(
+                        """INSERT OR IGNORE INTO {tn} (name, value) VALUES (?, 0)""".format(
+                            tn=self.statistics_table_name
+                        ), (name, )
+                    )
+                    conn.execute(
+                        """UPDATE {tn} SET value=value+? WHERE name=?""".format(
+                            tn=self.statistics_table_name
+                        ), (value, name)
+                    )
+        except sqlite3.OperationalError as e:
+            logging.warning(
+                "Database error recording thumbnail cache access: %s. May retry.", e
+            )
+            raise sqlite3.OperationalError from e
+        finally:
+            conn.close()
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        :return: value of each cache statistic, indexed by statistic name
+        """
+
+        conn = sqlite3.connect(self.db)
+        try:
+            rows = conn.execute(
+                "SELECT name, value FROM {tn}".format(tn=self.statistics_table_name)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        conn.close()
+        return dict(rows)
+
+    def least_recently_used(self, limit: int) -> List[CachedThumbnail]:
+        """
+        :param limit: maximum number of thumbnails to return
+        :return: the thumbnails that have been used least recently, in
+         order of last use. Thumbnails not used since their last use was
+         first recorded come first.
+        """
+
+        conn = sqlite3.connect(self.db)
+        rows = conn.execute(
+            """SELECT uri, size, mtime, md5_name, segment, length FROM {tn}
+            WHERE failure=0 ORDER BY last_access LIMIT ?""".format(tn=self.table_name),
+            (limit, )
+        ).fetchall()
+        conn.close()
+        return [CachedThumbnail._make(row) for row in rows]
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def delete_cached_thumbnails(self, thumbnails: Sequence[CachedThumbnail]) -> None:
+        """
+        Delete thumbnails from the database
+
+        :param thumbnails: the thumbnails to delete
+        """
+
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                conn.executemany(
+                    "DELETE FROM {tn} WHERE uri=? AND size=? AND mtime=?".format(
+                        tn=self.table_name
+                    ), ((t.uri, t.size, t.mtime) for t in thumbnails)
+                )
+        finally:
+            conn.close()
+
+    def segment_usage(self) -> Dict[int, int]:
+        """
+        :return: bytes used by thumbnails in each packed segment file,
+         indexed by segment number
+        """
+
+        conn = sqlite3.connect(self.db)
+        rows = conn.execute(
+            """SELECT segment, SUM(length) FROM {tn} WHERE segment IS NOT NULL
+            GROUP BY segment""".format(tn=self.table_name)
+        ).fetchall()
+        conn.close()
+        return dict(rows)
+
+    def packed_thumbnails(self, segment: int) -> List[PackedThumbnail]:
+        """
+        :param segment: segment number
+        :return: the thumbnails in the packed segment file, in the order
+         they are in the file
+        """
+
+        conn = sqlite3.connect(self.db)
+        rows = conn.execute(
+            """SELECT md5_name, offset, length FROM {tn} WHERE segment=?
+            ORDER BY offset""".format(tn=self.table_name), (segment, )
+        ).fetchall()
+        conn.close()
+        return [PackedThumbnail._make(row) for row in rows]
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def move_packed_thumbnails(self, segment: int,
+                               moved: Sequence[Tuple[int, int, int, int]]) -> None:
+        """
+        Record the new locations of thumbnails copied out of a segment file
+
+        :param segment: the segment the thumbnails were copied from
+        :param moved: for each thumbnail, the new segment and offset, followed
+         by the old offset and length
+        """
+
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                conn.executemany(
+                    """UPDATE {tn} SET segment=?, offset=? WHERE segment={segment} AND
+                    offset=? AND length=?""".format(tn=self.table_name, segment=int(segment)),
+                    moved
+                )
+        finally:
+            conn.close()
+
+    def delete_segments(self, segments: Sequence[int]) -> int:
+        """
+        Remove thumbnails in packed segment files from the database
+
+        :param segments: the segment numbers
+        :return: number of thumbnails removed
+        """
+
+        conn = sqlite3.connect(self.db)
+        count = 0
+        for segment in segments:
+            count += conn.execute(
+                "DELETE FROM {tn} WHERE segment=?".format(tn=self.table_name), (segment, )
+            ).rowcount
+        conn.commit()
+        conn.close()
+        return count
+
     def vacuum(self) -> None:
         conn = sqlite3.connect(self.db)
         conn.execute("VACUUM")
         conn.close()
 
+
+class MetadataCacheSQL:
+    """
+    Metadata values previously read from photos and videos.
+
+    A file is the same if its uri, size and modification time are the
+    same. Values are also indexed by the kind of metadata reader used to
+    read them, because readers can format the same value differently.
+    """
+
+    def __init__(self, location: str=None) -> None:
+        """
+        :param location: path on the file system where the database is
+         saved. If None, use default
+        """
+        if location is None:
+            location = get_program_cache_directory(create_if_not_exist=True)
+
+        self.db = os.path.join(location, 'metadata_cache.sqlite')
+        self.table_name = 'metadata'
+        self.statistics_table_name = 'statistics'
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        self.update_table()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def update_table(self, reset: bool=False) -> None:
+        """
+        Create or update the database table
+        :param reset: if True, delete the contents of the table and
+         build it
+        """
+
+        conn = sqlite3.connect(self.db)
+
+        # Several worker processes read and write the cache at the same time
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        if reset:
+            conn.execute(r"""DROP TABLE IF EXISTS {tn}""".format(tn=self.table_name))
+            conn.execute("VACUUM")
+
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS {tn} (
+            uri TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            reader TEXT NOT NULL,
+            metadata_values BLOB NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (uri, size, mtime, reader)
+            )""".format(tn=self.table_name)
+        )
+
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS {tn} (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+            )""".format(tn=self.statistics_table_name)
+        )
+
+        conn.execute("""CREATE INDEX IF NOT EXISTS last_access_idx ON
+        {tn} (last_access)""".format(tn=self.table_name))
+
+        conn.commit()
+        conn.close()
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def get_values(self, uri: str, size: int, mtime: float,
+                   reader: str) -> Optional[Dict[Tuple, Any]]:
+        """
+        :param uri: file name, including path
+        :param size: file size in bytes
+        :param mtime: file modification time
+        :param reader: the kind of metadata reader the values were read
+         with
+        :return: the metadata values, indexed by metadata function name
+         and arguments, or None if there are none for the file
+        """
+
+        try:
+            row = self.conn.execute(
+                """SELECT metadata_values FROM {tn} WHERE uri=? AND size=? AND mtime=? AND
+                reader=?""".format(tn=self.table_name), (uri, size, mtime, reader)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            logging.warning("Database error reading metadata for %s: %s. May retry.", uri, e)
+            self.close()
+            raise sqlite3.OperationalError from e
+
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def record(self, values: Sequence[Tuple[str, int, float, str, Dict[Tuple, Any]]],
+               accessed: Sequence[Tuple[float, str, int, float, str]],
+               statistics: Dict[str, int]) -> None:
+        """
+        Add or replace metadata values, record when values were last
+        used, and add to the cache statistics, in one transaction
+
+        :param values: for each file, its uri, size, modification time,
+         metadata reader and metadata values
+        :param accessed: for each file whose values were used, the time
+         they were used followed by its uri, size, modification time and
+         metadata reader
+        :param statistics: amounts to add to each statistic, indexed by
+         statistic name
+        """
+
+        now = time.time()
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                conn.executemany(
+                    """INSERT OR REPLACE INTO {tn} (uri, size, mtime, reader, metadata_values,
+                    last_access) VALUES (?,?,?,?,?,?)""".format(tn=self.table_name),
+                    (
+                        (
+                            uri, size, mtime, reader,
+                            pickle.dumps(file_values, pickle.HIGHEST_PROTOCOL), now
+                        ) for uri, size, mtime, reader, file_values in values
+                    )
+                )
+                conn.executemany(
+                    """UPDATE {tn} SET last_access=? WHERE uri=? AND size=? AND mtime=? AND
+                    reader=?""".format(tn=self.table_name), accessed
+                )
+                for name, value in statistics.items():
+                    conn.execute(
+                        """INSERT OR IGNORE INTO {tn} (name, value) VALUES (?, 0)""".format(
+                            tn=self.statistics_table_name
+                        ), (name, )
+                    )
+                    conn.execute(
+                        """UPDATE {tn} SET value=value+? WHERE name=?""".format(
+                            tn=self.statistics_table_name
+                        ), (value, name)
+                    )
+        except sqlite3.OperationalError as e:
+            logging.warning(
+                "Database error recording %s files in metadata cache: %s. May retry.",
+                len(values), e
+            )
+            raise sqlite3.OperationalError from e
+        finally:
+            conn.close()
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        :return: value of each cache statistic, indexed by statistic name
+        """
+
+        try:
+            rows = self.conn.execute(
+                "SELECT name, value FROM {tn}".format(tn=self.statistics_table_name)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        return dict(rows)
+
+    def delete_not_accessed_since(self, timestamp: float) -> int:
+        """
+        Remove the values of files whose values have not been used
+        since the time
+
+        :param timestamp: time since the epoch
+        :return: number of files removed
+        """
+
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                count = conn.execute(
+                    "DELETE FROM {tn} WHERE last_access<?".format(tn=self.table_name),
+                    (timestamp, )
+                ).rowcount
+        except sqlite3.OperationalError as e:
+            logging.error("Database error while cleaning up the metadata cache: %s", e)
+            count = 0
+        finally:
+            conn.close()
+        return count
+
+    def no_files(self) -> int:
+        """
+        :return: how many files have values in the db
+        """
+
+        row = self.conn.execute(
+            'SELECT COUNT(*) FROM {tn}'.format(tn=self.table_name)
+        ).fetchone()
+        return row[0]
+
+
 class FileFormatSQL:
     def __init__(self, data_dir: str=None) -> None:
         """
@@ -1052,6 +1625,116 @@ class FileFormatSQL:
         return None
 
 
+class ScanManifestSQL:
+    """
+    Contents of directories on each device as they were when the device
+    was last scanned.
+
+    A directory whose modification time is unchanged since it was last
+    scanned has had no entries added, removed or renamed, meaning it
+    need not be read again.
+    """
+
+    def __init__(self, location: str=None) -> None:
+        """
+        :param location: path on the file system where the database is
+         saved. If None, use default
+        """
+        if location is None:
+            location = get_program_cache_directory(create_if_not_exist=True)
+
+        self.db = os.path.join(location, 'scan_manifest.sqlite')
+        self.table_name = 'directories'
+        self.update_table()
+
+    def update_table(self, reset: bool=False) -> None:
+        """
+        Create or update the database table
+        :param reset: if True, delete the contents of the table and
+         build it
+        """
+
+        conn = sqlite3.connect(self.db)
+
+        if reset:
+            conn.execute(r"""DROP TABLE IF EXISTS {tn}""".format(tn=self.table_name))
+            conn.execute("VACUUM")
+
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS {tn} (
+            device TEXT NOT NULL,
+            path TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            mtime REAL NOT NULL,
+            contents BLOB NOT NULL,
+            PRIMARY KEY (device, path)
+            )""".format(tn=self.table_name)
+        )
+
+        conn.commit()
+        conn.close()
+
+    def get_manifest(self, device: str, signature: str) -> Dict[str, DirectoryManifest]:
+        """
+        :param device: identifies the device, e.g. its file system UUID and path
+        :param signature: identifies what the device was scanned for, e.g.
+         the file extensions scanned. Directories scanned with a different
+         signature are ignored.
+        :return: contents of the directories when the device was last
+         scanned, indexed by path
+        """
+
+        conn = sqlite3.connect(self.db)
+        manifest = {}
+        try:
+            for path, mtime, contents in conn.execute(
+                    """SELECT path, mtime, contents FROM {tn} WHERE device=? AND
+                    signature=?""".format(tn=self.table_name), (device, signature)):
+                manifest[path] = DirectoryManifest(mtime, *pickle.loads(contents))
+        except sqlite3.OperationalError as e:
+            logging.warning("Database error reading scan manifest for %s: %s", device, e)
+            manifest = {}
+        finally:
+            conn.close()
+        return manifest
+
+    @retry(stop=stop_after_attempt(sqlite3_retry_attempts))
+    def save_manifest(self, device: str, signature: str,
+                      manifest: Dict[str, DirectoryManifest]) -> None:
+        """
+        Replace the device's directory contents with those from the most
+        recent scan
+
+        :param device: identifies the device, e.g. its file system UUID and path
+        :param signature: identifies what the device was scanned for
+        :param manifest: contents of the directories, indexed by path
+        """
+
+        conn = sqlite3.connect(self.db, timeout=sqlite3_timeout)
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM {tn} WHERE device=?".format(tn=self.table_name), (device,)
+                )
+                conn.executemany(
+                    """INSERT INTO {tn} (device, path, signature, mtime, contents)
+                    VALUES (?,?,?,?,?)""".format(tn=self.table_name),
+                    (
+                        (
+                            device, path, signature, directory.mtime,
+                            pickle.dumps(directory[1:], pickle.HIGHEST_PROTOCOL)
+                        ) for path, directory in manifest.items()
+                    )
+                )
+        except sqlite3.OperationalError as e:
+            logging.warning(
+                "Database error saving scan manifest for %s: %s. May retry.", device, e
+            )
+            raise sqlite3.OperationalError from e
+        finally:
+            conn.close()
+
+
 if __name__ == '__main__':
     import uuid
     d = ThumbnailRowsSQL()
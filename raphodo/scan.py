@@ -52,6 +52,11 @@ import logging
 from collections import (namedtuple, defaultdict, deque)
 from datetime import datetime
 import tempfile
+import stat
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import operator
 import locale
 try:
@@ -62,10 +67,12 @@ except locale.Error:
 
 if sys.version_info < (3,5):
     import scandir
-    walk = scandir.walk
+    scandir = scandir.scandir
 else:
-    walk = os.walk
-from typing import List, Dict, Union, Optional, Iterator, Tuple, DefaultDict
+    scandir = os.scandir
+from typing import (
+    List, Dict, Union, Optional, Iterator, Tuple, DefaultDict, Sequence
+)
 
 import gphoto2 as gp
 
@@ -76,6 +83,7 @@ from raphodo.preferences import ScanPreferences, Preferences
 from raphodo.interprocess import (
     WorkerInPublishPullPipeline, ScanResults, ScanArguments
 )
+from raphodo.serialization import encode_message
 from raphodo.camera import (
     Camera, CameraError, CameraProblemEx, gphoto2_python_logging, gphoto2_named_error
 )
@@ -84,13 +92,16 @@ from raphodo.constants import (
     DeviceType, FileType, DeviceTimestampTZ, CameraErrorCode, FileExtension,
     ThumbnailCacheDiskStatus, all_tags_offset, ExifSource, all_tags_offset_exiftool
 )
-from raphodo.rpdsql import DownloadedSQL, FileDownloaded
+from raphodo.rpdsql import (
+    DownloadedSQL, FileDownloaded, ScanManifestSQL, DirectoryManifest, FileStat
+)
 from raphodo.cache import ThumbnailCacheSql
 from raphodo.utilities import (
     stdchannel_redirected, datetime_roughly_equal, GenerateRandomFileName, format_size_for_user,
     is_snap
 )
-from raphodo.exiftool import ExifTool
+from raphodo.exiftool import ExifToolBatch
+from raphodo.exiftoolpool import get_exiftool
 import raphodo.metadatavideo as metadatavideo
 import raphodo.metadataphoto as metadataphoto
 import raphodo.metadataexiftool as metadataexiftool
@@ -99,7 +110,7 @@ from raphodo.problemnotification import (
     CameraFileReadProblem, FileMetadataLoadProblem, FileWriteProblem, FsMetadataReadProblem,
     FileZeroLengthProblem
 )
-from raphodo.storage import get_uri, CameraDetails, gvfs_gphoto2_path
+from raphodo.storage import get_uri, CameraDetails, gvfs_gphoto2_path, fs_uuid
 import raphodo.fileformats as fileformats
 
 
@@ -110,6 +121,51 @@ CameraMetadataDetails = namedtuple(
 )
 SampleMetadata = namedtuple('SampleMetadata', 'datetime determined_by')
 
+_euid = os.geteuid()
+_egroups = set(os.getgroups()) | {os.getegid()}
+
+
+def readable(path: str, file_stat: os.stat_result) -> bool:
+    """
+    Determine if this process can read a file.
+
+    If its permission bits allow it to be read, no other system call to the
+    file system is made. Otherwise ask the file system, because an access
+    control list or the file system itself may still allow it to be read.
+
+    :param path: full path of the file
+    :param file_stat: result of stat on the file
+    :return: True if the file is readable
+    """
+
+    if _euid == 0:
+        return True
+    if file_stat.st_uid == _euid:
+        mode_readable = file_stat.st_mode & stat.S_IRUSR
+    elif file_stat.st_gid in _egroups:
+        mode_readable = file_stat.st_mode & stat.S_IRGRP
+    else:
+        mode_readable = file_stat.st_mode & stat.S_IROTH
+    return bool(mode_readable) or os.access(path, os.R_OK)
+
+
+class ManifestDirEntry:
+    """
+    Directory entry for a file in a directory that is unchanged since the
+    device was last scanned, implementing the parts of os.DirEntry that are
+    used when scanning
+    """
+
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, name: str, path: str, file_stat: FileStat) -> None:
+        self.name = name
+        self.path = path
+        self._stat = file_stat
+
+    def stat(self) -> FileStat:
+        return self._stat
+
 
 class ScanWorker(WorkerInPublishPullPipeline):
 
@@ -118,7 +174,18 @@ class ScanWorker(WorkerInPublishPullPipeline):
         self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
         self.no_previously_downloaded = 0
         self.file_batch = []
+        # Files are sent to the main process in batches. The batch size adapts to the
+        # rate at which files are being scanned: fast scans send large batches (fewer,
+        # bigger messages for the GUI to process), slow scans send small batches.
+        # Regardless of the batch size, files on a file system are not held back
+        # much longer than the maximum batch latency, even when walking a directory
+        # stalls. Files on a camera can be held back while the camera is busy.
+        self.min_batch_size = 20
+        self.max_batch_size = 2000
         self.batch_size = 50
+        self.batch_interval = 0.25  # seconds
+        self.max_batch_latency = 0.5  # seconds
+        self.batch_started = 0.0
         self.file_type_counter = rpdfile.FileTypeCounter()
         self.file_size_sum = rpdfile.FileSizeSum()
         self.device_timestamp_type = DeviceTimestampTZ.undetermined
@@ -154,20 +221,31 @@ class ScanWorker(WorkerInPublishPullPipeline):
 
         self._camera_details = None  # type: Optional[CameraDetails]
 
-        self._et_process = None  # type: Optional[ExifTool]
+        self._et_process = None  # type: Optional[ExifToolBatch]
+
+        # Set to stop threads walking the file system concurrently
+        self.stop_walking = threading.Event()
+        # Maximum number of walked files a thread can queue before they are processed
+        self.walk_queue_size = 10000
+
+        # Contents of directories when the device was last scanned, and as
+        # they are now. None if not scanning incrementally.
+        self.manifest = None  # type: Optional[Dict[str, DirectoryManifest]]
+        self.new_manifest = None  # type: Optional[Dict[str, DirectoryManifest]]
 
         super().__init__('Scan')
 
     @property
-    def et_process(self) -> ExifTool:
+    def et_process(self) -> ExifToolBatch:
         """
         Instead of using with statement, which starts a new instance of ExifTool every time,
         start it once for this scan process, if needed
-        :return: ExifTool process
+        :return: ExifTool process, able to read queued files in batches
         """
         if self._et_process is None:
-            self._et_process = ExifTool()
-            self._et_process.start()
+            et_process = get_exiftool()
+            et_process.start()
+            self._et_process = ExifToolBatch(et_process)
         return self._et_process
 
     def exit_exiftool(self):
@@ -187,9 +265,8 @@ class ScanWorker(WorkerInPublishPullPipeline):
                 device = ''
             logging.exception("Unexpected exception while scanning %s", device)
 
-            self.content = pickle.dumps(
-                ScanResults(scan_id=int(self.worker_id), fatal_error=True),
-                pickle.HIGHEST_PROTOCOL
+            self.content = encode_message(
+                ScanResults(scan_id=int(self.worker_id), fatal_error=True)
             )
             self.exit_exiftool()
             self.send_message_to_sink()
@@ -206,6 +283,13 @@ class ScanWorker(WorkerInPublishPullPipeline):
         if scan_arguments.ignore_other_types:
             fileformats.PHOTO_EXTENSIONS_SCAN = fileformats.PHOTO_EXTENSIONS_WITHOUT_OTHER
 
+        # File type of each extension to be scanned, allowing a file to be excluded
+        # from the scan using only its name
+        self.scan_extensions = {ext: FileType.video for ext in fileformats.VIDEO_EXTENSIONS}
+        self.scan_extensions.update(
+            (ext, FileType.photo) for ext in fileformats.PHOTO_EXTENSIONS_SCAN
+        )
+
         self.device = scan_arguments.device
 
         self.download_from_camera = scan_arguments.device.device_type == DeviceType.camera
@@ -227,6 +311,8 @@ class ScanWorker(WorkerInPublishPullPipeline):
         self.camera = None
         terminated = False
 
+        self.downloaded.load_prefilter()
+
         if not self.download_from_camera:
             self.scan_file_system(scan_arguments)
         else:
@@ -254,7 +340,8 @@ class ScanWorker(WorkerInPublishPullPipeline):
         if not terminated:
             if self.file_batch:
                 # Send any remaining files, including the sample photo or video
-                self.content = pickle.dumps(
+                self.assign_previously_downloaded()
+                self.content = encode_message(
                     ScanResults(
                         self.file_batch,
                         self.file_type_counter,
@@ -263,21 +350,21 @@ class ScanWorker(WorkerInPublishPullPipeline):
                         sample_video=self.sample_video,
                         entire_video_required=self.entire_video_required,
                         entire_photo_required=self.entire_photo_required,
-                    ),
-                    pickle.HIGHEST_PROTOCOL
+                    )
                 )
                 self.send_message_to_sink()
         elif self.download_from_camera:
-            self.content = pickle.dumps(
+            self.content = encode_message(
                 ScanResults(
                     scan_id=int(self.worker_id), camera_removed=True
-                ),
-                pickle.HIGHEST_PROTOCOL
+                )
             )
             self.send_message_to_sink()
 
         self.send_problems()
 
+        self.thumbnail_cache.flush_access_times()
+
         if self.files_scanned > 0 and not (self.files_scanned == 0 and self.download_from_camera):
             logging.info(
                 "{} total files scanned on {}".format(self.files_scanned, self.display_name)
@@ -289,34 +376,260 @@ class ScanWorker(WorkerInPublishPullPipeline):
 
     def send_problems(self) -> None:
         if self.problems:
-            self.content = pickle.dumps(
+            self.content = encode_message(
                 ScanResults(
                     scan_id=int(self.worker_id), problems=self.problems
-                ),
-                pickle.HIGHEST_PROTOCOL
+                )
             )
             self.send_message_to_sink()
 
-    def walk_file_system(self, path_to_walk: str) -> Iterator[Tuple[str, str]]:
+    def walk_file_system(self, path_to_walk: str) -> Iterator[Tuple[str, os.DirEntry]]:
         """
-        Return files on local file system, ignoring those in directories
-        the user doesn't want scanned
+        Return photos and videos on local file system, ignoring those in
+        directories the user doesn't want scanned.
+
+        Files are excluded by their extension before any further system call
+        is made. The directory entries that are returned cache the result of
+        stat, and so should be used in preference to calling stat again.
+
         :param path_to_walk: the path to scan
+        :return: directory and directory entry of each file
+        """
+
+        dirs_to_walk = [path_to_walk]
+        while dirs_to_walk and not self.stop_walking.is_set():
+            dir_name = dirs_to_walk.pop()
+            files, sub_dirs = self.read_directory(dir_name)
+            for entry in files:
+                yield dir_name, entry
+
+            # Walk subdirectories in the same order os.walk would
+            dirs_to_walk.extend(reversed(sub_dirs))
+
+    def read_directory(self, dir_name: str) -> Tuple[List[os.DirEntry], List[str]]:
+        """
+        Read the contents of a single directory
+
+        :param dir_name: the directory to read
+        :return: entries of the photos and videos in the directory, and the
+         subdirectories that should be scanned
+        """
+
+        if self.manifest is not None:
+            return self.read_directory_using_manifest(dir_name)
+
+        try:
+            # Read the entire directory now, so no file descriptor is kept
+            # open while walking its subdirectories
+            entries = list(scandir(dir_name))
+        except OSError as e:
+            logging.warning("Could not read directory %s: %s", dir_name, e)
+            return [], []
+
+        files = []
+        sub_dirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk, do not follow symbolic links to directories.
+                if not entry.is_symlink():
+                    sub_dirs.append(entry.path)
+            elif fileformats.extract_extension(entry.name) in self.scan_extensions:
+                files.append(entry)
+        return files, self.filter_sub_dirs(sub_dirs)
+
+    def filter_sub_dirs(self, sub_dirs: List[str]) -> List[str]:
+        """
+        Do not scan gvfs gphoto2 mount, or paths the user wants ignored.
+        """
+
+        return [
+            path for path in sub_dirs if not gvfs_gphoto2_path(path) and
+            self.scan_preferences.scan_this_path(os.path.basename(path))
+        ]
+
+    def read_directory_using_manifest(self, dir_name: str) -> Tuple[
+            List[Union[os.DirEntry, ManifestDirEntry]], List[str]]:
+        """
+        Read the contents of a single directory from the manifest of the
+        previous scan if the directory is unchanged since then, else from the
+        file system, recording its contents in the new manifest
+
+        :param dir_name: the directory to read
+        :return: entries of the photos and videos in the directory, and the
+         subdirectories that should be scanned
+        """
+
+        try:
+            dir_mtime = os.stat(dir_name).st_mtime
+        except OSError as e:
+            logging.warning("Could not read directory %s: %s", dir_name, e)
+            return [], []
+
+        directory = self.manifest.get(dir_name)
+        if directory is not None and directory.mtime == dir_mtime:
+            files = self.unchanged_files(dir_name, directory)
+            if files is not None:
+                self.new_manifest[dir_name] = directory
+                sub_dirs = [os.path.join(dir_name, name) for name in directory.sub_dirs]
+                return files, self.filter_sub_dirs(sub_dirs)
+
+        try:
+            entries = list(scandir(dir_name))
+        except OSError as e:
+            logging.warning("Could not read directory %s: %s", dir_name, e)
+            return [], []
+
+        files = []
+        sub_dirs = []
+        names = []
+        file_stats = {}  # type: Dict[str, FileStat]
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    sub_dirs.append(entry.name)
+            else:
+                names.append(entry.name)
+                if fileformats.extract_extension(entry.name) in self.scan_extensions:
+                    files.append(entry)
+                    try:
+                        file_stat = entry.stat()
+                    except OSError:
+                        # The error is reported when the file is processed
+                        continue
+                    file_stats[entry.name] = FileStat(
+                        file_stat.st_mode, file_stat.st_uid, file_stat.st_gid,
+                        file_stat.st_size, file_stat.st_mtime
+                    )
+
+        files.sort(key=operator.attrgetter('name'))
+        self.new_manifest[dir_name] = DirectoryManifest(
+            dir_mtime, sub_dirs, frozenset(names), file_stats
+        )
+        sub_dirs = [os.path.join(dir_name, name) for name in sub_dirs]
+        return files, self.filter_sub_dirs(sub_dirs)
+
+    def unchanged_files(self, dir_name: str,
+                        directory: DirectoryManifest) -> Optional[List[ManifestDirEntry]]:
+        """
+        Check the files recorded in the manifest of an unchanged directory
+        are themselves unchanged. Modifying a file's contents does not change
+        the modification time of its directory.
+
+        :param dir_name: the directory
+        :param directory: the directory's contents when it was last scanned
+        :return: entries of the photos and videos in the directory, or None if
+         any has changed since the directory was last scanned
         """
 
-        for dir_name, dir_list, file_list in walk(path_to_walk):
-            if len(dir_list) > 0:
-                # Do not scan gvfs gphoto2 mount
-                dir_list[:] = (d for d in dir_list if not gvfs_gphoto2_path(dir_name + d))
+        files = []
+        for name, file_stat in directory.files.items():
+            full_file_name = os.path.join(dir_name, name)
+            try:
+                current = os.stat(full_file_name)
+            except OSError:
+                return None
+            if current.st_size != file_stat.st_size or current.st_mtime != file_stat.st_mtime:
+                return None
+            files.append(ManifestDirEntry(name, full_file_name, file_stat))
+        files.sort(key=operator.attrgetter('name'))
+        return files
+
+    def walk_file_systems(self, paths: Sequence[str]) -> Iterator[Tuple[str, os.DirEntry]]:
+        """
+        Return photos and videos in each path, walking the paths concurrently
+        if the user has configured more than one scan thread.
 
-                if self.scan_preferences.ignored_paths:
-                    # Don't inspect paths the user wants ignored
-                    # Altering subdirs in place controls the looping
-                    # [:] ensures the list is altered in place
-                    # (mutating slice method)
-                    dir_list[:] = filter(self.scan_preferences.scan_this_path, dir_list)
-            for name in file_list:
-                yield dir_name, name
+        Regardless of how many threads are used, files are returned in the same
+        order as walking each path in turn using walk_file_system().
+
+        The paths are walked in threads even if only one is used, so that while
+        waiting for a slow directory to be read, scanned files can still be sent
+        to the main process.
+
+        :param paths: the paths to scan
+        :return: directory and directory entry of each file
+        """
+
+        max_workers = self.prefs.scan_threads
+
+        if max_workers > 1 and len(paths) == 1:
+            # Walk the subdirectories of the single path concurrently
+            path = paths[0]
+            files, paths = self.read_directory(path)
+            for entry in files:
+                yield path, entry
+
+        if not paths:
+            return
+
+        no_threads = max(min(max_workers, len(paths)), 1)
+        logging.debug(
+            "Walking %s paths on %s using %s threads", len(paths), self.display_name,
+            no_threads
+        )
+
+        # One queue per path, so that files can be returned in the order of the paths
+        queues = [queue.Queue(maxsize=self.walk_queue_size) for path in paths]
+        with ThreadPoolExecutor(max_workers=no_threads) as executor:
+            for path, walk_queue in zip(paths, queues):
+                executor.submit(self.walk_file_system_to_queue, path, walk_queue)
+            finished = False
+            try:
+                for walk_queue in queues:
+                    while True:
+                        try:
+                            item = walk_queue.get(timeout=self.max_batch_latency / 5)
+                        except queue.Empty:
+                            self.send_batch_if_overdue()
+                            continue
+                        if item is None:
+                            break
+                        yield item
+                finished = True
+            finally:
+                if not finished:
+                    # Scanning did not complete, so stop the threads
+                    self.stop_walking.set()
+
+    def walk_file_system_to_queue(self, path_to_walk: str, walk_queue: queue.Queue) -> None:
+        """
+        Walk the path in a thread, placing the files found in the queue.
+        None is placed in the queue when the walk is finished.
+
+        :param path_to_walk: the path to scan
+        :param walk_queue: the queue to place the files in
+        """
+
+        try:
+            for dir_name, entry in self.walk_file_system(path_to_walk):
+                try:
+                    # Cache the result of stat while still in this thread
+                    entry.stat()
+                except OSError:
+                    pass
+                self.put_walked_file(walk_queue, (dir_name, entry))
+        except Exception:
+            logging.exception("Error walking %s", path_to_walk)
+        finally:
+            self.put_walked_file(walk_queue, None)
+
+    def put_walked_file(self, walk_queue: queue.Queue,
+                        item: Optional[Tuple[str, os.DirEntry]]) -> None:
+        # The queue is no longer read once the walk is stopped
+        while not self.stop_walking.is_set():
+            try:
+                walk_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
 
     def scan_file_system(self, scan_arguments: ScanArguments):
         """
@@ -352,6 +665,25 @@ class ScanWorker(WorkerInPublishPullPipeline):
         self.problems.uri = get_uri(path=path)
         self.problems.name = self.display_name
 
+        # Memory cards and camera firmware do not reliably update the modification
+        # time of directories, and FAT file systems record it to only two seconds,
+        # so only directories on This Computer are scanned incrementally
+        if self.prefs.incremental_scan and \
+                scan_arguments.device.device_type == DeviceType.path:
+            # Identify the file system by its UUID, because the same path can
+            # be the mount point of different file systems
+            manifest_device = '{}:{}'.format(fs_uuid(path) or 'unknown', path)
+            # The extensions scanned determine which files are in the manifest
+            manifest_signature = ','.join(sorted(self.scan_extensions))
+            manifest_sql = ScanManifestSQL()
+            self.manifest = manifest_sql.get_manifest(manifest_device, manifest_signature)
+            self.new_manifest = {}
+            scan_start = time.time()
+            logging.debug(
+                "Loaded scan manifest of %s directories for %s", len(self.manifest),
+                self.display_name
+            )
+
         # Before doing anything else, determine time zone approach
         # Need two different walks because first folder of files
         # might be videos, then the 2nd folder photos, etc.
@@ -360,13 +692,33 @@ class ScanWorker(WorkerInPublishPullPipeline):
             if self.device_timestamp_type != DeviceTimestampTZ.undetermined:
                 break
 
-        for path in paths:
-            if scanning_specific_path:
-                logging.info("Scanning {} on {}".format(path, self.display_name))
-            for dir_name, name in self.walk_file_system(path):
-                self.dir_name = dir_name
-                self.file_name = name
-                self.process_file()
+        if scanning_specific_path:
+            logging.info("Scanning {} on {}".format(', '.join(paths), self.display_name))
+        for dir_name, entry in self.walk_file_systems(paths):
+            self.dir_name = dir_name
+            self.file_name = entry.name
+            self.dir_entry = entry
+            self.process_file()
+
+        if self.manifest is not None:
+            unchanged = sum(
+                1 for dir_name, directory in self.new_manifest.items()
+                if self.manifest.get(dir_name) is directory
+            )
+            logging.info(
+                "%s of %s directories on %s were unchanged since the previous scan",
+                unchanged, len(self.new_manifest), self.display_name
+            )
+            # A directory modified within the resolution of file system timestamps
+            # could be modified again without its modification time changing
+            manifest = {
+                dir_name: directory for dir_name, directory in self.new_manifest.items()
+                if directory.mtime < scan_start - 2
+            }
+            try:
+                manifest_sql.save_manifest(manifest_device, manifest_signature, manifest)
+            except Exception as e:
+                logging.error("Could not save scan manifest for %s: %s", self.display_name, e)
 
     def scan_camera(self, scan_arguments: ScanArguments) -> None:
         """
@@ -398,23 +750,21 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     self.display_name = self.camera_display_name
                     storage_space = self.camera.get_storage_media_capacity(refresh=True)
                     storage_descriptions = self.camera.get_storage_descriptions()
-                    self.content = pickle.dumps(
+                    self.content = encode_message(
                         ScanResults(
                             optimal_display_name=self.camera_display_name,
                             storage_space=storage_space,
                             storage_descriptions=storage_descriptions,
                             scan_id=int(self.worker_id),
-                        ),
-                        pickle.HIGHEST_PROTOCOL
+                        )
                     )
                     self.send_message_to_sink()
                 break
             except CameraProblemEx as e:
-                self.content = pickle.dumps(
+                self.content = encode_message(
                     ScanResults(
                         error_code=e.code, scan_id=int(self.worker_id)
-                    ),
-                    pickle.HIGHEST_PROTOCOL
+                    )
                 )
                 self.send_message_to_sink()
                 # Wait for command to resume or halt processing
@@ -744,10 +1094,18 @@ class ScanWorker(WorkerInPublishPullPipeline):
         # pause
         self.check_for_controller_directive()
 
-        file = os.path.join(self.dir_name, self.file_name)
+        if self.download_from_camera:
+            file = os.path.join(self.dir_name, self.file_name)
+        else:
+            file = self.dir_entry.path
+            try:
+                file_stat = self.dir_entry.stat()
+            except OSError as e:
+                logging.warning("Could not read %s: %s", file, e)
+                return
 
         # do we have permission to read the file?
-        if self.download_from_camera or os.access(file, os.R_OK):
+        if self.download_from_camera or readable(file, file_stat):
 
             # count how many files of each type are included
             # i.e. how many photos and videos
@@ -758,7 +1116,7 @@ class ScanWorker(WorkerInPublishPullPipeline):
             if not self.download_from_camera:
                 base_name, ext = os.path.splitext(self.file_name)
                 ext = ext[1:].lower()
-                file_type = fileformats.file_type(ext)
+                file_type = self.scan_extensions[ext]
 
                 # For next code block, see comment in
                 # self.distinguish_non_camera_device_timestamp()
@@ -796,8 +1154,7 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     size = file_info.size
                     camera_file = CameraFile(name=self.file_name, size=size)
                 else:
-                    stat = os.stat(file)
-                    size = stat.st_size
+                    size = file_stat.st_size
                     if size <= 0:
                         logging.error(
                             "Zero length file %s will not be downloaded from %s",
@@ -806,7 +1163,7 @@ class ScanWorker(WorkerInPublishPullPipeline):
                         uri = get_uri(full_file_name=file)
                         self.problems.append(FileZeroLengthProblem(name=self.file_name, uri=uri))
                         return
-                    modification_time = stat.st_mtime
+                    modification_time = file_stat.st_mtime
                     camera_file = None
 
                 self.file_size_sum[file_type] += size
@@ -826,13 +1183,11 @@ class ScanWorker(WorkerInPublishPullPipeline):
                 # check if an audio file is associated with the photo or video
                 audio_file_full_name = self.get_audio_file(base_name, camera_file)
 
-                # has the file been downloaded previously?
                 # note: we should use the adjusted mtime, not the raw one
                 adjusted_mtime = self.adjusted_mtime(modification_time)
 
-                downloaded = self.downloaded.file_downloaded(
-                    name=self.file_name, size=size, modification_time=adjusted_mtime
-                )
+                # Whether the file has been downloaded previously is determined
+                # for the entire batch of files, just before it is sent
 
                 thumbnail_cache_status = ThumbnailCacheDiskStatus.unknown
 
@@ -847,20 +1202,13 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     # If so, get the metadata date time from that
                     get_thumbnail = self.thumbnail_cache.get_thumbnail_path(
                         full_file_name=file, mtime=adjusted_mtime,
-                        size=size, camera_model=self.camera_model
+                        size=size, camera_model=self.camera_model, extract_packed=False
                     )
                     thumbnail_cache_status = get_thumbnail.disk_status
                     if thumbnail_cache_status in (
                             ThumbnailCacheDiskStatus.found, ThumbnailCacheDiskStatus.failure):
                         mdatatime = get_thumbnail.mdatatime
 
-                if downloaded is not None:
-                    self.no_previously_downloaded += 1
-                    prev_full_name = downloaded.download_name
-                    prev_datetime = downloaded.download_datetime
-                else:
-                    prev_full_name = prev_datetime = None
-
                 if self.download_from_camera:
                     camera_memory_card_identifiers = self._folder_identifers_for_file[camera_file]
                     if not camera_memory_card_identifiers:
@@ -874,8 +1222,8 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     name=self.file_name,
                     path=self.dir_name,
                     size=size,
-                    prev_full_name=prev_full_name,
-                    prev_datetime=prev_datetime,
+                    prev_full_name=None,
+                    prev_datetime=None,
                     device_timestamp_type=self.device_timestamp_type,
                     mtime=modification_time,
                     mdatatime=mdatatime,
@@ -897,6 +1245,8 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     problem=problem
                 )
 
+                if not self.file_batch:
+                    self.batch_started = time.time()
                 self.file_batch.append(rpd_file)
 
                 if (not self.prepared_sample_photo and
@@ -934,23 +1284,85 @@ class ScanWorker(WorkerInPublishPullPipeline):
                     self.sample_video_extract_full_file_name = None
                     self.prepared_sample_video = True
 
-                if len(self.file_batch) == self.batch_size:
-                    self.content = pickle.dumps(
-                        ScanResults(
-                            rpd_files=self.file_batch,
-                            file_type_counter=self.file_type_counter,
-                            file_size_sum=self.file_size_sum,
-                            sample_photo=self.sample_photo,
-                            sample_video=self.sample_video,
-                            entire_video_required=self.entire_video_required,
-                            entire_photo_required=self.entire_photo_required,
-                        ),
-                        pickle.HIGHEST_PROTOCOL
-                    )
-                    self.send_message_to_sink()
-                    self.file_batch = []
-                    self.sample_photo = None
-                    self.sample_video = None
+                if self.batch_ready():
+                    self.send_batch()
+
+    def send_batch(self) -> None:
+        """
+        Send the batch of scanned files to the main process
+        """
+
+        self.assign_previously_downloaded()
+        self.content = encode_message(
+            ScanResults(
+                rpd_files=self.file_batch,
+                file_type_counter=self.file_type_counter,
+                file_size_sum=self.file_size_sum,
+                sample_photo=self.sample_photo,
+                sample_video=self.sample_video,
+                entire_video_required=self.entire_video_required,
+                entire_photo_required=self.entire_photo_required,
+            )
+        )
+        self.send_message_to_sink()
+        self.file_batch = []
+        self.sample_photo = None
+        self.sample_video = None
+
+    def send_batch_if_overdue(self) -> None:
+        """
+        Send a partial batch of scanned files that has waited the maximum batch
+        latency, e.g. because the walk is waiting for a slow directory to be read
+        """
+
+        if self.file_batch and self.batch_ready():
+            self.send_batch()
+
+    def batch_ready(self) -> bool:
+        """
+        Determine if the batch of scanned files should be sent to the main process.
+
+        When the batch is ready, adjust the size of the next batch so that, at the
+        current scan rate, a batch will take about batch_interval seconds to fill.
+
+        :return: True if the batch should be sent now, else False
+        """
+
+        elapsed = time.time() - self.batch_started
+        batch_length = len(self.file_batch)
+        if batch_length < self.batch_size and elapsed < self.max_batch_latency:
+            return False
+
+        rate = batch_length / max(elapsed, 0.001)
+        self.batch_size = min(
+            max(int(rate * self.batch_interval), self.min_batch_size),
+            # Grow gradually, so a burst of files does not unduly delay the next batch
+            self.batch_size * 2,
+            self.max_batch_size
+        )
+        return True
+
+    def assign_previously_downloaded(self) -> None:
+        """
+        Determine which files in the batch have been downloaded before, using
+        one database query for the entire batch
+        """
+
+        keys = [
+            (rpd_file.name, rpd_file.size, self.adjusted_mtime(rpd_file.modification_time))
+            for rpd_file in self.file_batch
+        ]
+        downloaded = self.downloaded.files_downloaded(keys)
+        if not downloaded:
+            return
+
+        for rpd_file, key in zip(self.file_batch, keys):
+            file_downloaded = downloaded.get(key)
+            if file_downloaded is not None:
+                self.no_previously_downloaded += 1
+                rpd_file.prev_full_name = file_downloaded.download_name
+                rpd_file.prev_datetime = file_downloaded.download_datetime
+                rpd_file.previously_downloaded = True
 
     def send_message_to_sink(self) -> None:
         try:
@@ -1331,6 +1743,19 @@ class ScanWorker(WorkerInPublishPullPipeline):
                 self.located_sample_video = True
         return SampleMetadata(dt, determined_by)
 
+    def sample_uses_exiftool(self, ext_type: FileExtension, extension: str) -> bool:
+        """
+        :return: True if the sample metadata of a file not on a camera is read
+         using ExifTool
+        """
+
+        return ext_type == FileExtension.video or self.prefs.force_exiftool or \
+            fileformats.use_exiftool_on_photo(extension, preview_extraction_irrelevant=True)
+
+    def clear_queued_exiftool_files(self) -> None:
+        if self._et_process is not None:
+            self._et_process.clear()
+
     def examine_sample_non_camera_file(self, dirname: str,
                                        name: str,
                                        full_file_name: str,
@@ -1393,9 +1818,10 @@ class ScanWorker(WorkerInPublishPullPipeline):
             extensions = (FileExtension.raw, FileExtension.jpeg, FileExtension.video)
         non_raw_extensions = extensions[1:]
 
-        for dir_name, name in self.walk_file_system(path):
-            full_file_name = os.path.join(dir_name, name)
-            extension = fileformats.extract_extension(full_file_name)
+        for dir_name, entry in self.walk_file_system(path):
+            name = entry.name
+            full_file_name = entry.path
+            extension = fileformats.extract_extension(name)
             ext_type = fileformats.extension_type(extension)
             if ext_type in extensions:
                 file_type = fileformats.file_type(extension)
@@ -1417,12 +1843,23 @@ class ScanWorker(WorkerInPublishPullPipeline):
 
         # Couldn't locate sample raw file. Are left with up to max_attempts jpeg and video files
         for ext_type in non_raw_extensions:
-            for dir_name, name, full_file_name, extension in jpegs_heifs_and_videos[ext_type]:
+            candidates = jpegs_heifs_and_videos[ext_type]
+            # Read the metadata of the candidates that need ExifTool using as
+            # few requests as possible
+            exiftool_candidates = [
+                full_file_name for dir_name, name, full_file_name, extension in candidates
+                if self.sample_uses_exiftool(ext_type, extension)
+            ]
+            if len(exiftool_candidates) > 1:
+                self.et_process.queue(exiftool_candidates)
+            for dir_name, name, full_file_name, extension in candidates:
                 file_type = fileformats.file_type(extension)
                 if self.examine_sample_non_camera_file(
                         dirname=dir_name, name=name, full_file_name=full_file_name,
                         ext_type=ext_type, extension=extension, file_type=file_type):
+                    self.clear_queued_exiftool_files()
                     return
+        self.clear_queued_exiftool_files()
 
     def determine_device_timestamp_tz(self, mdatatime: datetime,
                                       modification_time: Union[int, float],
@@ -1560,6 +1997,18 @@ class ScanWorker(WorkerInPublishPullPipeline):
         """
 
         full_file_name_no_ext = os.path.join(self.dir_name, base_name)
+
+        if self.new_manifest is not None and self.dir_name in self.new_manifest:
+            # Use the directory contents already read, rather than checking
+            # the file system
+            names = self.new_manifest[self.dir_name].names
+            for e in extensions_to_check:
+                for possible_name in ('{}.{}'.format(base_name, e),
+                                      '{}.{}'.format(base_name, e.upper())):
+                    if possible_name in names:
+                        return os.path.join(self.dir_name, possible_name)
+            return None
+
         for e in extensions_to_check:
             possible_file = '{}.{}'.format(full_file_name_no_ext, e)
             if os.path.exists(possible_file):
@@ -1570,6 +2019,7 @@ class ScanWorker(WorkerInPublishPullPipeline):
         return None
 
     def cleanup_pre_stop(self):
+        self.stop_walking.set()
         self.exit_exiftool()
         if self.camera is not None:
             self.camera.free_camera()
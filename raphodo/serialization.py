@@ -0,0 +1,191 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Compact binary encoding of the messages most often sent from worker processes
+to the main process.
+
+An encoded message is a list of 0MQ frames. The first frame starts with a
+header identifying the message type, the version of the type's schema, and
+which of the message's fields are set. The values of the fields that are set
+follow the header. Fields holding binary payloads, like thumbnails, are not
+copied into the first frame. Instead each is sent as a frame of its own, which
+0MQ can send without copying it.
+
+Messages whose type has no registered schema are pickled, as are values of
+fields that have no compact encoding.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import pickle
+import struct
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+from raphodo.constants import MessageField
+
+# First byte of an encoded message. Pickles made using protocol 2 or higher
+# start with 0x80, so the two kinds of message cannot be confused.
+message_magic = 0xA5
+
+_header = struct.Struct('<BBBI')
+_integer = struct.Struct('<q')
+_boolean = struct.Struct('<?')
+_length = struct.Struct('<I')
+
+Frame = Union[bytes, bytearray, memoryview]
+
+
+class MessageSchema:
+    """
+    The fields of a message type, in the order they are encoded
+    """
+
+    def __init__(self, message_type: type, code: int, version: int,
+                 fields: Sequence[Tuple[str, MessageField]]) -> None:
+        """
+        :param message_type: the class of the message
+        :param code: number identifying the message type, unique across all
+         message types
+        :param version: version of the schema. Must be incremented when
+         the fields change.
+        :param fields: the names of all the message's attributes, and how
+         each is encoded
+        """
+
+        # Which fields are set is recorded in 32 bits
+        assert len(fields) <= 32
+        self.message_type = message_type
+        self.code = code
+        self.version = version
+        self.fields = tuple(fields)
+
+
+_schemas_by_type = {}  # type: Dict[type, MessageSchema]
+_schemas_by_code = {}  # type: Dict[Tuple[int, int], MessageSchema]
+
+
+def register_message(message_type: type, code: int, version: int,
+                     fields: Sequence[Tuple[str, MessageField]]) -> None:
+    """
+    Encode messages of the type using the compact binary encoding rather than
+    pickling them.
+
+    Parameters are the same as MessageSchema.
+    """
+
+    schema = MessageSchema(message_type, code, version, fields)
+    assert (code, version) not in _schemas_by_code
+    _schemas_by_type[message_type] = schema
+    _schemas_by_code[(code, version)] = schema
+
+
+def encode_message(message: Any) -> List[Frame]:
+    """
+    Encode a message to send to another process
+
+    :param message: the message
+    :return: the frames of the encoded message
+    """
+
+    schema = _schemas_by_type.get(type(message))
+    if schema is None:
+        return [pickle.dumps(message, pickle.HIGHEST_PROTOCOL)]
+
+    present = 0
+    parts = []  # type: List[bytes]
+    payloads = []  # type: List[Frame]
+    try:
+        for bit, (name, field) in enumerate(schema.fields):
+            value = getattr(message, name)
+            if value is None:
+                continue
+            present |= 1 << bit
+            if field == MessageField.integer:
+                parts.append(_integer.pack(value))
+            elif field == MessageField.boolean:
+                parts.append(_boolean.pack(value))
+            elif field == MessageField.string:
+                data = value.encode('utf-8', 'surrogatepass')
+                parts.append(_length.pack(len(data)))
+                parts.append(data)
+            elif field == MessageField.payload:
+                if not isinstance(value, (bytes, bytearray, memoryview)):
+                    # e.g. a QByteArray
+                    value = bytes(value)
+                payloads.append(value)
+            else:
+                data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                parts.append(_length.pack(len(data)))
+                parts.append(data)
+    except (struct.error, AttributeError):
+        # A value that cannot be encoded in the schema, e.g. a float in an
+        # integer field
+        return [pickle.dumps(message, pickle.HIGHEST_PROTOCOL)]
+
+    parts.insert(0, _header.pack(message_magic, schema.code, schema.version, present))
+    return [b''.join(parts)] + payloads
+
+
+def decode_message(content: Frame, payloads: Sequence[Frame]=()) -> Any:
+    """
+    Decode a message received from another process
+
+    :param content: the first frame of the message
+    :param payloads: any remaining frames of the message
+    :return: the message
+    """
+
+    if content[0] != message_magic:
+        return pickle.loads(content)
+
+    view = memoryview(content)
+    magic, code, version, present = _header.unpack_from(view)
+    schema = _schemas_by_code.get((code, version))
+    if schema is None:
+        raise ValueError(
+            "Unknown message type {} version {}".format(code, version)
+        )
+
+    message = schema.message_type.__new__(schema.message_type)
+    offset = _header.size
+    payload = 0
+    for bit, (name, field) in enumerate(schema.fields):
+        if not present & 1 << bit:
+            value = None
+        elif field == MessageField.integer:
+            value = _integer.unpack_from(view, offset)[0]
+            offset += _integer.size
+        elif field == MessageField.boolean:
+            value = _boolean.unpack_from(view, offset)[0]
+            offset += _boolean.size
+        elif field == MessageField.payload:
+            value = payloads[payload]
+            payload += 1
+        else:
+            length = _length.unpack_from(view, offset)[0]
+            offset += _length.size
+            data = view[offset:offset + length]
+            offset += length
+            if field == MessageField.string:
+                value = str(data, 'utf-8', 'surrogatepass')
+            else:
+                value = pickle.loads(data)
+        setattr(message, name, value)
+    return message
@@ -937,6 +937,23 @@ def fs_device_details(path: str) -> Tuple:
     return name, uri, root_path, fstype
 
 
+def fs_uuid(path: str) -> Optional[str]:
+    """
+    :return: UUID of the file system the path is on, or None if it
+     cannot be determined
+    """
+
+    try:
+        device = os.stat(path).st_dev
+        by_uuid = '/dev/disk/by-uuid'
+        for uuid in os.listdir(by_uuid):
+            if os.stat(os.path.join(by_uuid, uuid)).st_rdev == device:
+                return uuid
+    except OSError:
+        pass
+    return None
+
+
 class WatchDownloadDirs(QFileSystemWatcher):
     """
     Create a file system watch to monitor if there are changes to the
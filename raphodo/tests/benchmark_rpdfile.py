@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Measure the memory used by the RPDFiles of a synthetic scan, both as created
+by the scan and as unpickled by the main process, along with the bytes and
+time needed to pickle them.
+
+Usage: benchmark_rpdfile.py [number of files]
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import gc
+import pickle
+import sys
+import time
+import tracemalloc
+
+from raphodo.constants import DeviceTimestampTZ, ThumbnailCacheDiskStatus, FileType
+from raphodo.rpdfile import get_rpdfile
+
+
+def make_rpd_file(number: int):
+    photo = number % 10
+    return get_rpdfile(
+        name='IMG_{:04d}.{}'.format(number % 10000, 'MOV' if photo == 0 else 'CR2'),
+        path='/media/user/EOS_DIGITAL/DCIM/{}CANON'.format(100 + number // 10000),
+        size=25 * 1024 * 1024, prev_full_name=None, prev_datetime=None,
+        device_timestamp_type=DeviceTimestampTZ.is_local, mtime=1577836800.0 + number,
+        mdatatime=1577836800.0 + number, thumbnail_cache_status=ThumbnailCacheDiskStatus.unknown,
+        thm_full_name=None, audio_file_full_name=None, xmp_file_full_name=None,
+        log_file_full_name=None, scan_id=b'1',
+        file_type=FileType.video if photo == 0 else FileType.photo, from_camera=False,
+        camera_details=None, camera_memory_card_identifiers=None, never_read_mdatatime=False,
+        device_display_name='EOS_DIGITAL', device_uri='file:///media/user/EOS_DIGITAL',
+        raw_exif_bytes=None, exif_source=None, problem=None
+    )
+
+
+def measure(description: str, make):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    files = make()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('{:<28} {:>10.1f} {:>12.0f} {:>12.1f}'.format(
+        description, size / 1024 / 1024, size / len(files), elapsed)
+    )
+    return files
+
+
+no_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+batch_size = 50
+
+print('{} files\n'.format(no_files))
+print('{:<28} {:>10} {:>12} {:>12}'.format('', 'MiB', 'Bytes/file', 'Seconds'))
+files = measure('Scanned', lambda: [make_rpd_file(i) for i in range(no_files)])
+
+# Files arrive in the main process in batches, as they do from the scan process
+batches = [
+    pickle.dumps(files[i:i + batch_size], pickle.HIGHEST_PROTOCOL)
+    for i in range(0, no_files, batch_size)
+]
+del files
+measure('Unpickled in main process', lambda: [f for batch in batches for f in pickle.loads(batch)])
+
+files = [make_rpd_file(i) for i in range(1000)]
+single = [pickle.dumps(f, pickle.HIGHEST_PROTOCOL) for f in files]
+start = time.perf_counter()
+for f in files:
+    pickle.loads(pickle.dumps(f, pickle.HIGHEST_PROTOCOL))
+round_trip = (time.perf_counter() - start) / len(files) * 1000000
+
+print()
+print('Pickled bytes per file, sent singly:     {:.0f}'.format(
+    sum(len(s) for s in single) / len(single))
+)
+print('Pickled bytes per file, batches of {}:   {:.0f}'.format(
+    batch_size, sum(len(b) for b in batches) / no_files)
+)
+print('Pickle and unpickle one file:            {:.1f} µs'.format(round_trip))
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the cost of encoding and decoding interprocess messages using the
+compact binary encoding with the cost of pickling them, and the bytes each
+sends per message.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import os
+import pickle
+import timeit
+
+from raphodo.constants import (
+    DeviceTimestampTZ, ThumbnailCacheDiskStatus, FileType
+)
+from raphodo.interprocess import (
+    ScanResults, CopyFilesResults, RenameAndMoveFileResults, BackupResults,
+    GenerateThumbnailsResults
+)
+from raphodo.rpdfile import get_rpdfile
+from raphodo.serialization import encode_message, decode_message
+
+
+def make_rpd_file(number: int):
+    return get_rpdfile(
+        name='IMG_{:04d}.CR2'.format(number), path='/media/user/EOS_DIGITAL/DCIM/100CANON',
+        size=25 * 1024 * 1024, prev_full_name=None, prev_datetime=None,
+        device_timestamp_type=DeviceTimestampTZ.is_local, mtime=1577836800.0 + number,
+        mdatatime=1577836800.0 + number, thumbnail_cache_status=ThumbnailCacheDiskStatus.unknown,
+        thm_full_name=None, audio_file_full_name=None, xmp_file_full_name=None,
+        log_file_full_name=None, scan_id=b'1', file_type=FileType.photo, from_camera=False,
+        camera_details=None, camera_memory_card_identifiers=None, never_read_mdatatime=False,
+        device_display_name='EOS_DIGITAL', device_uri='file:///media/user/EOS_DIGITAL',
+        raw_exif_bytes=None, exif_source=None, problem=None
+    )
+
+
+def pickled(message):
+    return [pickle.dumps(message, pickle.HIGHEST_PROTOCOL)]
+
+
+def unpickled(frames):
+    return pickle.loads(frames[0])
+
+
+def encoded(message):
+    return encode_message(message)
+
+
+def decoded(frames):
+    return decode_message(frames[0], frames[1:])
+
+
+messages = dict(
+    copy_progress=CopyFilesResults(scan_id=1, total_downloaded=1234567890, chunk_downloaded=65536),
+    backup_progress=BackupResults(
+        scan_id=1, device_id=2, total_downloaded=1234567890, chunk_downloaded=65536
+    ),
+    file_copied=CopyFilesResults(copy_succeeded=True, rpd_file=make_rpd_file(1), download_count=1),
+    file_renamed=RenameAndMoveFileResults(
+        move_succeeded=True, rpd_file=make_rpd_file(1), download_count=1
+    ),
+    thumbnail=GenerateThumbnailsResults(
+        rpd_file=make_rpd_file(1), thumbnail_bytes=os.urandom(40 * 1024)
+    ),
+    scan_batch=ScanResults(
+        rpd_files=[make_rpd_file(i) for i in range(50)], scan_id=1, entire_photo_required=False,
+        entire_video_required=False
+    ),
+)
+
+repeat = 2000
+
+print('{:<16} {:>14} {:>14} {:>14} {:>14}'.format(
+    'Message', 'Pickle bytes', 'Encoded bytes', 'Pickle µs', 'Encoded µs')
+)
+for name, message in messages.items():
+    sizes = []
+    times = []
+    for encode, decode in ((pickled, unpickled), (encoded, decoded)):
+        frames = encode(message)
+        assert vars(decode(frames)).keys() == vars(message).keys()
+        sizes.append(sum(len(frame) for frame in frames))
+        seconds = timeit.timeit(lambda: decode(encode(message)), number=repeat)
+        times.append(seconds / repeat * 1000000)
+    print('{:<16} {:>14} {:>14} {:>14.1f} {:>14.1f}'.format(name, *sizes, *times))
@@ -20,7 +20,65 @@ __author__ = 'Damon Lynch'
 # see <http://www.gnu.org/licenses/>.
 
 import pickle
+import random
 import proximity
+from viewutils import ThumbnailDataForProximity
+from constants import FileType
+
+
+def make_rows(uid_times):
+    return [
+        ThumbnailDataForProximity(
+            uid=str(uid).encode(), ctime=ctime, file_type=FileType.photo,
+            previously_downloaded=False
+        )
+        for uid, ctime in uid_times
+    ]
+
+
+def group_uids(index):
+    return [group.uids for group in index.groups()]
+
+
+def check_proximity_index(index):
+    """
+    Check the incrementally updated index has the same groups as an index
+    generated from scratch
+    """
+
+    fresh = proximity.ProximityIndex(index.temporal_span)
+    fresh.add(index.thumbnail_rows())
+    assert group_uids(index) == group_uids(fresh), (group_uids(index), group_uids(fresh))
+
+
+index = proximity.ProximityIndex(60)
+index.add(make_rows([(1, 286), (2, 208), (3, 272)]))
+index.add(make_rows([(4, 137), (5, 146)]))
+index.add(make_rows([(6, 142), (7, 255)]))
+check_proximity_index(index)
+index.add(make_rows([(8, 160), (9, 209)]))
+index.set_temporal_span(30)
+check_proximity_index(index)
+
+random.seed(0)
+index = proximity.ProximityIndex(60)
+next_uid = 0
+for operation in range(2000):
+    choice = random.random()
+    if choice < 0.5 or not len(index):
+        rows = make_rows(
+            (next_uid + i, random.randint(0, 1000)) for i in range(random.randint(1, 3))
+        )
+        next_uid += len(rows)
+        index.add(rows)
+    elif choice < 0.8:
+        present = [row.uid for row in index.thumbnail_rows()]
+        index.remove(random.sample(present, min(len(present), random.randint(1, 2))))
+    else:
+        index.set_temporal_span(random.choice((10, 30, 60, 120, 300)))
+    if random.random() < 0.3:
+        check_proximity_index(index)
+check_proximity_index(index)
 
 with open('proximity_test_data', 'rb') as data:
     test_rows = pickle.load(data)
@@ -52,6 +52,7 @@ from raphodo.constants import (
 from raphodo.interprocess import (
     ThumbnailDaemonData, GenerateThumbnailsResults, DaemonProcess, ThumbnailExtractorArgument
 )
+from raphodo.serialization import encode_message
 from raphodo.rpdfile import RPDFile
 from raphodo.thumbnailpara import GetThumbnailFromCache, preprocess_thumbnail_from_disk
 from raphodo.cache import FdoCacheLarge, FdoCacheNormal
@@ -171,10 +172,9 @@ class DameonThumbnailWorker(DaemonProcess):
                                 full_file_name_to_work_on = rpd_file.download_full_file_name
 
                     if task == ExtractionTask.bypass:
-                        self.content = pickle.dumps(
+                        self.content = encode_message(
                             GenerateThumbnailsResults(
-                                rpd_file=rpd_file, thumbnail_bytes=thumbnail_bytes),
-                                pickle.HIGHEST_PROTOCOL
+                                rpd_file=rpd_file, thumbnail_bytes=thumbnail_bytes)
                         )
                         self.send_message_to_sink()
 
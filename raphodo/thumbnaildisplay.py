@@ -23,7 +23,7 @@ import pickle
 import os
 import sys
 import datetime
-from collections import (namedtuple, defaultdict, deque)
+from collections import (namedtuple, defaultdict, deque, OrderedDict)
 from operator import attrgetter
 import subprocess
 import shlex
@@ -42,7 +42,7 @@ from colour import Color
 from PyQt5.QtCore import (
     QAbstractListModel, QModelIndex, Qt, pyqtSignal, QSizeF, QSize, QRect, QRectF, QEvent, QPoint,
     QItemSelectionModel, QAbstractItemModel, pyqtSlot, QItemSelection, QTimeLine, QPointF,
-    QT_VERSION_STR
+    QT_VERSION_STR, QTimer
 )
 from PyQt5.QtWidgets import (
     QListView, QStyledItemDelegate, QStyleOptionViewItem, QApplication, QStyle, QStyleOptionButton,
@@ -58,9 +58,9 @@ from raphodo.fileformats import ALL_USER_VISIBLE_EXTENSIONS, MUST_CACHE_VIDEOS
 from raphodo.interprocess import GenerateThumbnailsArguments, Device, GenerateThumbnailsResults
 from raphodo.constants import (
     DownloadStatus, Downloaded, FileType, DownloadingFileTypes, ThumbnailSize,
-    ThumbnailCacheStatus, Roles, DeviceType, CustomColors, Show, Sort, ThumbnailBackgroundName,
-    Desktop, DeviceState, extensionColor, FadeSteps, FadeMilliseconds, PaleGray, DarkGray,
-    DoubleDarkGray, Plural, manually_marked_previously_downloaded, thumbnail_margin
+    ThumbnailCacheStatus, ThumbnailCacheDiskStatus, Roles, DeviceType, CustomColors, Show, Sort,
+    ThumbnailBackgroundName, Desktop, DeviceState, extensionColor, FadeSteps, FadeMilliseconds,
+    PaleGray, DarkGray, DoubleDarkGray, Plural, manually_marked_previously_downloaded, thumbnail_margin
 )
 from raphodo.storage import (
     get_program_cache_directory, get_desktop, validate_download_folder, open_in_file_manager
@@ -74,6 +74,7 @@ from raphodo.viewutils import ThumbnailDataForProximity, scaledIcon
 from raphodo.proximity import TemporalProximityState
 from raphodo.rpdsql import DownloadedSQL
 from raphodo.preferences import Preferences
+from raphodo.cache import ThumbnailCacheSql
 
 
 DownloadFiles = namedtuple(
@@ -97,10 +98,13 @@ class AddBuffer:
     Buffers thumbnail rows for display.
 
     Add thumbnail rows to the listview is a relatively expensive operation, as the
-    model must be reset. Buffer the rows here, and then when big enough, flush it.
+    view must be requeried and its layout updated. Buffer the rows here, and then
+    when big enough, or when the rows have been waiting too long, flush it.
     """
 
     min_buffer_length = 10
+    # milliseconds
+    max_latency = 500
 
     def __init__(self):
         self.initialize()
@@ -134,9 +138,96 @@ class AddBuffer:
         del self.buffer[scan_id]
 
 
+class PixmapCache:
+    """
+    Thumbnails for display, keeping no more than a maximum number in memory.
+
+    Until a file's thumbnail has been received, a placeholder icon is used.
+    Thumbnails that can be reloaded from the thumbnail cache on disk are evicted
+    when the least recently used, and their placeholder used until they are
+    reloaded. Thumbnails that cannot be reloaded are always kept.
+    """
+
+    def __init__(self, max_pixmaps: int) -> None:
+        self.max_pixmaps = max_pixmaps
+        # uid: QPixmap
+        self.placeholders = {}  # type: Dict[bytes, QPixmap]
+        self.pixmaps = OrderedDict()  # type: Dict[bytes, QPixmap]
+        self.pinned = {}  # type: Dict[bytes, QPixmap]
+        self.evicted = set()  # type: Set[bytes]
+
+    def __len__(self) -> int:
+        return len(self.placeholders)
+
+    def __contains__(self, uid: bytes) -> bool:
+        return uid in self.placeholders
+
+    def __getitem__(self, uid: bytes) -> QPixmap:
+        pixmap = self.pixmaps.get(uid)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(uid)
+            return pixmap
+        pixmap = self.pinned.get(uid)
+        if pixmap is not None:
+            return pixmap
+        return self.placeholders[uid]
+
+    def __delitem__(self, uid: bytes) -> None:
+        del self.placeholders[uid]
+        self.pixmaps.pop(uid, None)
+        self.pinned.pop(uid, None)
+        self.evicted.discard(uid)
+
+    def get(self, uid: bytes, default: Optional[QPixmap]=None) -> Optional[QPixmap]:
+        if uid in self.placeholders:
+            return self[uid]
+        return default
+
+    def add_placeholder(self, uid: bytes, pixmap: QPixmap) -> None:
+        self.placeholders[uid] = pixmap
+
+    def add(self, uid: bytes, pixmap: QPixmap, evictable: bool) -> None:
+        """
+        Add a file's thumbnail, evicting the least recently used thumbnails
+        if there are too many in memory
+
+        :param uid: the file's uid
+        :param pixmap: its thumbnail
+        :param evictable: whether the thumbnail can be reloaded from the
+         thumbnail cache on disk if it is evicted
+        """
+
+        self.evicted.discard(uid)
+        if evictable:
+            self.pinned.pop(uid, None)
+            self.pixmaps[uid] = pixmap
+            self.pixmaps.move_to_end(uid)
+            while len(self.pixmaps) > self.max_pixmaps:
+                evicted_uid, _ = self.pixmaps.popitem(last=False)
+                self.evicted.add(evicted_uid)
+        else:
+            self.pixmaps.pop(uid, None)
+            self.pinned[uid] = pixmap
+
+    def is_evicted(self, uid: bytes) -> bool:
+        return uid in self.evicted
+
+    def forget(self, uid: bytes) -> None:
+        """
+        Use the placeholder for a file's thumbnail from now on, because the
+        evicted thumbnail could not be reloaded
+        """
+
+        self.evicted.discard(uid)
+
+
 class ThumbnailListModel(QAbstractListModel):
     selectionReset = pyqtSignal()
 
+    # How many evicted thumbnails to reload from the thumbnail cache before
+    # returning to the event loop
+    reload_batch_size = 20
+
     def __init__(self, parent, logging_port: int, log_gphoto2: bool) -> None:
         super().__init__(parent)
         self.rapidApp = parent
@@ -145,6 +236,18 @@ class ThumbnailListModel(QAbstractListModel):
         self.thumbnailer_ready = False
         self.thumbnailer_generation_queue = []
 
+        # Evicted thumbnails are reloaded from the thumbnail cache when they are
+        # next displayed
+        self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(0)
+        self.reload_timer.timeout.connect(self.reloadThumbnails)
+        self.add_buffer_timer = QTimer(self)
+        self.add_buffer_timer.setSingleShot(True)
+        self.add_buffer_timer.setInterval(AddBuffer.max_latency)
+        self.add_buffer_timer.timeout.connect(self.flushAddBufferAndUpdateViews)
+
         # track what devices are having thumbnails generated, by scan_id
         # see also DeviceCollection.thumbnailing
 
@@ -176,7 +279,12 @@ class ThumbnailListModel(QAbstractListModel):
 
     def initialize(self) -> None:
         # uid: QPixmap
-        self.thumbnails = {}  # type: Dict[bytes, QPixmap]
+        self.thumbnails = PixmapCache(
+            max_pixmaps=self.prefs.max_thumbnails_in_memory
+        )  # type: PixmapCache
+        # uids of evicted thumbnails waiting to be reloaded, in the order they
+        # were requested
+        self.reload_pending = OrderedDict()  # type: Dict[bytes, None]
 
         self.add_buffer = AddBuffer()
 
@@ -233,6 +341,7 @@ class ThumbnailListModel(QAbstractListModel):
 
     def stopThumbnailer(self) -> None:
         self.thumbnailer.stop()
+        self.thumbnail_cache.flush_access_times()
 
     @pyqtSlot(int)
     def thumbnailWorkerFinished(self, scan_id: int) -> None:
@@ -309,11 +418,7 @@ class ThumbnailListModel(QAbstractListModel):
         if not suppress_signal:
             self.layoutAboutToBeChanged.emit()
 
-        self.rows = self.tsql.get_view(
-            sort_by=self.sort_by, sort_order=self.sort_order,
-            show=self.show, proximity_col1=self.proximity_col1,
-            proximity_col2=self.proximity_col2
-        )
+        self.rows = self._queryRows()
         self.uid_to_row = {row[0]: idx for idx, row in enumerate(self.rows)}
 
         if not suppress_signal:
@@ -322,6 +427,13 @@ class ThumbnailListModel(QAbstractListModel):
         if rememberSelection:
             self.reselect()
 
+    def _queryRows(self) -> List[Tuple[bytes, bool]]:
+        return self.tsql.get_view(
+            sort_by=self.sort_by, sort_order=self.sort_order,
+            show=self.show, proximity_col1=self.proximity_col1,
+            proximity_col2=self.proximity_col2
+        )
+
     def _selectionModel(self) -> QItemSelectionModel:
         return self.rapidApp.thumbnailView.selectionModel()
 
@@ -392,6 +504,11 @@ class ThumbnailListModel(QAbstractListModel):
             else:
                 return 0
         elif role == Qt.DecorationRole:
+            if self.thumbnails.is_evicted(uid):
+                self.reload_pending[uid] = None
+                self.reload_pending.move_to_end(uid)
+                if not self.reload_timer.isActive():
+                    self.reload_timer.start()
             return self.thumbnails[uid]
         elif role == Qt.CheckStateRole:
             if self.rows[row][1]:
@@ -613,7 +730,7 @@ class ThumbnailListModel(QAbstractListModel):
                 self.rows[row] = (uid, False)
             # Set the files as previously downloaded
             self.tsql.set_list_previously_downloaded(uids=uids, previously_downloaded=value)
-            d = DownloadedSQL()
+            d = DownloadedSQL(buffer_size=len(uids))
             now = datetime.datetime.now()
             for uid in uids:
                 rpd_file = self.rpd_files[uid]
@@ -625,6 +742,7 @@ class ThumbnailListModel(QAbstractListModel):
                     modification_time=rpd_file.modification_time,
                     download_full_file_name=manually_marked_previously_downloaded
                 )
+            d.flush()
             # Update Timeline formatting, if needed
             self.rapidApp.temporalProximity.previouslyDownloadedManuallySet(uids=uids)
 
@@ -688,9 +806,9 @@ class ThumbnailListModel(QAbstractListModel):
             self.rpd_files[uid] = rpd_file
 
             if rpd_file.file_type == FileType.photo:
-                self.thumbnails[uid] = self.photo_icon
+                self.thumbnails.add_placeholder(uid, self.photo_icon)
             else:
-                self.thumbnails[uid] = self.video_icon
+                self.thumbnails.add_placeholder(uid, self.video_icon)
 
             if generate_thumbnail:
                 self.total_thumbs_to_generate += 1
@@ -716,32 +834,87 @@ class ThumbnailListModel(QAbstractListModel):
         self.add_buffer.extend(scan_id=scan_id, thumbnail_rows=thumbnail_rows)
 
         if self.add_buffer.should_flush():
-            self.flushAddBuffer()
-            marked_summary = self.getMarkedSummary()
-            destinations_good = self.rapidApp.updateDestinationViews(marked_summary=marked_summary)
-            self.rapidApp.destinationButton.setHighlighted(not destinations_good)
-            if self.prefs.backup_files:
-                backups_good = self.rapidApp.updateBackupView(marked_summary=marked_summary)
-            else:
-                backups_good = True
-            self.rapidApp.destinationButton.setHighlighted(not destinations_good)
-            self.rapidApp.backupButton.setHighlighted(not backups_good)
+            self.flushAddBufferAndUpdateViews()
+        elif not self.add_buffer_timer.isActive():
+            # Ensure the buffered rows are displayed within a short time, even if no
+            # more files arrive
+            self.add_buffer_timer.start()
+
+    @pyqtSlot()
+    def flushAddBufferAndUpdateViews(self) -> None:
+        if not len(self.add_buffer):
+            return
+
+        self.flushAddBuffer()
+        marked_summary = self.getMarkedSummary()
+        destinations_good = self.rapidApp.updateDestinationViews(marked_summary=marked_summary)
+        self.rapidApp.destinationButton.setHighlighted(not destinations_good)
+        if self.prefs.backup_files:
+            backups_good = self.rapidApp.updateBackupView(marked_summary=marked_summary)
+        else:
+            backups_good = True
+        self.rapidApp.destinationButton.setHighlighted(not destinations_good)
+        self.rapidApp.backupButton.setHighlighted(not backups_good)
 
     def flushAddBuffer(self):
-        if len(self.add_buffer):
-            self.beginResetModel()
+        self.add_buffer_timer.stop()
 
+        if len(self.add_buffer):
+            added = set()  # type: Set[bytes]
             for buffer in self.add_buffer.buffer.values():
                 self.tsql.add_thumbnail_rows(thumbnail_rows=buffer)
-            self.refresh(suppress_signal=True)
+                added.update(row.uid for row in buffer)
+
+            rows = self._queryRows()
+            first = self._insertedBlock(rows=rows, added=added)
+
+            if first is not None:
+                # All the new rows form a single block: insert them in one operation,
+                # leaving the rest of the view (and its selection) untouched
+                last = first + len(rows) - len(self.rows) - 1
+                if last >= first:
+                    self.beginInsertRows(QModelIndex(), first, last)
+                self.rows = rows
+                self.uid_to_row = {row[0]: idx for idx, row in enumerate(self.rows)}
+                if last >= first:
+                    self.endInsertRows()
+            else:
+                self.beginResetModel()
+                self.rows = rows
+                self.uid_to_row = {row[0]: idx for idx, row in enumerate(self.rows)}
+                self.endResetModel()
 
             self.add_buffer.reset(buffer_length=len(self.rows))
 
-            self.endResetModel()
-
             self._resetHighlightingValues()
             self._resetRememberSelection()
 
+    def _insertedBlock(self, rows: List[Tuple[bytes, bool]], added: Set[bytes]) -> Optional[int]:
+        """
+        Determine if the newly added rows are in one contiguous block in the
+        requeried view, with the existing rows remaining in the same order.
+
+        :param rows: the requeried view
+        :param added: uids of the rows just added
+        :return: the row the block starts at (the end of the view if no
+         new rows are visible), or None if the rows are not in a single block
+        """
+
+        inserted = [idx for idx, row in enumerate(rows) if row[0] in added]
+        if not inserted:
+            first = len(rows)
+        else:
+            first = inserted[0]
+            if inserted[-1] - first + 1 != len(inserted):
+                return None
+        if len(rows) - len(inserted) != len(self.rows):
+            return None
+        if rows[:first] != self.rows[:first]:
+            return None
+        if rows[first + len(inserted):] != self.rows[first:]:
+            return None
+        return first
+
     def getMarkedSummary(self) -> MarkedSummary:
         """
         :return: summary of files marked for download including sizes in bytes
@@ -802,7 +975,15 @@ class ThumbnailListModel(QAbstractListModel):
             self.rpd_files[uid] = rpd_file
 
         if not thumbnail.isNull():
-            self.thumbnails[uid] = thumbnail
+            # Thumbnails saved in the thumbnail cache can be reloaded from it. Those
+            # regenerated after the file was downloaded, e.g. with their orientation
+            # corrected, are not saved to it, so reloading them would show the
+            # thumbnail they replaced.
+            self.thumbnails.add(
+                uid, thumbnail,
+                evictable=self.prefs.use_thumbnail_cache and self.thumbnail_cache.valid and
+                not rpd_file.modified_via_daemon_process
+            )
             # The thumbnail may or may not be displayed at this moment
             row = self.uid_to_row.get(uid)
             if row is not None:
@@ -845,6 +1026,54 @@ class ThumbnailListModel(QAbstractListModel):
         else:
             self.rapidApp.thumbnailGeneratedPostDownload(rpd_file=rpd_file)
 
+    @pyqtSlot()
+    def reloadThumbnails(self) -> None:
+        """
+        Reload evicted thumbnails from the thumbnail cache, most recently
+        requested first.
+
+        Only thumbnails still visible in the Thumbnail View are reloaded.
+        Others will be requested again when they are next displayed.
+        """
+
+        view = self.rapidApp.thumbnailView  # type: ThumbnailView
+        viewport = view.viewport().rect()
+        reloaded = 0
+        while self.reload_pending and reloaded < self.reload_batch_size:
+            uid, _ = self.reload_pending.popitem(last=True)
+            row = self.uid_to_row.get(uid)
+            if row is None or not self.thumbnails.is_evicted(uid):
+                continue
+            index = self.index(row, 0)
+            if not view.visualRect(index).intersects(viewport):
+                continue
+
+            rpd_file = self.rpd_files[uid]  # type: RPDFile
+            get_thumbnail = self.thumbnail_cache.get_thumbnail_bytes(
+                full_file_name=rpd_file.full_file_name,
+                mtime=rpd_file.modification_time,
+                size=rpd_file.size,
+                camera_model=rpd_file.camera_model
+            )
+            thumbnail = None
+            if get_thumbnail.disk_status == ThumbnailCacheDiskStatus.found:
+                image = QImage.fromData(get_thumbnail.thumbnail_bytes)
+                if not image.isNull():
+                    thumbnail = QPixmap.fromImage(image)
+            if thumbnail is None:
+                logging.debug(
+                    "Could not reload thumbnail for %s from the thumbnail cache",
+                    rpd_file.full_file_name
+                )
+                self.thumbnails.forget(uid)
+            else:
+                self.thumbnails.add(uid, thumbnail, evictable=True)
+            self.dataChanged.emit(index, index)
+            reloaded += 1
+
+        if self.reload_pending:
+            self.reload_timer.start()
+
     def addCtimeDisparity(self, rpd_file: RPDFile) -> None:
         """
         Track the fact that there was a disparity between the creation time and
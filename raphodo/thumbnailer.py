@@ -19,7 +19,6 @@
 __author__ = 'Damon Lynch'
 __copyright__ = "Copyright 2015-2017, Damon Lynch"
 
-import pickle
 from typing import Optional
 import logging
 
@@ -31,6 +30,8 @@ from raphodo.interprocess import (LoadBalancerManager, PublishPullPipelineManage
                                   GenerateThumbnailsArguments, GenerateThumbnailsResults,
                                   ThreadNames, create_inproc_msg)
 from raphodo.rpdfile import RPDFile
+from raphodo.serialization import decode_message
+from raphodo.thumbnailring import ThumbnailRing
 from raphodo.utilities import CacheDirs
 
 
@@ -47,16 +48,24 @@ class ThumbnailManagerPara(PublishPullPipelineManager):
     cacheDirs = pyqtSignal(int, CacheDirs)
     cameraRemoved = pyqtSignal(int)
 
-    def __init__(self, logging_port: int, thread_name: str) -> None:
+    def __init__(self, logging_port: int, thread_name: str,
+                 thumbnail_ring: Optional[ThumbnailRing]=None) -> None:
         super().__init__(logging_port=logging_port, thread_name=thread_name)
         self._process_name = 'Thumbnail Manager'
         self._process_to_run = 'thumbnailpara.py'
         self._worker_id = 0
+        self.thumbnail_ring = thumbnail_ring
 
     def process_sink_data(self) -> None:
-        data = pickle.loads(self.content) # type: GenerateThumbnailsResults
+        data = decode_message(self.content, self.payloads)  # type: GenerateThumbnailsResults
         if data.rpd_file is not None:
-            if data.thumbnail_bytes is None:
+            if data.thumbnail_slot is not None:
+                thumbnail = self.thumbnail_ring.read_image(data.thumbnail_slot)
+                if thumbnail is None or thumbnail.isNull():
+                    thumbnail = QPixmap()
+                else:
+                    thumbnail = QPixmap.fromImage(thumbnail)
+            elif data.thumbnail_bytes is None:
                 thumbnail = QPixmap()
             else:
                 thumbnail = QImage.fromData(data.thumbnail_bytes)
@@ -120,6 +129,13 @@ class Thumbnailer(QObject):
         self.load_balancer_controller = self.context.socket(zmq.PAIR)
         self.load_balancer_controller.bind(inproc.format(ThreadNames.load_balancer))
 
+        # Thumbnails are passed from the thumbnail extractors in shared memory
+        try:
+            self.thumbnail_ring = ThumbnailRing.create()  # type: Optional[ThumbnailRing]
+        except OSError as e:
+            logging.warning("Could not create shared memory for thumbnails: %s", e)
+            self.thumbnail_ring = None
+
         self.setupThumbnailManager()
 
     def generateThumbnails(self, scan_id: int,
@@ -175,7 +191,8 @@ class Thumbnailer(QObject):
                     camera=camera_model,
                     port=camera_port,
                     entire_video_required=entire_video_required,
-                    entire_photo_required=entire_photo_required
+                    entire_photo_required=entire_photo_required,
+                    thumbnail_ring=None if self.thumbnail_ring is None else self.thumbnail_ring.path
                 )
             )
         )
@@ -207,7 +224,8 @@ class Thumbnailer(QObject):
 
         self.thumbnail_manager_thread = QThread()
         self.thumbnail_manager = ThumbnailManagerPara(
-            logging_port=self.logging_port, thread_name=ThreadNames.thumbnailer
+            logging_port=self.logging_port, thread_name=ThreadNames.thumbnailer,
+            thumbnail_ring=self.thumbnail_ring
         )
         self.thumbnail_manager.moveToThread(self.thumbnail_manager_thread)
         self.thumbnail_manager_thread.started.connect(self.thumbnail_manager.run_sink)
@@ -254,6 +272,8 @@ class Thumbnailer(QObject):
         self.load_balancer_thread.quit()
         if not self.load_balancer_thread.wait(1000):
             self.load_balancer_controller.send_multipart(create_inproc_msg(b'TERMINATE'))
+        if self.thumbnail_ring is not None:
+            self.thumbnail_ring.unlink()
 
     def stop_worker(self, scan_id: int) -> None:
         self.thumbnailer_controller.send_multipart(
@@ -29,11 +29,17 @@ import os
 from collections import namedtuple
 import tempfile
 from datetime import datetime
-from typing import Optional, Set, Union, Tuple
+from typing import Optional, Set, Union, Tuple, Dict
 
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+from gi.repository import Gst, GLib
+try:
+    gi.require_version('GstVideo', '1.0')
+    from gi.repository import GstVideo
+    have_gst_video = True
+except (ImportError, ValueError):
+    have_gst_video = False
 
 from PyQt5.QtGui import QImage, QTransform
 from PyQt5.QtCore import QSize, Qt, QIODevice, QBuffer
@@ -48,6 +54,7 @@ except ImportError:
 from raphodo.interprocess import (
     LoadBalancerWorker, ThumbnailExtractorArgument, GenerateThumbnailsResults
 )
+from raphodo.serialization import encode_message
 
 from raphodo.constants import (
     ThumbnailSize, ExtractionTask, ExtractionProcessing, ThumbnailCacheStatus,
@@ -59,8 +66,9 @@ from raphodo.utilities import (
     stdchannel_redirected, show_errors, image_large_enough_fdo
 )
 from raphodo.filmstrip import add_filmstrip
-from raphodo.cache import ThumbnailCacheSql, FdoCacheLarge, FdoCacheNormal
-import raphodo.exiftool as exiftool
+from raphodo.cache import ThumbnailCacheSql, FdoCacheLarge, FdoCacheNormal, MetadataCacheSql
+from raphodo.thumbnailring import ThumbnailRing
+from raphodo.exiftoolpool import get_exiftool
 from raphodo.heif import have_heif_module, load_heif
 
 
@@ -180,6 +188,158 @@ def get_video_frame(full_file_name: str,
         return None
 
 
+class VideoFramePipeline:
+    """
+    Extracts frames from videos using a GStreamer playbin pipeline that is
+    reused from one video to the next, rather than building and tearing
+    down a pipeline for each video.
+
+    Frames are captured with an appsink, then converted to RGB and scaled by
+    GStreamer, rather than being encoded as PNG.
+    """
+
+    # How long to wait for the pipeline to open a video, or to seek in it
+    state_change_timeout = 10 * Gst.SECOND
+    convert_timeout = 5 * Gst.SECOND
+    # Build a fresh pipeline after this many videos, in case plugins leak
+    max_uses = 200
+
+    def __init__(self) -> None:
+        self.pipeline = None  # type: Optional[Gst.Element]
+        self.appsink = None  # type: Optional[Gst.Element]
+        self.uses = 0
+
+    def _make_pipeline(self) -> None:
+        self.pipeline = Gst.ElementFactory.make('playbin', None)
+        self.appsink = Gst.ElementFactory.make('appsink', None)
+        # Only the prerolled frame is needed
+        self.appsink.props.sync = False
+        self.appsink.props.max_buffers = 1
+        self.appsink.props.drop = True
+        self.pipeline.props.video_sink = self.appsink
+        self.pipeline.props.audio_sink = Gst.ElementFactory.make('fakesink', None)
+        # Do not decode audio or subtitles (GstPlayFlags audio and text)
+        self.pipeline.props.flags = self.pipeline.props.flags & ~(0x2 | 0x4)
+        # Messages are never read, so do not let them accumulate on the bus
+        self.pipeline.get_bus().set_flushing(True)
+        self.uses = 0
+
+    def close(self) -> None:
+        """
+        Release the pipeline and its resources
+        """
+
+        if self.pipeline is not None:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline = self.appsink = None
+
+    def get_frame(self, full_file_name: str,
+                  offset: Optional[float],
+                  size: QSize) -> Optional[QImage]:
+        """
+        :param full_file_name: file and path of the video
+        :param offset: how far into the video to read
+        :param size: the frame is scaled to fit within this size. It is
+         never enlarged.
+        :return: the frame, or None if it could not be extracted
+        """
+
+        logging.debug("Using gstreamer to generate thumbnail from %s", full_file_name)
+
+        if self.pipeline is None or self.uses >= self.max_uses:
+            self.close()
+            self._make_pipeline()
+        self.uses += 1
+
+        pipeline = self.pipeline
+        # The video can be changed only when the pipeline is not playing or paused
+        pipeline.set_state(Gst.State.READY)
+        pipeline.props.uri = 'file://{}'.format(pathname2url(os.path.abspath(full_file_name)))
+        if not self._wait_for_state(Gst.State.PAUSED, full_file_name):
+            return None
+
+        # Seek offset .10 seconds into the video as a minimum
+        if not offset:
+            offset = 0.5 * Gst.SECOND
+
+        # Duration is unreliable because when we are dealing with camera videos,
+        # we're only downloading a snapshot, i.e. 2 seconds of a 1 minute video.
+        # But no matter what, don't want to exceed it.
+        duration = pipeline.query_duration(Gst.Format.TIME)[1]
+        offset = min(duration, offset)
+
+        if not pipeline.seek_simple(
+                Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, offset):
+            logging.warning(
+                'seek_simple() failed for %s. Is the necessary gstreamer plugin installed for '
+                'this file format?', full_file_name
+            )
+            pipeline.set_state(Gst.State.READY)
+            return None
+        # Wait for seek to finish.
+        if not self._wait_for_state(Gst.State.PAUSED, full_file_name):
+            return None
+
+        sample = self.appsink.emit('pull-preroll')
+        image = None
+        if sample is not None:
+            try:
+                image = self._sample_to_image(sample, size)
+            except GLib.Error as e:
+                logging.warning("Could not convert video frame from %s: %s", full_file_name, e)
+        pipeline.set_state(Gst.State.READY)
+        return image
+
+    def _wait_for_state(self, state: Gst.State, full_file_name: str) -> bool:
+        """
+        Change the pipeline to the state, waiting for the change to complete
+
+        :return: True if the pipeline is in the state, else False, in which
+         case the pipeline should not be used for this video
+        """
+
+        if self.pipeline.get_state(0)[1] != state:
+            self.pipeline.set_state(state)
+        result = self.pipeline.get_state(self.state_change_timeout)[0]
+        if result == Gst.StateChangeReturn.SUCCESS:
+            return True
+        if result == Gst.StateChangeReturn.ASYNC:
+            # Still waiting: the pipeline may never recover
+            logging.warning("Timed out opening %s to extract a video frame", full_file_name)
+            self.close()
+        else:
+            logging.warning("Could not open %s to extract a video frame", full_file_name)
+            self.pipeline.set_state(Gst.State.READY)
+        return False
+
+    def _sample_to_image(self, sample: Gst.Sample, size: QSize) -> Optional[QImage]:
+        structure = sample.get_caps().get_structure(0)
+        width = structure.get_value('width')
+        height = structure.get_value('height')
+        valid, par_n, par_d = structure.get_fraction('pixel-aspect-ratio')
+        if valid and par_n and par_d:
+            width = width * par_n / par_d
+
+        # Scale to the display aspect ratio, fitting within size
+        scale = min(size.width() / width, size.height() / height, 1.0)
+        width = max(round(width * scale), 1)
+        height = max(round(height * scale), 1)
+        caps = Gst.Caps.from_string(
+            'video/x-raw,format=RGB,width={},height={},pixel-aspect-ratio=1/1'.format(
+                width, height
+            )
+        )
+        converted = GstVideo.video_convert_sample(sample, caps, self.convert_timeout)
+        if converted is None:
+            return None
+        buffer = converted.get_buffer()
+        data = buffer.extract_dup(0, buffer.get_size())
+        # Each row of RGB video is padded to a multiple of four bytes
+        stride = (width * 3 + 3) & ~3
+        # Copy the image, so that it owns its data
+        return QImage(data, width, height, stride, QImage.Format_RGB888).copy()
+
+
 PhotoDetails = namedtuple('PhotoDetails', 'thumbnail, orientation')
 
 
@@ -229,11 +389,33 @@ class ThumbnailExtractor(LoadBalancerWorker):
     def __init__(self) -> None:
         self.thumbnailSizeNeeded = QSize(ThumbnailSize.width, ThumbnailSize.height)
         self.thumbnail_cache = ThumbnailCacheSql(create_table_if_not_exists=False)
+        self.metadata_cache = MetadataCacheSql()
         self.fdo_cache_large = FdoCacheLarge()
         self.fdo_cache_normal = FdoCacheNormal()
+        # Thumbnail rings that have been opened, by path
+        self.thumbnail_rings = {}  # type: Dict[str, Optional[ThumbnailRing]]
+        # GstVideo is needed to convert frames without encoding them as PNG
+        if have_gst_video:
+            self.video_frames = VideoFramePipeline()  # type: Optional[VideoFramePipeline]
+        else:
+            self.video_frames = None
 
         super().__init__('Thumbnail Extractor')
 
+    def get_thumbnail_ring(self, path: str) -> Optional[ThumbnailRing]:
+        """
+        :param path: path of the thumbnail ring
+        :return: the thumbnail ring, or None if it could not be opened
+        """
+
+        if path not in self.thumbnail_rings:
+            try:
+                self.thumbnail_rings[path] = ThumbnailRing(path)
+            except (OSError, ValueError) as e:
+                logging.error("Could not open thumbnail ring %s: %s", path, e)
+                self.thumbnail_rings[path] = None
+        return self.thumbnail_rings[path]
+
     def rotate_thumb(self, thumbnail: QImage, orientation: str) -> QImage:
         """
         If required return a rotated copy the thumbnail
@@ -258,6 +440,35 @@ class ThumbnailExtractor(LoadBalancerWorker):
             size.height() >= self.thumbnailSizeNeeded.height()
         )
 
+    def load_metadata(self, rpd_file: Union[Photo, Video],
+                      full_file_name: Optional[str]=None,
+                      raw_bytes: Optional[bytearray]=None,
+                      app1_segment: Optional[bytearray]=None,
+                      force_exiftool: bool=False) -> bool:
+        """
+        Load the file's metadata into the rpd file, using values in the
+        metadata cache where possible.
+
+        Values read from the file are added to the cache only when they
+        are read from the file itself or a complete copy of it.
+
+        :return: True if successful, False otherwise
+        """
+
+        complete = bool(full_file_name) and full_file_name in (
+            rpd_file.full_file_name, rpd_file.cache_full_file_name
+        )
+        if rpd_file.file_type == FileType.video:
+            return self.metadata_cache.load_metadata(
+                rpd_file, complete=complete, full_file_name=full_file_name,
+                et_process=self.exiftool_process
+            )
+        return self.metadata_cache.load_metadata(
+            rpd_file, complete=complete, full_file_name=full_file_name, raw_bytes=raw_bytes,
+            app1_segment=app1_segment, et_process=self.exiftool_process,
+            force_exiftool=force_exiftool
+        )
+
     def _extract_256_thumb(self, rpd_file: RPDFile,
                           processing: Set[ExtractionProcessing],
                           orientation: Optional[str]) -> PhotoDetails:
@@ -339,8 +550,8 @@ class ThumbnailExtractor(LoadBalancerWorker):
         orientation = None
         thumbnail = None
         photo_details = PhotoDetails(thumbnail, orientation)
-        if rpd_file.load_metadata(full_file_name=full_file_name, et_process=self.exiftool_process,
-                                  force_exiftool=force_exiftool):
+        if self.load_metadata(rpd_file, full_file_name=full_file_name,
+                              force_exiftool=force_exiftool):
 
             photo_details = self._extract_metadata(rpd_file, processing)
             thumbnail = photo_details.thumbnail
@@ -412,7 +623,7 @@ class ThumbnailExtractor(LoadBalancerWorker):
     def get_from_buffer(self, rpd_file: Photo,
                         raw_bytes: bytearray,
                         processing: Set[ExtractionProcessing]) -> PhotoDetails:
-        if not rpd_file.load_metadata(raw_bytes=raw_bytes, et_process=self.exiftool_process):
+        if not self.load_metadata(rpd_file, raw_bytes=raw_bytes):
             # logging.warning("Extractor failed to load metadata from extract of %s", rpd_file.name)
             return PhotoDetails(None, None)
         else:
@@ -475,13 +686,12 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
         if raw_bytes is not None:
             if rpd_file.is_jpeg_type():
-                rpd_file.load_metadata(app1_segment=raw_bytes, et_process=self.exiftool_process)
+                self.load_metadata(rpd_file, app1_segment=raw_bytes)
             else:
-                rpd_file.load_metadata(raw_bytes=raw_bytes, et_process=self.exiftool_process)
+                self.load_metadata(rpd_file, raw_bytes=raw_bytes)
         else:
-            rpd_file.load_metadata(
-                full_file_name=full_file_name, et_process=self.exiftool_process,
-                force_exiftool=force_exiftool
+            self.load_metadata(
+                rpd_file, full_file_name=full_file_name, force_exiftool=force_exiftool
             )
 
     def assign_video_mdatatime(self, rpd_file: Video, full_file_name: str) -> None:
@@ -490,7 +700,7 @@ class ThumbnailExtractor(LoadBalancerWorker):
         """
 
         if rpd_file.metadata is None:
-            rpd_file.load_metadata(full_file_name=full_file_name, et_process=self.exiftool_process)
+            self.load_metadata(rpd_file, full_file_name=full_file_name)
         if rpd_file.date_time() is None:
             rpd_file.mdatatime = 0.0
 
@@ -500,7 +710,7 @@ class ThumbnailExtractor(LoadBalancerWorker):
         """
 
         if rpd_file.metadata is None:
-            rpd_file.load_metadata(full_file_name=full_file_name, et_process=self.exiftool_process)
+            self.load_metadata(rpd_file, full_file_name=full_file_name)
         orientation = rpd_file.metadata.rotation(missing=None)
         if orientation == 180:
             return self.rotate_180
@@ -639,15 +849,19 @@ class ThumbnailExtractor(LoadBalancerWorker):
                 if not have_gst:
                     thumbnail = None
                 else:
-                    png = get_video_frame(data.full_file_name_to_work_on, 1.0)
-                    if not png:
-                        thumbnail = None
+                    if self.video_frames is not None:
+                        thumbnail = self.video_frames.get_frame(
+                            data.full_file_name_to_work_on, 1.0, self.maxStandardSize
+                        )
+                    else:
+                        png = get_video_frame(data.full_file_name_to_work_on, 1.0)
+                        thumbnail = QImage.fromData(png) if png else None
+                    if thumbnail is None:
                         logging.warning(
                             "Could not extract video thumbnail from %s",
                             data.rpd_file.get_display_full_name()
                         )
                     else:
-                        thumbnail = QImage.fromData(png)
                         if thumbnail.isNull():
                             thumbnail = None
                         else:
@@ -675,7 +889,7 @@ class ThumbnailExtractor(LoadBalancerWorker):
 
             data = pickle.loads(content)  # type: ThumbnailExtractorArgument
 
-            thumbnail_256 = png_data = None
+            thumbnail_256 = png_data = thumbnail_slot = None
             task = data.task
             processing = data.processing
             rpd_file = data.rpd_file
@@ -756,9 +970,16 @@ class ThumbnailExtractor(LoadBalancerWorker):
                         if thumbnail_256 is not None:
                             thumbnail = add_filmstrip(thumbnail_256)
 
-                    if thumbnail is not None:
-                        buffer = qimage_to_png_buffer(thumbnail)
-                        png_data = buffer.data()
+                    if thumbnail is not None and data.send_thumb_to_main:
+                        # Pass the thumbnail to the main process in shared memory if
+                        # there is room for it, else as a PNG in the message
+                        if data.thumbnail_ring is not None:
+                            ring = self.get_thumbnail_ring(data.thumbnail_ring)
+                            if ring is not None:
+                                thumbnail_slot = ring.write_image(thumbnail)
+                        if thumbnail_slot is None:
+                            buffer = qimage_to_png_buffer(thumbnail)
+                            png_data = buffer.data()
 
                     orientation_unknown = (
                         ExtractionProcessing.orient in processing and orientation is None
@@ -824,6 +1045,8 @@ class ThumbnailExtractor(LoadBalancerWorker):
                     else:
                         rpd_file.thumbnail_status = ThumbnailCacheStatus.ready
 
+                self.metadata_cache.record(rpd_file)
+
             except SystemExit as e:
                 self.exiftool_process.terminate()
                 sys.exit(e)
@@ -838,13 +1061,12 @@ class ThumbnailExtractor(LoadBalancerWorker):
                 png_data = None
             rpd_file.metadata = None
             self.sender.send_multipart(
-                [
-                    b'0', b'data',
-                    pickle.dumps(
-                        GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=png_data),
-                        pickle.HIGHEST_PROTOCOL
+                [b'0', b'data'] + encode_message(
+                    GenerateThumbnailsResults(
+                        rpd_file=rpd_file, thumbnail_bytes=png_data, thumbnail_slot=thumbnail_slot
                     )
-                ]
+                ),
+                copy=False
             )
             self.requester.send_multipart([b'', b'', b'OK'])
 
@@ -861,12 +1083,15 @@ class ThumbnailExtractor(LoadBalancerWorker):
             # In some situations, using a context manager for exiftool can
             # result in exiftool processes not being terminated. So let's
             # handle starting and terminating it manually.
-            self.exiftool_process = exiftool.ExifTool()
+            self.exiftool_process = get_exiftool()
             self.exiftool_process.start()
             self.process_files()
             self.exit()
 
     def cleanup_pre_stop(self) -> None:
+        self.metadata_cache.flush()
+        if self.video_frames is not None:
+            self.video_frames.close()
         logging.debug(
             "Terminating thumbnail extractor ExifTool process for %s", self.identity.decode()
         )
@@ -73,6 +73,7 @@ from raphodo.interprocess import (
     WorkerInPublishPullPipeline, GenerateThumbnailsArguments, GenerateThumbnailsResults,
     ThumbnailExtractorArgument
 )
+from raphodo.serialization import encode_message
 from raphodo.constants import (
     FileType, ThumbnailSize, ThumbnailCacheStatus, ThumbnailCacheDiskStatus, ExtractionTask,
     ExtractionProcessing, orientation_offset, thumbnail_offset, ThumbnailCacheOrigin,
@@ -212,7 +213,7 @@ class GetThumbnailFromCache:
         # Attempt to get thumbnail from Thumbnail Cache
         # (see cache.py for definitions of various caches)
         if self.thumbnail_cache is not None and use_thumbnail_cache:
-            get_thumbnail = self.thumbnail_cache.get_thumbnail_path(
+            get_thumbnail = self.thumbnail_cache.get_thumbnail_bytes(
                 full_file_name=rpd_file.full_file_name,
                 mtime=rpd_file.modification_time,
                 size=rpd_file.size,
@@ -230,8 +231,7 @@ class GetThumbnailFromCache:
                         rpd_file.thumbnail_status = ThumbnailCacheStatus.orientation_unknown
                     else:
                         rpd_file.thumbnail_status = ThumbnailCacheStatus.ready
-                    with open(get_thumbnail.path, 'rb') as thumbnail:
-                        thumbnail_bytes = thumbnail.read()
+                    thumbnail_bytes = get_thumbnail.thumbnail_bytes
 
         # Attempt to get thumbnail from large FDO Cache if not found in Thumbnail Cache
         # and it's not being downloaded directly from a camera (if it's from a camera, it's
@@ -255,6 +255,14 @@ class GetThumbnailFromCache:
 
         return task, thumbnail_bytes, full_file_name_to_work_on, origin
 
+    def flush(self) -> None:
+        """
+        Record in the thumbnail cache which thumbnails were used
+        """
+
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.flush_access_times()
+
 
 # How much of the file should be read in from local disk and thus cached
 # by they kernel
@@ -541,11 +549,11 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                     "Prematurely exiting thumbnail generation due to lack of access to camera %s",
                     arguments.camera
                 )
-                self.content = pickle.dumps(
+                self.content = encode_message(
                     GenerateThumbnailsResults(
                         scan_id=arguments.scan_id,
                         camera_removed=True,
-                    ), pickle.HIGHEST_PROTOCOL
+                    )
                 )
                 self.send_message_to_sink()
                 self.disconnect_logging()
@@ -575,11 +583,11 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                     prefix=cache_dir_name(self.device_name)
                 )
                 cache_dirs = CacheDirs(self.photo_cache_dir, self.video_cache_dir)
-                self.content = pickle.dumps(
+                self.content = encode_message(
                     GenerateThumbnailsResults(
                         scan_id=arguments.scan_id,
                         cache_dirs=cache_dirs
-                    ), pickle.HIGHEST_PROTOCOL
+                    )
                 )
                 self.send_message_to_sink()
 
@@ -596,9 +604,8 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                     len(rescan.missing_rpd_files), self.camera.display_name
                 )
                 for rpd_file in rescan.missing_rpd_files:  # type: RPDFile
-                    self.content = pickle.dumps(
-                        GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=None),
-                        pickle.HIGHEST_PROTOCOL
+                    self.content = encode_message(
+                        GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=None)
                     )
                     self.send_message_to_sink()
 
@@ -795,9 +802,8 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                             full_file_name_to_work_on = rpd_file.full_file_name
 
             if task == ExtractionTask.bypass:
-                self.content = pickle.dumps(
-                    GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=thumbnail_bytes),
-                    pickle.HIGHEST_PROTOCOL
+                self.content = encode_message(
+                    GenerateThumbnailsResults(rpd_file=rpd_file, thumbnail_bytes=thumbnail_bytes)
                 )
                 self.send_message_to_sink()
 
@@ -818,7 +824,8 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                         file_to_work_on_is_temporary=file_to_work_on_is_temporary,
                         write_fdo_thumbnail=False,
                         send_thumb_to_main=True,
-                        force_exiftool=force_exiftool
+                        force_exiftool=force_exiftool,
+                        thumbnail_ring=arguments.thumbnail_ring
                     ),
                     pickle.HIGHEST_PROTOCOL)
                 self.frontend.send_multipart([b'data', self.content])
@@ -833,6 +840,8 @@ class GenerateThumbnails(WorkerInPublishPullPipeline):
                 if not os.listdir(self.video_cache_dir):
                     os.rmdir(self.video_cache_dir)
 
+        thumbnail_caches.flush()
+
         logging.debug("Finished phase 1 of thumbnail generation for %s", self.device_name)
         if from_thumb_cache:
             logging.info(
@@ -0,0 +1,202 @@
+# Copyright (C) 2020 Damon Lynch <damonlynch@gmail.com>
+
+# This file is part of Rapid Photo Downloader.
+#
+# Rapid Photo Downloader is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rapid Photo Downloader is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Rapid Photo Downloader.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""
+Pass thumbnails from worker processes to the main process in shared memory.
+
+The main process creates a memory mapped file divided into fixed size slots.
+A worker process claims the next free slot, writes the thumbnail's pixels into
+it, and sends only the slot number to the main process. The main process
+creates its image from the pixels in the slot, and frees the slot.
+
+This avoids encoding the thumbnail as a PNG in the worker process, copying
+it into and out of a 0MQ message, and decoding the PNG in the main process.
+"""
+
+__author__ = 'Damon Lynch'
+__copyright__ = "Copyright 2020, Damon Lynch"
+
+import os
+import mmap
+import fcntl
+import struct
+import logging
+import tempfile
+from typing import Optional
+
+from PyQt5.QtGui import QImage
+from PyQt5 import sip
+
+
+class ThumbnailRing:
+    """
+    Fixed size slots in a memory mapped file, claimed in turn by the worker
+    processes writing thumbnails to them.
+
+    Slots are claimed while holding an exclusive lock on the file. A slot is
+    freed by the main process once it has read the thumbnail in it. If no slot
+    is free, or the thumbnail is too big for a slot, the thumbnail must be sent
+    to the main process some other way.
+    """
+
+    magic = b'RPDT'
+    # Magic, number of slots, size of each slot, next slot to claim
+    header = struct.Struct('<4sIII')
+    # State, width, height, bytes per line, image format, length of pixel data
+    slot_header = struct.Struct('<B3xIIIII')
+
+    free = 0
+    claimed = 1
+    filled = 2
+
+    # Formats that can be read without a color table
+    image_formats = (
+        QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied
+    )
+
+    def __init__(self, path: str, slots: int=0, slot_size: int=0) -> None:
+        """
+        Open the ring, creating it if the number of slots is given
+
+        :param path: path of the memory mapped file
+        :param slots: number of slots to create, or 0 to open an existing ring
+        :param slot_size: size of each slot in bytes, including its header
+        """
+
+        self.path = path
+        create = slots > 0
+        flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if create else 0)
+        self.fd = os.open(path, flags, 0o600)
+        try:
+            if create:
+                os.ftruncate(self.fd, self.header.size + slots * slot_size)
+            self.map = mmap.mmap(self.fd, 0)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+        if create:
+            self.header.pack_into(self.map, 0, self.magic, slots, slot_size, 0)
+        magic, self.slots, self.slot_size, _ = self.header.unpack_from(self.map)
+        if magic != self.magic:
+            self.close()
+            raise ValueError("{} is not a thumbnail ring".format(path))
+
+    @classmethod
+    def create(cls, slots: int=64, slot_size: int=272 * 1024) -> 'ThumbnailRing':
+        """
+        Create a ring in the shared memory file system if there is one, else
+        in the temporary directory
+
+        :param slots: number of slots in the ring
+        :param slot_size: size of each slot in bytes. The default is big
+         enough for a 256 x 256 pixel thumbnail.
+        :return: the new ring
+        """
+
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        fd, path = tempfile.mkstemp(prefix='rapid-photo-downloader-thumbnails-', dir=directory)
+        os.close(fd)
+        os.remove(path)
+        return cls(path, slots=slots, slot_size=slot_size)
+
+    def _offset(self, slot: int) -> int:
+        return self.header.size + slot * self.slot_size
+
+    def _claim_slot(self) -> Optional[int]:
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            next_slot = self.header.unpack_from(self.map)[3]
+            for i in range(self.slots):
+                slot = (next_slot + i) % self.slots
+                offset = self._offset(slot)
+                if self.map[offset] == self.free:
+                    self.map[offset] = self.claimed
+                    struct.pack_into('<I', self.map, 12, (slot + 1) % self.slots)
+                    return slot
+            return None
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def write_image(self, image: QImage) -> Optional[int]:
+        """
+        Write a thumbnail's pixels to the next free slot
+
+        :param image: the thumbnail
+        :return: the slot it was written to, or None if it could not be
+         written
+        """
+
+        if image.format() not in self.image_formats:
+            image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        length = image.byteCount()
+        if length > self.slot_size - self.slot_header.size:
+            return None
+
+        slot = self._claim_slot()
+        if slot is None:
+            return None
+
+        offset = self._offset(slot)
+        start = offset + self.slot_header.size
+        pixels = image.constBits()
+        pixels.setsize(length)
+        self.map[start:start + length] = memoryview(pixels)
+        self.slot_header.pack_into(
+            self.map, offset, self.filled, image.width(), image.height(), image.bytesPerLine(),
+            int(image.format()), length
+        )
+        return slot
+
+    def read_image(self, slot: int) -> Optional[QImage]:
+        """
+        Read a thumbnail from a slot, and free the slot
+
+        :param slot: the slot the thumbnail was written to
+        :return: the thumbnail, or None if the slot holds no thumbnail
+        """
+
+        offset = self._offset(slot)
+        state, width, height, bytes_per_line, image_format, length = \
+            self.slot_header.unpack_from(self.map, offset)
+        if state != self.filled:
+            logging.error("Thumbnail ring slot %s holds no thumbnail", slot)
+            return None
+
+        start = offset + self.slot_header.size
+        pixels = memoryview(self.map)[start:start + length]
+        try:
+            # Copy the pixels out of the slot, because the image would
+            # otherwise share the memory in the slot
+            image = QImage(
+                sip.voidptr(pixels), width, height, bytes_per_line, QImage.Format(image_format)
+            ).copy()
+        finally:
+            pixels.release()
+            self.map[offset] = self.free
+        return image
+
+    def close(self) -> None:
+        self.map.close()
+        os.close(self.fd)
+
+    def unlink(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
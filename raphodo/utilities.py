@@ -32,6 +32,8 @@ import sys
 import tempfile
 import time
 import tarfile
+import hashlib
+import math
 from collections import namedtuple, defaultdict
 
 from datetime import datetime
@@ -51,8 +53,14 @@ import arrow
 import psutil
 from PyQt5.QtCore import QSize, QLocale, QTranslator, QLibraryInfo
 
+try:
+    import xxhash
+    have_xxhash = True
+except ImportError:
+    have_xxhash = False
+
 import raphodo.__about__ as __about__
-from raphodo.constants import disable_version_check
+from raphodo.constants import disable_version_check, ChecksumAlgorithm
 from raphodo import localedir, i18n_domain
 
 
@@ -388,6 +396,59 @@ def same_device(file1: str, file2: str) -> bool:
     return dev1 == dev2
 
 
+def available_checksum_algorithm(algorithm: ChecksumAlgorithm) -> ChecksumAlgorithm:
+    """
+    Determine the checksum algorithm that will actually be used.
+
+    xxHash is used only if the Python module xxhash is installed. If it is not,
+    BLAKE2 is used, which is also faster than MD5 on 64 bit platforms.
+
+    :param algorithm: the algorithm the user prefers
+    :return: the algorithm to use
+    """
+
+    if algorithm == ChecksumAlgorithm.xxh64 and not have_xxhash:
+        return ChecksumAlgorithm.blake2b
+    return algorithm
+
+
+def new_checksum(algorithm: ChecksumAlgorithm):
+    """
+    Create an object to incrementally calculate a checksum, with the same
+    update() and hexdigest() interface as the objects in hashlib.
+
+    :param algorithm: the checksum algorithm, which must be available
+    :return: the checksum object
+    """
+
+    if algorithm == ChecksumAlgorithm.xxh64:
+        return xxhash.xxh64()
+    elif algorithm == ChecksumAlgorithm.blake2b:
+        return hashlib.blake2b()
+    else:
+        return hashlib.md5()
+
+
+def file_checksum(full_file_name: str,
+                  algorithm: ChecksumAlgorithm,
+                  chunk_size: int=1024 * 1024) -> str:
+    """
+    Calculate the checksum of a file, reading it in chunks so that memory use is
+    constant regardless of the size of the file.
+
+    :param full_file_name: file to read
+    :param algorithm: the checksum algorithm, which must be available
+    :param chunk_size: number of bytes to read at a time
+    :return: the checksum in hexadecimal format
+    """
+
+    checksum = new_checksum(algorithm)
+    with open(full_file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
 def find_mount_point(path: str) -> str:
     """
     Find the mount point of a path
@@ -471,6 +532,45 @@ def thousands(i: int) -> str:
         return i
 
 
+class BloomFilter:
+    """
+    Space efficient test of whether a value is in a set. There are no false
+    negatives, but there are false positives at approximately the error rate
+    (assuming the number of values added does not exceed the capacity).
+
+    Uses Python's built in hash(), so a filter is meaningful only within the
+    process that created it.
+
+    >>> b = BloomFilter(capacity=100)
+    >>> b.add(('IMG_0001.CR2', 25374521))
+    >>> ('IMG_0001.CR2', 25374521) in b
+    True
+    """
+
+    def __init__(self, capacity: int, error_rate: float=0.01) -> None:
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: Any) -> Iterator[int]:
+        # Double hashing: derive all the hash functions from one 64 bit hash
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value: Any) -> None:
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: Any) -> bool:
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value)
+        )
+
+
 # Source of class AdjacentKey, first_and_last and runs:
 # http://stupidpythonideas.blogspot.com/2014/01/grouping-into-runs-of-adjacent-values.html
 class AdjacentKey: